@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# License: BSD/GPL2
+
+"""Time planning pipelines (base.plug) for growing synthetic setups.
+
+Every size gets that many feed types, sinks spread over all of them,
+a chain of transforms connecting the feed types plus random shortcuts
+(size * 3 transforms in total) and a few sources.  Plans are not cached
+between runs.  Run from the top of the source tree:
+
+    python benchmarks/bench_plug.py --sizes 2,4,6,8,10
+"""
+
+import optparse
+import random
+import time
+
+from pkgcore_checks import base
+
+
+class Source(object):
+
+    def __init__(self, feed_type, scope, cost):
+        self.feed_type = feed_type
+        self.scope = scope
+        self.cost = cost
+
+
+class Sink(base.Template):
+
+    def __init__(self, feed_type, scope):
+        base.Template.__init__(self, None)
+        self.feed_type = feed_type
+        self.scope = scope
+
+
+def make_transform(source, dest, scope, cost, name):
+    return type(name, (base.Transform,), dict(
+        source=source, dest=dest, scope=scope, cost=cost))
+
+
+def make_setup(size, rand):
+    feed_types = list('type-%i' % (i,) for i in xrange(size))
+    transforms = []
+    for i in xrange(size - 1):
+        transforms.append(make_transform(
+            feed_types[i], feed_types[i + 1], base.version_scope,
+            rand.randint(1, 20), 'Chain%i' % (i,)))
+    while len(transforms) < size * 3:
+        transforms.append(make_transform(
+            rand.choice(feed_types), rand.choice(feed_types),
+            rand.randint(base.version_scope, base.repository_scope),
+            rand.randint(1, 20), 'Random%i' % (len(transforms),)))
+    sinks = list(
+        Sink(rand.choice(feed_types),
+             rand.randint(base.version_scope, base.repository_scope))
+        for i in xrange(size * 10))
+    sources = [Source(feed_types[0], base.repository_scope, 10)]
+    sources.extend(
+        Source(rand.choice(feed_types),
+               rand.randint(base.version_scope, base.repository_scope),
+               rand.randint(1, 20))
+        for i in xrange(2))
+    return sinks, transforms, sources
+
+
+def main():
+    parser = optparse.OptionParser(description=__doc__.split('\n')[0])
+    parser.add_option(
+        '--sizes', default='2,4,6,8,10',
+        help='comma separated numbers of feed types (default %default)')
+    parser.add_option(
+        '--repeat', type='int', default=5,
+        help='setups timed per size, the best time is shown '
+        '(default %default)')
+    parser.add_option(
+        '--seed', type='int', default=0,
+        help='seed for generating the setups (default %default)')
+    options, args = parser.parse_args()
+    if args:
+        parser.error('takes no arguments')
+    rand = random.Random(options.seed)
+    print '%6s %6s %11s %8s %10s' % (
+        'types', 'sinks', 'transforms', 'sources', 'best(ms)')
+    for size in (int(x) for x in options.sizes.split(',')):
+        best = None
+        for i in xrange(options.repeat):
+            sinks, transforms, sources = make_setup(size, rand)
+            start = time.time()
+            base.plug(sinks, transforms, sources, plans=base.PlanCache())
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        print '%6i %6i %11i %8i %10.2f' % (
+            size, len(sinks), len(transforms), len(sources), best * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,29 +4,36 @@
 
 """Addon functionality shared by multiple checkers."""
 
+import copy
 from functools import partial
 import optparse
-from itertools import ifilter, ifilterfalse
+from itertools import chain, ifilter, ifilterfalse
 
 from snakeoil.containers import ProtectedSet
 from snakeoil.demandload import demandload
 from snakeoil.iterables import expandable_chain
 from snakeoil.lists import iflatten_instance
-from snakeoil.mappings import OrderedDict
+from snakeoil.mappings import LazyValDict, OrderedDict
 from snakeoil.osutils import abspath, listdir_files, pjoin
 
-from pkgcore_checks import base
+from pkgcore_checks import base, errors, metrics
 
 demandload(
+    'multiprocessing',
     'os',
+    'pkgcore_checks:profile_cache',
+    'pkgcore.ebuild:atom,cpv',
+    'pkgcore.repository.util:SimpleTree',
     'pkgcore.restrictions:packages,values',
-    'pkgcore.ebuild:misc,domain,profiles,repo_objs',
+    'pkgcore.ebuild:misc,profiles,repo_objs',
     'pkgcore.log:logger',
 )
 
 
 class ArchesAddon(base.Addon):
 
+    fingerprint_options = ('arches',)
+
     default_arches = tuple(sorted([
         "alpha", "amd64", "arm", "arm64", "hppa", "ia64", "m68k", "mips",
         "ppc", "ppc64", "s390", "sh", "sparc", "x86",
@@ -56,6 +63,34 @@ class ArchesAddon(base.Addon):
             help="comma separated list of arches to disable from the defaults")
 
 
+query_cache_lookups = metrics.registry.counter(
+    'pcheck_query_cache_lookups_total',
+    'Lookups of dependency atoms in the query cache.', ('result',))
+query_cache_entries = metrics.registry.histogram(
+    'pcheck_query_cache_entries',
+    'Entries in the query cache when it gets cleared.',
+    (10, 100, 1000, 10000, 100000))
+depset_cache_lookups = metrics.registry.counter(
+    'pcheck_depset_cache_lookups_total',
+    'Lookups in the per version caches of EvaluateDepSetAddon.',
+    ('cache', 'result'))
+profile_cache_lookups = metrics.registry.counter(
+    'pcheck_profile_cache_lookups_total',
+    'Lookups of dependency atoms in the per profile visibility caches.',
+    ('cache', 'result'))
+global_insoluble_lookups = metrics.registry.counter(
+    'pcheck_global_insoluble_lookups_total',
+    'Lookups of dependency atoms in the insoluble atoms shared by all '
+    'profiles.', ('result',))
+profile_data_cache_lookups = metrics.registry.counter(
+    'pcheck_profile_data_cache_lookups_total',
+    'Lookups of the parsed data of a profile in the on disk profile cache.',
+    ('result',))
+global_insoluble_entries = metrics.registry.gauge(
+    'pcheck_global_insoluble_entries',
+    'Atoms in the insoluble atoms shared by all profiles.')
+
+
 class QueryCacheAddon(base.Template):
 
     priority = 1
@@ -86,15 +121,87 @@ class QueryCacheAddon(base.Template):
 
     def feed(self, item, reporter):
         # XXX as should this.
+        query_cache_entries.observe(len(self.query_cache))
         self.query_cache.clear()
 
 
+class mask_filter(object):
+
+    """Visibility filter of the package.mask/unmask entries of a profile.
+
+    Matches what C{domain.generate_filter(masks, unmasks, keywords)} does,
+    but the masks and unmasks of a package key are kept together in one
+    dict, so a package nothing masks specifically costs a single lookup.
+    Entries not tied to a package key are checked for every package.
+    """
+
+    __slots__ = ('index', 'global_masks', 'global_unmasks', 'keywords')
+
+    _empty = ((), ())
+
+    def __init__(self, masks, unmasks, keywords=None):
+        """Initialize.
+
+        :param masks: the package.mask restrictions.
+        :param unmasks: the package.unmask restrictions.
+        :param keywords: C{None} or a restriction packages must also match,
+            evaluated last (it pulls in the metadata).
+        """
+        index = {}
+        global_masks = []
+        global_unmasks = []
+        for restricts, pos, global_restricts in (
+                (masks, 0, global_masks), (unmasks, 1, global_unmasks)):
+            for restrict in restricts:
+                if isinstance(restrict, atom.atom):
+                    index.setdefault(restrict.key, ([], []))[pos].append(
+                        restrict)
+                else:
+                    global_restricts.append(restrict)
+        self.index = dict(
+            (key, (tuple(key_masks), tuple(key_unmasks)))
+            for key, (key_masks, key_unmasks) in index.iteritems())
+        self.global_masks = tuple(global_masks)
+        self.global_unmasks = tuple(global_unmasks)
+        self.keywords = keywords
+
+    def restrict(self, keywords):
+        """Return a filter sharing the masks of this one, for keywords."""
+        obj = self.__class__((), ())
+        obj.index = self.index
+        obj.global_masks = self.global_masks
+        obj.global_unmasks = self.global_unmasks
+        obj.keywords = keywords
+        return obj
+
+    def match(self, pkg):
+        masks, unmasks = self.index.get(pkg.key, self._empty)
+        for restrict in chain(self.global_masks, masks):
+            if restrict.match(pkg):
+                # unmasking only applies to masked packages.
+                for restrict in chain(self.global_unmasks, unmasks):
+                    if restrict.match(pkg):
+                        break
+                else:
+                    return False
+                break
+        return self.keywords is None or self.keywords.match(pkg)
+
+
 class profile_data(object):
 
+    """The data of a profile for a keyword.
+
+    :ivar members: the profiles (this one first) with the same visibility
+        inputs, evaluated through this one; empty for the other members of
+        its class.  See L{ProfileAddon}.
+    """
+
     def __init__(self, profile_name, key, provides, vfilter,
                  iuse_effective, masked_use, forced_use, lookup_cache, insoluble):
         self.key = key
         self.name = profile_name
+        self.members = [self]
         self.provides_repo = provides
         self.provides_has_match = getattr(provides, 'has_match', provides.match)
         self.iuse_effective = iuse_effective
@@ -104,6 +211,17 @@ class profile_data(object):
         self.insoluble = insoluble
         self.visible = vfilter.match
 
+    def equivalent(self, profile_name):
+        """Add profile_name as a member sharing all the data of this one.
+
+        :return: the profile_data of profile_name.
+        """
+        member = copy.copy(self)
+        member.name = profile_name
+        member.members = ()
+        self.members.append(member)
+        return member
+
     def identify_use(self, pkg, known_flags):
         # note we're trying to be *really* careful about not creating
         # pointless intermediate sets unless required
@@ -117,8 +235,115 @@ class profile_data(object):
         return immutable, enabled
 
 
+def _flags_key(flags):
+    """Return a hashable key of the contents of a frozen C{ChunkedDataDict}."""
+    items, global_settings = profile_cache.dump_flags(flags)
+    return tuple(sorted(items)), global_settings
+
+
+def _profile_flags(profile, stable_key, default_masked_use, chunked_data_cache):
+    """Return the masked and forced use flags of profile for stable_key.
+
+    :return: the frozen unstable masked, stable masked, unstable forced and
+        stable forced C{ChunkedDataDict}s.
+    """
+    immutable_flags = profile.masked_use.clone(unfreeze=True)
+    immutable_flags.add_bare_global((), default_masked_use)
+    immutable_flags.optimize(cache=chunked_data_cache)
+    immutable_flags.freeze()
+
+    stable_immutable_flags = profile.stable_masked_use.clone(unfreeze=True)
+    stable_immutable_flags.add_bare_global((), default_masked_use)
+    stable_immutable_flags.optimize(cache=chunked_data_cache)
+    stable_immutable_flags.freeze()
+
+    enabled_flags = profile.forced_use.clone(unfreeze=True)
+    enabled_flags.add_bare_global((), (stable_key,))
+    enabled_flags.optimize(cache=chunked_data_cache)
+    enabled_flags.freeze()
+
+    stable_enabled_flags = profile.stable_forced_use.clone(unfreeze=True)
+    stable_enabled_flags.add_bare_global((), (stable_key,))
+    stable_enabled_flags.optimize(cache=chunked_data_cache)
+    stable_enabled_flags.freeze()
+
+    return (immutable_flags, stable_immutable_flags, enabled_flags,
+            stable_enabled_flags)
+
+
+# What the profile loading workers inherit: the profiles object, the list
+# of (profile name, profile or None, stable key, default masked use) tasks,
+# the ProfileCache (or None), whether to skip deprecated profiles and the
+# chunked data cache of the worker.
+_worker_state = None
+
+
+def _load_profile(index):
+    """Load the profile of task index in a worker process.
+
+    :return: C{None} for a skipped deprecated profile, else the stamp,
+        whether the data came from the cache, the cache data (flags as
+        returned by L{profile_cache.dump_flags}) and the cpvs the profile
+        provides.
+    """
+    profile_name = _worker_state[1][index][0]
+    try:
+        return _load_profile_data(index)
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except Exception, e:
+        # pkgcore's exceptions do not survive the trip back to the pool.
+        raise errors.FatalError(
+            'failed loading profile %s: %s' % (profile_name, e))
+
+
+def _load_profile_data(index):
+    profiles_obj, tasks, cache, ignore_deprecated, chunked_data_cache = \
+        _worker_state
+    profile_name, profile, stable_key, default_masked_use = tasks[index]
+    if profile is None:
+        profile = profiles_obj.create_profile(profile_name)
+    if ignore_deprecated and profile.deprecated:
+        return None
+    stamp = data = None
+    if cache is not None:
+        stamp = profile_cache.profile_stamp(profile)
+        data = cache.get(
+            (profile_name, stable_key, tuple(sorted(default_masked_use))),
+            stamp)
+    hit = data is not None
+    if not hit:
+        data = (profile.masks, profile.unmasks, profile.iuse_effective, tuple(
+            profile_cache.dump_flags(x) for x in _profile_flags(
+                profile, stable_key, default_masked_use, chunked_data_cache)))
+    provided = tuple(sorted(pkg.cpvstr for pkg in profile.provides_repo))
+    return stamp, hit, data, provided
+
+
+def _provides_repo(provided):
+    """Rebuild the provides repo of a profile from the cpvs it provides."""
+    d = {}
+    for pkg in (cpv.versioned_CPV(x) for x in provided):
+        d.setdefault(pkg.category, {}).setdefault(
+            pkg.package, []).append(pkg.fullver)
+    intermediate_parent = profiles.PkgProvidedParent()
+    repo = SimpleTree(
+        d, pkg_klass=partial(profiles.PkgProvided, intermediate_parent),
+        livefs=True, frozen=True, repo_id='provided')
+    intermediate_parent._parent_repo = repo
+    return repo
+
+
 class ProfileAddon(base.Addon):
 
+    # layout.conf has the profile-formats the profiles are parsed with.
+    source_paths = ('profiles', 'metadata/layout.conf')
+    source_options = ('profiles_dir',)
+    fingerprint_options = (
+        'arches', 'profiles_dir', 'profiles_enabled', 'profiles_disabled',
+        'profiles_desc_enabled', 'profile_ignore_dev', 'profile_ignore_exp',
+        'profile_ignore_deprecated')
+
     @staticmethod
     def check_values(values):
         if values.profiles_enabled is None:
@@ -134,6 +359,10 @@ class ProfileAddon(base.Addon):
                     "profile-base location %r doesn't exist/isn't a dir" % (
                         profiles_dir,))
         values.profiles_dir = profiles_dir
+        if not values.profile_cache:
+            values.profile_cache_dir = None
+        elif values.profile_cache_dir is None:
+            values.profile_cache_dir = profile_cache.default_location()
 
     @staticmethod
     def _record_profiles(option, opt_str, value, parser):
@@ -173,6 +402,15 @@ class ProfileAddon(base.Addon):
             '--disable-profiles', action='callback', callback=cls._record_profiles,
             dest='profiles_disabled', type='string',
             help="comma separated list of profiles to ignore")
+        group.add_option(
+            '--profile-cache-dir', action='store', type='string',
+            default=None, metavar='DIR',
+            help="directory to cache the parsed profiles in, defaults to "
+            "$XDG_CACHE_HOME/pkgcore-checks/profiles")
+        group.add_option(
+            '--no-profile-cache', action='store_false', dest='profile_cache',
+            default=True,
+            help="neither use nor update the on disk cache of parsed profiles")
 
     def __init__(self, options, *args):
         base.Addon.__init__(self, options)
@@ -221,18 +459,23 @@ class ProfileAddon(base.Addon):
             self.desired_arches = set(self.official_arches)
 
         self.global_insoluble = set()
-        profile_filters = {}
         self.keywords_filter = {}
-        ignore_deprecated = self.options.profile_ignore_deprecated
-
-        # we hold onto the profiles as we're going, due to the fact
-        # profilenodes are weakly cached; hold onto all for this loop,
-        # avoids a lot of reparsing at the expense of slightly more memory
-        # temporarily.
-        cached_profiles = []
-
-        chunked_data_cache = {}
 
+        self._cache = None
+        if options.profile_cache_dir is not None:
+            self._cache = profile_cache.ProfileCache(
+                options.profile_cache_dir, options.profiles_obj.profile_base)
+        self._chunked_data_cache = {}
+        self._shared_chunks = {}
+        # profiles created by earlier loads; profile nodes are weakly
+        # cached, holding onto them saves reparsing the parents a later
+        # keyword shares.
+        self._profiles = {}
+
+        # the (profile name, profile or None, default masked use) of the
+        # profiles of each stable keyword, loaded on first use.
+        self._tasks = {}
+        self._keyword_restricts = {}
         for k in self.desired_arches:
             if k.lstrip("~") not in self.desired_arches:
                 continue
@@ -242,82 +485,157 @@ class ProfileAddon(base.Addon):
                 values.ContainmentMatch(stable_key))
             unstable_r = packages.PackageRestriction("keywords",
                 values.ContainmentMatch(stable_key, unstable_key))
+            self._keyword_restricts[stable_key] = (stable_r, unstable_r)
 
             default_masked_use = tuple(set(x for x in self.official_arches
                                            if x != stable_key))
 
-            profile_filters.update({stable_key: [], unstable_key: []})
+            tasks = self._tasks[stable_key] = []
             for profile_name in arch_profiles.get(k, []):
+                profile = None
                 if not isinstance(profile_name, basestring):
                     profile_name, profile = profile_name
-                else:
-                    profile = options.profiles_obj.create_profile(profile_name)
-                    cached_profiles.append(profile)
-                if ignore_deprecated and profile.deprecated:
-                    continue
-
-                vfilter = domain.generate_filter(profile.masks, profile.unmasks)
-
-                immutable_flags = profile.masked_use.clone(unfreeze=True)
-                immutable_flags.add_bare_global((), default_masked_use)
-                immutable_flags.optimize(cache=chunked_data_cache)
-                immutable_flags.freeze()
-
-                stable_immutable_flags = profile.stable_masked_use.clone(unfreeze=True)
-                stable_immutable_flags.add_bare_global((), default_masked_use)
-                stable_immutable_flags.optimize(cache=chunked_data_cache)
-                stable_immutable_flags.freeze()
-
-                enabled_flags = profile.forced_use.clone(unfreeze=True)
-                enabled_flags.add_bare_global((), (stable_key,))
-                enabled_flags.optimize(cache=chunked_data_cache)
-                enabled_flags.freeze()
-
-                stable_enabled_flags = profile.stable_forced_use.clone(unfreeze=True)
-                stable_enabled_flags.add_bare_global((), (stable_key,))
-                stable_enabled_flags.optimize(cache=chunked_data_cache)
-                stable_enabled_flags.freeze()
-
-                # used to interlink stable/unstable lookups so that if
-                # unstable says it's not visible, stable doesn't try
-                # if stable says something is visible, unstable doesn't try.
-                stable_cache = set()
-                unstable_insoluble = ProtectedSet(self.global_insoluble)
-
-                # few notes.  for filter, ensure keywords is last, on the
-                # offchance a non-metadata based restrict foregos having to
-                # access the metadata.
-                # note that the cache/insoluble are inversly paired;
-                # stable cache is usable for unstable, but not vice versa.
-                # unstable insoluble is usable for stable, but not vice versa
-
-                profile_filters[stable_key].append(profile_data(
-                    profile_name, stable_key,
-                    profile.provides_repo,
-                    packages.AndRestriction(vfilter, stable_r),
-                    profile.iuse_effective,
-                    stable_immutable_flags, stable_enabled_flags,
-                    stable_cache,
-                    ProtectedSet(unstable_insoluble)))
-
-                profile_filters[unstable_key].append(profile_data(
-                    profile_name, unstable_key,
-                    profile.provides_repo,
-                    packages.AndRestriction(vfilter, unstable_r),
-                    profile.iuse_effective,
-                    immutable_flags, enabled_flags,
-                    ProtectedSet(stable_cache),
-                    unstable_insoluble))
+                tasks.append((profile_name, profile, default_masked_use))
 
             self.keywords_filter[stable_key] = stable_r
             self.keywords_filter[unstable_key] = packages.PackageRestriction(
                 "keywords",
                 values.ContainmentMatch(unstable_key))
 
-        profile_evaluate_dict = {}
+        self.arch_profiles = arch_profiles
+        self.keywords_filter = OrderedDict(
+            (k, self.keywords_filter[k])
+            for k in sorted(self.keywords_filter))
+
+        # the profiles of a keyword are only loaded once something asks for
+        # them, so scanning a few packages only pays for their keywords.
+        self._loaded = {}
+        # a failed load is fatal, and stays so for this instance instead
+        # of being retried by every package asking for the profiles.
+        self._load_error = None
+        self.profile_filters = LazyValDict(
+            self.keywords_filter, self._get_profile_filters)
+        self.profile_evaluate_dict = LazyValDict(
+            self.keywords_filter, self._get_profile_groups)
+        if getattr(options, 'jobs', 1) > 1:
+            # full scans in forked processes; load everything at once (in a
+            # process pool), instead of once per scanning process.
+            self._load_keywords(sorted(self._tasks))
+            self.save_cache()
+
+    def _get_profile_filters(self, key):
+        self._ensure_loaded(key)
+        return self._loaded[key][0]
+
+    def _get_profile_groups(self, key):
+        self._ensure_loaded(key)
+        return self._loaded[key][1]
+
+    def _ensure_loaded(self, key):
+        """Load the profiles of keyword key unless done already.
+
+        :raise errors.FatalError: if loading the profiles fails (now or
+            at an earlier call).
+        """
+        if key in self._loaded:
+            return
+        if self._load_error is not None:
+            raise self._load_error
+        try:
+            self._load_keywords([key.lstrip("~")])
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception, e:
+            self._load_error = errors.FatalError(
+                'failed loading the profiles: %s' % (e,))
+            raise self._load_error
+
+    def _load_keywords(self, stable_keys):
+        """Load the profiles of stable_keys and their unstable keywords."""
+        tasks = [(profile_name, profile, stable_key, default_masked_use)
+                 for stable_key in stable_keys
+                 for profile_name, profile, default_masked_use
+                 in self._tasks[stable_key]]
+        jobs = min(getattr(self.options, 'jobs', 1), len(tasks))
+        if jobs > 1:
+            loaded = self._load_profiles_pooled(tasks, jobs)
+        else:
+            loaded = self._load_profiles(tasks)
+
+        profile_filters = {}
+        for stable_key in stable_keys:
+            profile_filters.update({stable_key: [], "~" + stable_key: []})
+
+        # profiles with the same visibility inputs for a keyword (a lot of
+        # the desktop/server/... subprofiles) are collapsed into equivalence
+        # classes; only the first profile of a class gets evaluated, the
+        # results are reported for every member.
+        classes = {}
+        for task, result in zip(tasks, loaded):
+            if result is None:
+                continue
+            profile_name, _, stable_key, _ = task
+            unstable_key = "~" + stable_key
+            stable_r, unstable_r = self._keyword_restricts[stable_key]
+            masks, unmasks, iuse_effective, flags, provides_repo = result
+            (immutable_flags, stable_immutable_flags, enabled_flags,
+             stable_enabled_flags) = flags
+
+            fingerprint = (
+                stable_key, frozenset(masks), frozenset(unmasks),
+                frozenset(iuse_effective),
+                tuple(sorted(pkg.cpvstr for pkg in provides_repo)),
+                tuple(_flags_key(x) for x in flags))
+            equivalent = classes.get(fingerprint)
+            if equivalent is not None:
+                for profile in equivalent:
+                    profile_filters[profile.key].append(
+                        profile.equivalent(profile_name))
+                continue
+
+            vfilter = mask_filter(masks, unmasks)
+
+            # used to interlink stable/unstable lookups so that if
+            # unstable says it's not visible, stable doesn't try
+            # if stable says something is visible, unstable doesn't try.
+            stable_cache = set()
+            unstable_insoluble = ProtectedSet(self.global_insoluble)
+
+            # few notes.  for filter, ensure keywords is last, on the
+            # offchance a non-metadata based restrict foregos having to
+            # access the metadata.
+            # note that the cache/insoluble are inversly paired;
+            # stable cache is usable for unstable, but not vice versa.
+            # unstable insoluble is usable for stable, but not vice versa
+
+            stable_profile = profile_data(
+                profile_name, stable_key,
+                provides_repo,
+                vfilter.restrict(stable_r),
+                iuse_effective,
+                stable_immutable_flags, stable_enabled_flags,
+                stable_cache,
+                ProtectedSet(unstable_insoluble))
+
+            unstable_profile = profile_data(
+                profile_name, unstable_key,
+                provides_repo,
+                vfilter.restrict(unstable_r),
+                iuse_effective,
+                immutable_flags, enabled_flags,
+                ProtectedSet(stable_cache),
+                unstable_insoluble)
+
+            classes[fingerprint] = (stable_profile, unstable_profile)
+            profile_filters[stable_key].append(stable_profile)
+            profile_filters[unstable_key].append(unstable_profile)
+
         for key, profile_list in profile_filters.iteritems():
-            similar = profile_evaluate_dict[key] = []
+            similar = []
             for profile in profile_list:
+                if not profile.members:
+                    # evaluated through the first profile of its class.
+                    continue
                 for existing in similar:
                     if existing[0].masked_use == profile.masked_use and \
                             existing[0].forced_use == profile.forced_use:
@@ -325,13 +643,121 @@ class ProfileAddon(base.Addon):
                         break
                 else:
                     similar.append([profile])
+            self._loaded[key] = (profile_list, similar)
 
-        self.profile_evaluate_dict = profile_evaluate_dict
-        self.arch_profiles = arch_profiles
-        self.keywords_filter = OrderedDict(
-            (k, self.keywords_filter[k])
-            for k in sorted(self.keywords_filter))
-        self.profile_filters = profile_filters
+    def save_cache(self):
+        """Write out the profile data cache, if it got anything new.
+
+        Called once loading is done, that is after scanning as the profiles
+        of a keyword are loaded on first use.
+        """
+        if self._cache is not None:
+            self._cache.save()
+
+    def _load_profiles(self, tasks):
+        """Load the profiles of tasks in this process.
+
+        :return: a list with, per task, C{None} for a skipped deprecated
+            profile, else the masks, unmasks, iuse effective, use flags (as
+            returned by L{_profile_flags}) and provides repo of the profile.
+        """
+        ignore_deprecated = self.options.profile_ignore_deprecated
+        cache = self._cache
+        loaded = []
+        for profile_name, profile, stable_key, default_masked_use in tasks:
+            if profile is None:
+                profile = self._profiles.get(profile_name)
+            if profile is None:
+                profile = self._profiles[profile_name] = \
+                    self.options.profiles_obj.create_profile(profile_name)
+            if ignore_deprecated and profile.deprecated:
+                loaded.append(None)
+                continue
+
+            cached = None
+            if cache is not None:
+                cache_key = (profile_name, stable_key,
+                             tuple(sorted(default_masked_use)))
+                stamp = profile_cache.profile_stamp(profile)
+                cached = cache.get(cache_key, stamp)
+                profile_data_cache_lookups.inc(
+                    1, ('miss' if cached is None else 'hit',))
+            if cached is not None:
+                masks, unmasks, iuse_effective, flags = cached
+                flags = tuple(
+                    profile_cache.load_flags(x, self._shared_chunks)
+                    for x in flags)
+            else:
+                masks = profile.masks
+                unmasks = profile.unmasks
+                iuse_effective = profile.iuse_effective
+                flags = _profile_flags(
+                    profile, stable_key, default_masked_use,
+                    self._chunked_data_cache)
+                if cache is not None:
+                    cache.add(cache_key, stamp, (
+                        masks, unmasks, iuse_effective,
+                        tuple(profile_cache.dump_flags(x) for x in flags)))
+            loaded.append((masks, unmasks, iuse_effective, flags,
+                           profile.provides_repo))
+        return loaded
+
+    def _load_profiles_pooled(self, tasks, jobs):
+        """Load the profiles of tasks using jobs worker processes.
+
+        Returns the same as L{_load_profiles}.  The workers ship the use
+        flags back as L{profile_cache.dump_flags} tuples; identical chunks
+        are shared again while loading them, like the chunked data cache
+        of a serial load does.
+        """
+        global _worker_state
+        cache = self._cache
+        if cache is not None and cache.entries is None:
+            # read it once, before the workers fork.
+            cache.load()
+        _worker_state = (self.options.profiles_obj, tasks, cache,
+                         self.options.profile_ignore_deprecated, {})
+        try:
+            pool = multiprocessing.Pool(jobs)
+        finally:
+            _worker_state = None
+
+        provides_repos = {}
+        loaded = []
+        try:
+            # imap keeps the task order.
+            results = pool.imap(_load_profile, xrange(len(tasks)))
+            for task, result in zip(tasks, results):
+                if result is None:
+                    loaded.append(None)
+                    continue
+                stamp, hit, data, provided = result
+                if cache is not None:
+                    profile_name, _, stable_key, default_masked_use = task
+                    profile_data_cache_lookups.inc(
+                        1, ('hit' if hit else 'miss',))
+                    if not hit:
+                        cache.add(
+                            (profile_name, stable_key,
+                             tuple(sorted(default_masked_use))),
+                            stamp, data)
+                masks, unmasks, iuse_effective, flags = data
+                flags = tuple(
+                    profile_cache.load_flags(x, self._shared_chunks)
+                    for x in flags)
+                provides_repo = provides_repos.get(provided)
+                if provides_repo is None:
+                    provides_repo = provides_repos[provided] = \
+                        _provides_repo(provided)
+                loaded.append((masks, unmasks, iuse_effective, flags,
+                               provides_repo))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return loaded
 
     def identify_profiles(self, pkg):
         # yields groups of profiles; the 'groups' are grouped by the ability to share
@@ -368,15 +794,21 @@ class EvaluateDepSetAddon(base.Template):
     def collapse_evaluate_depset(self, pkg, attr, depset):
         depset_profiles = self.pkg_evaluate_depsets_cache.get((pkg, attr))
         if depset_profiles is None:
+            depset_cache_lookups.inc(1, ('evaluate_depsets', 'miss'))
             depset_profiles = self.identify_common_depsets(pkg, depset)
             self.pkg_evaluate_depsets_cache[(pkg, attr)] = depset_profiles
+        else:
+            depset_cache_lookups.inc(1, ('evaluate_depsets', 'hit'))
         return depset_profiles
 
     def identify_common_depsets(self, pkg, depset):
         profile_grps = self.pkg_profiles_cache.get(pkg, None)
         if profile_grps is None:
+            depset_cache_lookups.inc(1, ('profiles', 'miss'))
             profile_grps = self.profiles.identify_profiles(pkg)
             self.pkg_profiles_cache[pkg] = profile_grps
+        else:
+            depset_cache_lookups.inc(1, ('profiles', 'hit'))
 
         # strip use dep defaults so known flags get identified correctly
         diuse = frozenset([x[:-3] if x[-1] == ')' else x
@@ -394,6 +826,9 @@ class StableCheckAddon(base.Template):
 
     """Check relating to stable arches by default."""
 
+    source_paths = ('profiles',)
+    fingerprint_options = ('arches',)
+
     def __init__(self, options, *args):
         super(StableCheckAddon, self).__init__(self, options)
 
@@ -405,6 +840,10 @@ class StableCheckAddon(base.Template):
 
 class LicenseAddon(base.Addon):
 
+    source_paths = ('licenses',)
+    source_options = ('license_dirs',)
+    fingerprint_options = ('license_dirs',)
+
     @staticmethod
     def mangle_option_parser(parser):
         parser.add_option(
@@ -459,6 +898,7 @@ class UnstatedIUSE(base.Result):
 class UseAddon(base.Addon):
 
     known_results = (UnstatedIUSE,)
+    source_paths = ('profiles',)
 
     def __init__(self, options, silence_warnings=False):
         base.Addon.__init__(self, options)
@@ -15,22 +15,37 @@ minimally accepted scope, and for transforms the output scope is
 identical to the input scope.
 """
 
+from functools import partial
 from operator import attrgetter
 
 from pkgcore.config import ConfigHint
 from snakeoil.demandload import demandload
 
 demandload(
+    'errno',
+    'heapq',
     'itertools',
     'logging',
+    'os',
     're',
+    'snakeoil:pickling',
+    'snakeoil.fileutils:AtomicWriteFile',
+    'snakeoil.osutils:ensure_dirs,pjoin',
+    'pkgcore_checks:errors',
 )
 
+# Checks of the repository feed are fed the package (or category) tuples
+# of the repository one at a time as the scan goes, then finished once
+# it is done; they reduce those into what they need to report on rather
+# than keeping them around, the whole tree being too large for that.
 repository_feed = "repo"
 category_feed = "cat"
 package_feed = "cat/pkg"
 versioned_feed = "cat/pkg-ver"
 ebuild_feed = "cat/pkg-ver+text"
+# (package or category tuple, pkgcore_checks.feeds.DirSnapshot) pairs.
+pkgdir_feed = "cat/pkg+dir"
+catdir_feed = "cat+dir"
 
 # The plugger needs to be able to compare those and know the highest one.
 version_scope, package_scope, category_scope, repository_scope = range(4)
@@ -54,9 +69,21 @@ class Addon(object):
     (but if not overridden they will be no-ops).
 
     :cvar required_addons: sequence of addons this one depends on.
+    :cvar source_paths: paths (relative to the repository bases) of the
+        files the addon reads when instantiated. Long running processes
+        (see L{pkgcore_checks.daemon}) instantiate it again if they change.
+    :cvar source_options: names of the option values holding a path (or
+        a list of paths) the addon reads, like source_paths but for what
+        can live outside the repositories (C{--license-dir}...).
+    :cvar fingerprint_options: names of the option values the addon
+        depends on; part of the key of cached check results (see
+        L{pkgcore_checks.result_cache}) along with source_paths.
     """
 
     required_addons = ()
+    source_paths = ()
+    source_options = ()
+    fingerprint_options = ()
     known_results = []
 
     def __init__(self, options, *args):
@@ -106,6 +133,22 @@ class Template(Addon):
     # The plugger sorts based on this. Should be left alone except for
     # weird pseudo-checks like the cache wiper that influence other checks.
     priority = 0
+    # Set to an int (and bump it when the results can change) to have
+    # the results cached, see pkgcore_checks.result_cache. Only for checks
+    # whose results depend on just the package being fed.
+    result_cache_version = None
+    # Checks able to process many items per call (using set operations or
+    # lookups shared across packages) define feed_batch(items, reporter);
+    # the pipeline then hands them lists of items instead of calling feed,
+    # see Dispatcher. They should keep a working feed too, and feed the
+    # items through feed_each so one broken item doesn't cost the others
+    # of the batch their results.
+    feed_batch = None
+    # Repository scope checks define save_state() returning a picklable
+    # copy of what they gathered so far and restore_state(state) taking it
+    # back, so checkpointed scans can be resumed without feeding them
+    # everything again, see pkgcore_checks.checkpoint.
+    save_state = None
 
     def start(self):
         """Do startup here."""
@@ -117,6 +160,33 @@ class Template(Addon):
         """Do cleanup and omit final results here."""
 
 
+def _report_all(reporter, results):
+    for result in results:
+        reporter.add_report(result)
+
+
+def defer(reporter, func, args=(), callback=None):
+    """Run func(*args), the blocking file I/O a check does for an item.
+
+    If reporter supports it (see L{pkgcore_checks.overlap}) func runs in a
+    thread while the next items are fed, and callback is called from the
+    scanning thread later on; the results it reports still reach the real
+    reporter in the order they would have without deferring.  Otherwise
+    both are called right away.  func must not touch state shared with
+    the scanning thread.
+
+    :param callback: called with what func returned; if C{None} func
+        returns the results to report.
+    """
+    if callback is None:
+        callback = partial(_report_all, reporter)
+    hook = getattr(reporter, 'defer', None)
+    if hook is None:
+        callback(func(*args))
+    else:
+        hook(func, args, callback)
+
+
 class Transform(object):
 
     """Base class for a feed type transformer.
@@ -125,8 +195,13 @@ class Transform(object):
     :cvar dest: destination type
     :cvar scope: minimun scope
     :cvar cost: cost
+    :cvar unwrap: C{None} or a cheap function returning what the transform
+        feeds its child for an item; such transforms keep no state and get
+        inlined by L{compile_pipeline}.
     """
 
+    unwrap = None
+
     def __init__(self, child):
         self.child = child
 
@@ -144,13 +219,58 @@ class Transform(object):
     def __repr__(self):
         return '%s(%r)' % (self.__class__.__name__, self.child)
 
+
+class CheckWrapper(object):
+
+    """Base class for objects standing in for a check or transform.
+
+    Used to instrument a planned pipeline (see L{wrap_checks}); anything
+    not overridden is forwarded to the wrapped object.
+    """
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    def start(self):
+        self.wrapped.start()
+
+    def feed(self, item, reporter):
+        self.wrapped.feed(item, reporter)
+
+    def feed_batch(self, items, reporter):
+        self.wrapped.feed_batch(items, reporter)
+
     def finish(self, reporter):
-        pass
+        self.wrapped.finish(reporter)
+
+    def __getattr__(self, attr):
+        return getattr(self.wrapped, attr)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.wrapped)
+
+
+def wrap_checks(obj, wrapper):
+    """Wrap every check and transform of a pipeline, in place.
+
+    :param obj: a L{CheckRunner} as returned by L{plug}.
+    :param wrapper: callable taking a check or transform and returning
+        the object to use instead, usually a L{CheckWrapper}.
+    :return: the wrapped pipeline.
+    """
+    if isinstance(obj, CheckRunner):
+        obj.checks = list(wrap_checks(check, wrapper) for check in obj.checks)
+        return obj
+    if isinstance(obj, Transform):
+        wrap_checks(obj.child, wrapper)
+    return wrapper(obj)
 
 
 def _collect_checks(obj):
     if isinstance(obj, Transform):
         i = collect_checks(obj.child)
+    elif isinstance(obj, CheckWrapper):
+        i = collect_checks(obj.wrapped)
     elif isinstance(obj, CheckRunner):
         i = itertools.chain(*map(collect_checks, obj.checks))
     elif isinstance(obj, Addon):
@@ -169,6 +289,32 @@ def collect_checks_classes(obj):
     return set(x.__class__ for x in collect_checks(obj))
 
 
+def addon_source_paths(addon, options):
+    """Return the paths addon reads, see L{Addon.source_paths} and
+    L{Addon.source_options}."""
+    paths = list(pjoin(repo_base, path) for path in addon.source_paths
+                 for repo_base in options.repo_bases)
+    for attr in addon.source_options:
+        value = getattr(options, attr, None)
+        if isinstance(value, basestring):
+            paths.append(value)
+        elif value is not None:
+            paths.extend(value)
+    return paths
+
+
+def required_addons(addons):
+    """Return addons plus the addons they (indirectly) require."""
+    result = set()
+    todo = list(addons)
+    while todo:
+        addon = todo.pop()
+        if addon not in result:
+            result.add(addon)
+            todo.extend(addon.required_addons)
+    return result
+
+
 class Result(object):
 
     __metaclass__ = set_documentation
@@ -335,7 +481,7 @@ class CheckRunner(object):
         for check in self.checks:
             try:
                 check.feed(item, reporter)
-            except (KeyboardInterrupt, SystemExit):
+            except (KeyboardInterrupt, SystemExit, errors.FatalError):
                 raise
             except Exception:
                 logging.exception('check %r raised', check)
@@ -344,6 +490,8 @@ class CheckRunner(object):
         for check in self.checks:
             try:
                 check.finish(reporter)
+            except errors.FatalError:
+                raise
             except Exception:
                 logging.exception('finishing check %r failed', check)
 
@@ -363,7 +511,276 @@ class CheckRunner(object):
             sorted(str(check) for check in self.checks)))
 
 
-def plug(sinks, transforms, sources, debug=None):
+default_batch_size = 64
+
+
+def batching(check):
+    """Return whether check (possibly wrapped) defines C{feed_batch}."""
+    while isinstance(check, CheckWrapper):
+        check = check.wrapped
+    return getattr(check, 'feed_batch', None) is not None
+
+
+def package_key(item):
+    """Return the (category, package) a feed item is about.
+
+    Items of the category and repository feeds give C{None}s.
+    """
+    while isinstance(item, (tuple, list)):
+        if not item:
+            return None, None
+        item = item[0]
+    return getattr(item, 'category', None), getattr(item, 'package', None)
+
+
+def feed_each(check, items, feed, reporter):
+    """Call feed(item, reporter) for each of items, for C{feed_batch}.
+
+    An item feed raises for is logged and skipped the way L{CheckRunner}
+    does it for feed, the remaining items still get fed.
+    """
+    for item in items:
+        try:
+            feed(item, reporter)
+        except (KeyboardInterrupt, SystemExit, errors.FatalError):
+            raise
+        except Exception:
+            logging.exception('check %r raised', check)
+
+
+def _batcher(check, batch, size):
+    def feed(item, reporter):
+        batch.append(item)
+        if len(batch) >= size:
+            items = batch[:]
+            del batch[:]
+            check.feed_batch(items, reporter)
+    return feed
+
+
+class Dispatcher(CheckRunner):
+
+    """Flattened L{CheckRunner} tree, see L{compile_pipeline}.
+
+    Checks fed through transforms that only unwrap items are fed from the
+    same loop as the others, converting the item on the spot.  Items for
+    checks defining C{feed_batch} are collected and handed over batch_size
+    at a time, so their results are reported later than those of the other
+    checks.  Batches do not span packages (see L{package_key}): pending
+    ones are handed over before the first item of the next package, so
+    results still come grouped by package.
+    """
+
+    def __init__(self, entries, batch_size=1):
+        """Initialize.
+
+        :param entries: sequence of (check, convert) tuples, convert being
+            C{None} or a function to apply to items before feeding them.
+        :param batch_size: maximum number of items per C{feed_batch} call,
+            1 disables batching.
+        """
+        CheckRunner.__init__(self, list(check for check, convert in entries))
+        self.batch_size = batch_size
+        self._batches = []
+        feeds = []
+        for check, convert in entries:
+            if batch_size > 1 and batching(check):
+                batch = []
+                self._batches.append((check, batch))
+                feeds.append(
+                    (check, _batcher(check, batch, batch_size), convert))
+            else:
+                feeds.append((check, check.feed, convert))
+        self._feeds = tuple(feeds)
+        self._package = None
+
+    def feed(self, item, reporter):
+        if self._batches:
+            package = package_key(item)
+            if package != self._package:
+                self.flush(reporter)
+                self._package = package
+        for check, feed, convert in self._feeds:
+            try:
+                if convert is None:
+                    feed(item, reporter)
+                else:
+                    feed(convert(item), reporter)
+            except (KeyboardInterrupt, SystemExit, errors.FatalError):
+                raise
+            except Exception:
+                logging.exception('check %r raised', check)
+
+    def flush(self, reporter):
+        """Hand over the items collected for checks with C{feed_batch}."""
+        for check, batch in self._batches:
+            if not batch:
+                continue
+            items = batch[:]
+            del batch[:]
+            try:
+                check.feed_batch(items, reporter)
+            except (KeyboardInterrupt, SystemExit, errors.FatalError):
+                raise
+            except Exception:
+                logging.exception('check %r raised', check)
+
+    def finish(self, reporter):
+        self.flush(reporter)
+        self._package = None
+        CheckRunner.finish(self, reporter)
+
+
+def _compose(first, second):
+    if first is None:
+        return second
+    return lambda item: second(first(item))
+
+
+def _flatten(runner, convert, entries, batch_size):
+    for check in runner.checks:
+        if isinstance(check, Transform) and check.unwrap is not None:
+            _flatten(check.child, _compose(convert, check.unwrap), entries,
+                     batch_size)
+            continue
+        target = check
+        while isinstance(target, CheckWrapper):
+            target = target.wrapped
+        if isinstance(target, Transform) and \
+                isinstance(target.child, CheckRunner):
+            target.child = compile_pipeline(target.child, batch_size)
+        entries.append((check, convert))
+
+
+def compile_pipeline(pipe, batch_size=default_batch_size):
+    """Turn a pipeline returned by L{plug} into L{Dispatcher}s.
+
+    Every L{CheckRunner} is replaced by a L{Dispatcher} and transforms
+    with an C{unwrap} function are dropped, their children moving up.
+    Call L{wrap_checks} first, if at all.
+
+    :param batch_size: passed to the L{Dispatcher}s.
+    :return: the L{Dispatcher} to feed instead of pipe.
+    """
+    entries = []
+    _flatten(pipe, None, entries, batch_size)
+    return Dispatcher(entries, batch_size)
+
+
+def _sink_key(sink):
+    return sink.feed_type, sink.scope
+
+
+def _transform_key(trans):
+    return (trans.__module__, trans.__name__, trans.source, trans.dest,
+            trans.scope, trans.cost)
+
+
+def plan_key(sinks, transforms, sources):
+    """Return what the plan L{plug} makes for its arguments depends on.
+
+    The order of sinks and transforms does not matter (it is not stable
+    from one run to the next), the order of sources does.
+    """
+    return (
+        tuple(sorted(set(_sink_key(sink) for sink in sinks))),
+        tuple(sorted(set(_transform_key(trans) for trans in transforms))),
+        tuple((source.feed_type, source.scope, source.cost)
+              for source in sources))
+
+
+class PlanCache(object):
+
+    """Memoizes the plans of L{plug}.
+
+    Plans are stored under their L{plan_key} and refer to sinks and
+    transforms by their type and scope and to sources by their index, so
+    they can be saved to disk and loaded again by a later run.
+    """
+
+    # Bump when the plan format changes.
+    version = 1
+
+    def __init__(self):
+        self.plans = {}
+        self.hits = self.misses = 0
+        self.dirty = False
+
+    def get(self, key):
+        plan = self.plans.get(key)
+        if plan is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return plan
+
+    def add(self, key, plan):
+        self.plans[key] = plan
+        self.dirty = True
+
+    def load(self, path):
+        """Add the plans saved at path, if there are any."""
+        try:
+            with open(path, 'rb') as f:
+                version, plans = pickling.load(f)
+        except EnvironmentError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        except Exception:
+            # Corrupted; it gets replaced by save.
+            return
+        if version == self.version:
+            self.plans.update(plans)
+
+    def save(self, path):
+        """Write the plans to path if any were added since the last save."""
+        if not self.dirty:
+            return
+        ensure_dirs(os.path.dirname(os.path.abspath(path)))
+        f = AtomicWriteFile(path, binary=True)
+        try:
+            pickling.dump((self.version, self.plans), f, -1)
+        except:
+            f.discard()
+            raise
+        f.close()
+        self.dirty = False
+
+
+# Used by plug unless told otherwise.
+plan_cache = PlanCache()
+
+
+def _get_plan(sinks, transforms, sources, debug, plans):
+    if plans is None:
+        plans = plan_cache
+    key = plan_key(sinks, transforms, sources)
+    plan = plans.get(key)
+    if plan is None:
+        plan = _plan(sinks, transforms, sources, debug)
+        plans.add(key, plan)
+    elif debug is not None:
+        debug('plan cache hit for %i sinks, %i transforms, %i sources',
+              len(sinks), len(transforms), len(sources))
+    return plan
+
+
+def unreachable_sinks(sinks, transforms, sources, debug=None, plans=None):
+    """Return the sinks L{plug} would find unreachable, building nothing.
+
+    Only the feed_type and scope of the sinks are looked at, so this
+    works on check classes too (if they set those as class attributes),
+    before any of them or their addons are instantiated.
+    """
+    if not sinks:
+        return []
+    bad_keys = frozenset(
+        _get_plan(sinks, transforms, sources, debug, plans)[0])
+    return list(sink for sink in sinks if _sink_key(sink) in bad_keys)
+
+
+def plug(sinks, transforms, sources, debug=None, plans=None):
     """Plug together a pipeline.
 
     This tries to return a single pipeline if possible (even if it is
@@ -374,18 +791,173 @@ def plug(sinks, transforms, sources, debug=None):
     :param transforms: Sequence of transform classes.
     :param sources: Sequence of source instances.
     :param debug: A logging function or C{None}.
+    :param plans: L{PlanCache} to use, defaults to L{plan_cache}.
     :return: a sequence of sinks that are unreachable (out of scope or
         missing sources/transforms of the right type),
         a sequence of (source, consumer) tuples.
     """
+    assert sinks
+    bad_keys, pipes_to_run = _get_plan(sinks, transforms, sources, debug, plans)
+
+    bad_keys = frozenset(bad_keys)
+    bad_sinks = list(sink for sink in sinks if _sink_key(sink) in bad_keys)
+    if not pipes_to_run:
+        return bad_sinks, ()
+    good_sinks = list(
+        sink for sink in sinks if _sink_key(sink) not in bad_keys)
+    good_sinks.sort(key=attrgetter('priority'))
+    transforms_by_key = dict(
+        (_transform_key(trans), trans) for trans in transforms)
+
+    def build_transform(scope, feed_type, transforms):
+        children = list(
+            # Note this relies on the cheapest pipe not having
+            # any "loops" in its transforms.
+            trans(build_transform(scope, trans.dest, transforms))
+            for trans in transforms
+            if trans.source == feed_type and trans.scope <= scope)
+        # Hacky: we modify this in place.
+        for i in reversed(xrange(len(good_sinks))):
+            sink = good_sinks[i]
+            if sink.feed_type == feed_type and sink.scope <= scope:
+                children.append(sink)
+                del good_sinks[i]
+        return CheckRunner(children)
 
-    # This is not optimized to deal with huge numbers of sinks,
-    # sources and transforms, but that should not matter (although it
-    # may be necessary to handle a lot of sinks a bit better at some
-    # point, which should be fairly easy since we only care about
-    # their type and scope).
+    result = []
+    for source_index, trans_keys in pipes_to_run:
+        source = sources[source_index]
+        result.append((source, build_transform(
+            source.scope, source.feed_type,
+            list(transforms_by_key[key] for key in trans_keys))))
 
-    assert sinks
+    assert not good_sinks, 'sinks left: %r' % (good_sinks,)
+    return bad_sinks, result
+
+
+class _TreeSearch(object):
+
+    """Finds the cheapest trees of transforms starting at a feed type.
+
+    Uniform cost (A*) search over the sets of feed types reached so far,
+    growing a set by a transform from a reached type to a new one.  The
+    estimate of what is left is the largest distance (cost of the
+    cheapest chain of transforms) from the reached types to one still to
+    reach.  That never overestimates, so the first set reaching all
+    wanted types comes from the cheapest tree.
+    """
+
+    def __init__(self, root, edges):
+        """Initialize.
+
+        :param root: feed type the trees start at.
+        :param edges: dict mapping (source, dest) feed types to (cost,
+            transform) tuples.
+        """
+        nodes = set([root])
+        for edge in edges:
+            nodes.update(edge)
+        nodes = sorted(nodes)
+        self.index = index = dict((x, i) for i, x in enumerate(nodes))
+        self.root = index[root]
+        self.outgoing = outgoing = list([] for x in nodes)
+        inf = float('inf')
+        # All pairs distances, Floyd-Warshall (there are few feed types).
+        self.dist = dist = list([inf] * len(nodes) for x in nodes)
+        for i in xrange(len(nodes)):
+            dist[i][i] = 0
+        for (source, dest), (cost, transform) in sorted(edges.iteritems()):
+            if source != dest:
+                outgoing[index[source]].append((index[dest], cost, transform))
+                dist[index[source]][index[dest]] = cost
+        for k in xrange(len(nodes)):
+            dist_k = dist[k]
+            for row in dist:
+                via = row[k]
+                if via == inf:
+                    continue
+                for j in xrange(len(nodes)):
+                    if via + dist_k[j] < row[j]:
+                        row[j] = via + dist_k[j]
+        self._memo = {}
+
+    def _estimate(self, mask, targets):
+        result = 0
+        for target in targets:
+            if mask >> target & 1:
+                continue
+            nearest = min(row[target] for i, row in enumerate(self.dist)
+                          if mask >> i & 1)
+            if nearest > result:
+                result = nearest
+        return result
+
+    def search(self, targets):
+        """Return the cheapest tree reaching targets.
+
+        :param targets: frozenset of feed types.
+        :return: (cost, transforms) tuple, or C{None} if there is no such
+            tree.
+        """
+        if targets in self._memo:
+            return self._memo[targets]
+        result = self._memo[targets] = self._search(targets)
+        return result
+
+    def _search(self, targets):
+        if not targets.issubset(self.index):
+            return None
+        targets = list(self.index[x] for x in targets)
+        inf = float('inf')
+        start = 1 << self.root
+        estimate = self._estimate(start, targets)
+        if estimate == inf:
+            return None
+        best = {start: 0}
+        parent = {start: None}
+        heap = [(estimate, 0, start)]
+        while heap:
+            estimate, cost, mask = heapq.heappop(heap)
+            if cost > best[mask]:
+                continue
+            remaining = list(x for x in targets if not mask >> x & 1)
+            if not remaining:
+                transforms = []
+                while parent[mask] is not None:
+                    mask, transform = parent[mask]
+                    transforms.append(transform)
+                transforms.reverse()
+                return cost, transforms
+            for node in xrange(len(self.outgoing)):
+                if not mask >> node & 1:
+                    continue
+                for dest, edge_cost, transform in self.outgoing[node]:
+                    if mask >> dest & 1:
+                        continue
+                    # Only grow towards something still to reach.
+                    dist = self.dist[dest]
+                    if all(dist[x] == inf for x in remaining):
+                        continue
+                    new_mask = mask | 1 << dest
+                    new_cost = cost + edge_cost
+                    if new_cost < best.get(new_mask, inf):
+                        best[new_mask] = new_cost
+                        parent[new_mask] = (mask, transform)
+                        heapq.heappush(heap, (
+                            new_cost + self._estimate(new_mask, targets),
+                            new_cost, new_mask))
+        return None
+
+
+def _plan(sinks, transforms, sources, debug=None):
+    """Work out the pipelines for L{plug}.
+
+    :return: a tuple of the (feed type, scope) of the unreachable sinks
+        and a tuple of (source index, transform keys) tuples, one per
+        pipeline.
+    """
+
+    source_indices = dict((id(source), i) for i, source in enumerate(sources))
 
     feed_to_transforms = {}
     for transform in transforms:
@@ -417,13 +989,13 @@ def plug(sinks, transforms, sources, debug=None):
     for sink in sinks:
         scope = best_scope.get(sink.feed_type)
         if scope is None or sink.scope > scope:
-            bad_sinks.append(sink)
+            bad_sinks.append(_sink_key(sink))
         else:
             good_sinks.append(sink)
 
     if not good_sinks:
         # No point in continuing.
-        return bad_sinks, ()
+        return tuple(set(bad_sinks)), ()
 
     # Throw out all sources with a scope lower than the least required scope.
     # Does not check transform requirements, may not be very useful.
@@ -432,10 +1004,7 @@ def plug(sinks, transforms, sources, debug=None):
     sources = list(s for s in sources if s.scope >= lowest_required_scope)
     if not sources:
         # No usable sources, abort.
-        return bad_sinks + good_sinks, ()
-
-    # All types we need to reach.
-    sink_types = set(sink.feed_type for sink in good_sinks)
+        return tuple(set(_sink_key(sink) for sink in sinks)), ()
 
     # Map from scope, source typename to cheapest source.
     source_map = {}
@@ -445,108 +1014,78 @@ def plug(sinks, transforms, sources, debug=None):
         if current_source is None or current_source.cost > new_source.cost:
             source_map[new_source.scope, new_source.feed_type] = new_source
 
-    # Tuples of (visited_types, source, transforms, price)
-    pipes = set()
-    unprocessed = set(
-        (frozenset((source.feed_type,)), source, frozenset(), source.cost)
-        for source in source_map.itervalues())
-    if debug is not None:
-        for pipe in unprocessed:
-            debug('initial: %r', pipe)
+    # A pipeline has to be of at least the highest scope of the sinks of a
+    # type for it to drive them.
+    needed_scope = {}
+    for sink in good_sinks:
+        needed_scope[sink.feed_type] = max(
+            sink.scope, needed_scope.get(sink.feed_type, sink.scope))
+    # All types we need to reach.
+    sink_types = frozenset(needed_scope)
+
+    searches = []
+    for source in sorted(source_map.itervalues(),
+                         key=lambda x: source_indices[id(x)]):
+        edges = {}
+        for transform in sorted(transforms, key=_transform_key):
+            if transform.scope > source.scope:
+                continue
+            edge = transform.source, transform.dest
+            if edge not in edges or edges[edge][0] > transform.cost:
+                edges[edge] = transform.cost, transform
+        drives = frozenset(feed_type for feed_type in sink_types
+                           if needed_scope[feed_type] <= source.scope)
+        searches.append((source, drives, _TreeSearch(source.feed_type, edges)))
 
     # If we find a single pipeline driving all sinks we want to use it.
     # List of tuples of source, transforms.
     pipes_to_run = None
     best_cost = None
-    while unprocessed:
-        next = unprocessed.pop()
-        if next in pipes:
-            continue
-        pipes.add(next)
-        visited, source, trans, cost = next
-        if visited >= sink_types:
-            # Already reaches all sink types. Check if it is usable as
-            # single pipeline:
-            if best_cost is None or cost < best_cost:
-                pipes_to_run = [(source, trans)]
-                best_cost = cost
-            # No point in growing this further: it already reaches everything.
+    for source, drives, search in searches:
+        if drives != sink_types:
             continue
-        if best_cost is not None and best_cost <= cost:
-            # No point in growing this further.
-            continue
-        for transform in transforms:
-            if source.scope >= transform.scope and \
-                    transform.source in visited and \
-                    transform.dest not in visited:
-                unprocessed.add((
-                    visited.union((transform.dest,)), source,
-                    trans.union((transform,)), cost + transform.cost))
-                if debug is not None:
-                    debug(
-                        'growing %r for %r with %r', trans, source, transform)
+        found = search.search(sink_types)
+        if debug is not None:
+            debug('single pipeline from %r: %r', source, found)
+        if found is not None and (
+                best_cost is None or source.cost + found[0] < best_cost):
+            pipes_to_run = [(source, found[1])]
+            best_cost = source.cost + found[0]
 
     if pipes_to_run is None:
-        # No single pipe will drive everything, try combining pipes.
-        # This is pretty stupid but effective. Map sources to
-        # pipelines they drive, try combinations of sources (using a
-        # source more than once in a combination makes no sense since
-        # we also have the "combined" pipeline in pipes).
-        source_to_pipes = {}
-        for visited, source, trans, cost in pipes:
-            source_to_pipes.setdefault(source, []).append(
-                (visited, trans, cost))
-        unprocessed = set(
-            (visited, frozenset([source]), ((source, trans),), cost)
-            for visited, source, trans, cost in pipes)
-        done = set()
-        while unprocessed:
-            next = unprocessed.pop()
-            if next in done:
-                continue
-            done.add(next)
-            visited, sources, seq, cost = next
-            if visited >= sink_types:
-                # This combination reaches everything.
-                if best_cost is None or cost < best_cost:
-                    pipes_to_run = seq
-                    best_cost = cost
-                # No point in growing this further.
-            if best_cost is not None and best_cost <= cost:
-                # No point in growing this further.
-                continue
-            for source, source_pipes in source_to_pipes.iteritems():
-                if source not in sources:
-                    for new_visited, trans, new_cost in source_pipes:
-                        unprocessed.add((
-                            visited.union(new_visited),
-                            sources.union([source]),
-                            seq + ((source, trans),),
-                            cost + new_cost))
+        # No single pipe will drive everything, combine pipes of
+        # different sources: map sets of covered sink types to the
+        # cheapest (cost, ((source, transforms), ...)) covering them,
+        # adding one source at a time (using a source more than once
+        # makes no sense, one pipe of it can drive everything it reaches).
+        combinations = {frozenset(): (0, ())}
+        for source, drives, search in searches:
+            subsets = [frozenset()]
+            for feed_type in sorted(drives):
+                subsets.extend(x.union([feed_type]) for x in list(subsets))
+            new = dict(combinations)
+            for covered, (cost, seq) in combinations.iteritems():
+                for subset in subsets:
+                    if not subset or subset & covered:
+                        continue
+                    found = search.search(subset)
+                    if found is None:
+                        continue
+                    total = cost + source.cost + found[0]
+                    current = new.get(covered | subset)
+                    if current is None or total < current[0]:
+                        new[covered | subset] = (
+                            total, seq + ((source, found[1]),))
+            combinations = new
+        if sink_types in combinations:
+            total, pipes_to_run = combinations[sink_types]
+            if debug is not None:
+                debug('combined pipelines: cost %r: %r', total, pipes_to_run)
 
     # Just an assert since unreachable sinks should have been thrown away.
     assert pipes_to_run, 'did not find a solution?'
 
-    good_sinks.sort(key=attrgetter('priority'))
-
-    def build_transform(scope, feed_type, transforms):
-        children = list(
-            # Note this relies on the cheapest pipe not having
-            # any "loops" in its transforms.
-            trans(build_transform(scope, trans.dest, transforms))
-            for trans in transforms
-            if trans.source == feed_type and trans.scope <= scope)
-        # Hacky: we modify this in place.
-        for i in reversed(xrange(len(good_sinks))):
-            sink = good_sinks[i]
-            if sink.feed_type == feed_type and sink.scope <= source.scope:
-                children.append(sink)
-                del good_sinks[i]
-        return CheckRunner(children)
-
-    result = list(
-        (source, build_transform(source.scope, source.feed_type, transforms))
-        for source, transforms in pipes_to_run)
-
-    assert not good_sinks, 'sinks left: %r' % (good_sinks,)
-    return bad_sinks, result
+    return tuple(set(bad_sinks)), tuple(
+        (source_indices[id(source)],
+         tuple(sorted(_transform_key(x) for x in pipe_transforms)))
+        for source, pipe_transforms in pipes_to_run)
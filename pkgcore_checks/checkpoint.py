@@ -0,0 +1,261 @@
+# License: BSD/GPL2
+
+"""Checkpoints of full repo scans, so an interrupted scan can be resumed.
+
+A checkpointed scan runs the sinks below repository scope once per
+category, in category order, the way L{pkgcore_checks.parallel} runs them
+per shard.  After a category is done, at most every L{default_interval}
+seconds, a L{Checkpoint} saves:
+
+ - the categories done so far;
+ - the results reported for them;
+ - the state of the repository scope checks (those feeding on every
+   package and reporting in C{finish}), through their C{save_state}
+   methods.
+
+A resumed scan replays the saved results, restores that state and scans
+the remaining categories only, so its output is that of a scan that was
+not interrupted.  If a repository scope check cannot save its state (or
+a transform in front of it holds items between categories) the
+repository wide pipelines are fed every category again instead.
+"""
+
+import os
+import time
+
+from snakeoil.demandload import demandload
+from snakeoil.osutils import pjoin
+
+from pkgcore_checks import base, parallel
+
+demandload(
+    'errno',
+    'pkgcore_checks:errors,overlap',
+    'snakeoil:pickling',
+)
+
+# Bump when the format of the checkpoint changes.
+version = 1
+
+# Minimum number of seconds between two saves of the checkpoint.
+default_interval = 60
+
+
+def _unwrap(check):
+    while isinstance(check, base.CheckWrapper):
+        check = check.wrapped
+    return check
+
+
+def _name(sink):
+    klass = sink.__class__
+    return '%s.%s' % (klass.__module__, klass.__name__)
+
+
+def _stateless(runner):
+    for check in runner.checks:
+        check = _unwrap(check)
+        if isinstance(check, base.Transform) and (
+                check.unwrap is None or not _stateless(check.child)):
+            return False
+    return True
+
+
+def restorable(pipes):
+    """Return whether the state of pipes can be saved between categories.
+
+    :param pipes: pipelines as returned by L{base.plug} (not compiled).
+    """
+    if not all(_stateless(pipe) for pipe in pipes):
+        return False
+    return all(
+        _unwrap(sink).save_state is not None
+        for sink in base.collect_checks(pipes)
+        if sink.scope >= base.repository_scope)
+
+
+class Checkpoint(object):
+
+    """The checkpoint of a scan, kept in a directory."""
+
+    filename = 'checkpoint.pickle'
+
+    def __init__(self, directory, resume=False, interval=default_interval,
+                 clock=time.time):
+        """Initialize.
+
+        :param directory: directory to keep the checkpoint in, created if
+            needed.
+        :param resume: whether to carry on from a checkpoint left there.
+        :param interval: minimum number of seconds between saves.
+        :param clock: function returning the current time.
+        """
+        self.directory = directory
+        self.path = pjoin(directory, self.filename)
+        self.resume = resume
+        self.interval = interval
+        self.clock = clock
+        self._due = clock() + interval
+
+    def load(self, key):
+        """Return the data saved for the scan identified by key.
+
+        :return: a dict, or C{None} to start from scratch (not resuming or
+            nothing saved yet).
+        :raise errors.CheckpointError: if the checkpoint cannot be read or
+            is of another scan.
+        """
+        if not self.resume:
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickling.load(f)
+        except EnvironmentError, e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise errors.CheckpointError(
+                'cannot read checkpoint %s: %s' % (self.path, e))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception, e:
+            raise errors.CheckpointError(
+                'checkpoint %s is corrupt: %s' % (self.path, e))
+        if not isinstance(data, dict) or data.get('version') != version or \
+                data.get('key') != key:
+            raise errors.CheckpointError(
+                'checkpoint %s is of a different scan' % (self.path,))
+        return data
+
+    def due(self):
+        """Return whether it is time to save again."""
+        now = self.clock()
+        if now < self._due:
+            return False
+        self._due = now + self.interval
+        return True
+
+    def save(self, data):
+        """Save data, atomically."""
+        try:
+            os.makedirs(self.directory)
+        except EnvironmentError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        tmp = '%s.%i.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                pickling.dump(data, f, -1)
+            # Killed while writing, the previous checkpoint is still there.
+            os.rename(tmp, self.path)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def remove(self):
+        """Remove the checkpoint, the scan being complete."""
+        try:
+            os.unlink(self.path)
+        except EnvironmentError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def scan_key(repo, limiter, sinks):
+    """Return what identifies a scan, to match checkpoints against."""
+    return (getattr(repo, 'location', None), str(limiter),
+            sorted(_name(sink) for sink in sinks))
+
+
+def run_checkpointed(repo, limiter, source, sinks, transforms, reporter,
+                     checkpoint, debug=None, instruments=(),
+                     batch_size=base.default_batch_size, prefetch=None,
+                     io_loop=None, progress=None):
+    """Run sinks over source a category at a time, saving checkpoints.
+
+    Arguments are those of L{parallel.run_sharded} (without jobs) plus
+    checkpoint, the L{Checkpoint} to save to and resume from.  The
+    checkpoint is removed once the scan completes.
+
+    :raise errors.CheckpointError: see L{Checkpoint.load}.
+    """
+    shard_pipes, serial_pipes = parallel.plug_split(
+        sinks, transforms, source, debug)
+    restore = restorable(serial_pipes)
+    states = dict(
+        (_name(sink), _unwrap(sink))
+        for sink in base.collect_checks(serial_pipes)
+        if sink.scope >= base.repository_scope)
+    for instrument in instruments:
+        for pipe in shard_pipes + serial_pipes:
+            base.wrap_checks(pipe, instrument.wrap)
+    shard_pipes = list(base.compile_pipeline(pipe, batch_size)
+                       for pipe in shard_pipes)
+    serial_pipes = list(base.compile_pipeline(pipe, batch_size)
+                        for pipe in serial_pipes)
+
+    key = scan_key(repo, limiter, sinks)
+    data = checkpoint.load(key)
+    serial_reporter = parallel.CollectingReporter()
+    for pipe in serial_pipes:
+        pipe.start()
+    if data is None:
+        data = {'version': version, 'key': key, 'categories': [],
+                'results': [], 'serial_results': [], 'state': None}
+    else:
+        if debug is not None:
+            debug('resuming from %s after %i categories',
+                  checkpoint.path, len(data['categories']))
+        if data['state'] is not None:
+            for name, state in data['state'].iteritems():
+                states[name].restore_state(state)
+            serial_reporter.results = data['serial_results']
+        for result in data['results']:
+            reporter.add_report(result)
+    done = set(data['categories'])
+    if not restore:
+        if debug is not None and done:
+            debug('feeding the repository wide checks everything again')
+        data['serial_results'] = data['state'] = None
+    if progress is not None and shard_pipes:
+        progress.expect(repo, limiter, len(shard_pipes))
+
+    for category in sorted(repo.categories):
+        if category not in done:
+            shard_reporter = parallel.CollectingReporter()
+            for pipe in shard_pipes:
+                pipe.start()
+                pkgs = parallel.iter_shard(repo, limiter, [category])
+                if prefetch is not None:
+                    pkgs = prefetch.iter(pkgs)
+                if progress is not None:
+                    pkgs = progress.iter(pkgs)
+                overlap.feed_pipeline(pipe, pkgs, shard_reporter, io_loop)
+            for result in shard_reporter.results:
+                reporter.add_report(result)
+            data['results'].extend(shard_reporter.results)
+        elif restore:
+            continue
+        for pipe in serial_pipes:
+            pkgs = parallel.iter_shard(repo, limiter, [category])
+            if prefetch is not None:
+                pkgs = prefetch.iter(pkgs)
+            for pkg in pkgs:
+                pipe.feed(pkg, serial_reporter)
+            pipe.flush(serial_reporter)
+        if category in done:
+            continue
+        data['categories'].append(category)
+        if checkpoint.due():
+            if restore:
+                data['state'] = dict(
+                    (name, sink.save_state())
+                    for name, sink in states.iteritems())
+                data['serial_results'] = serial_reporter.results
+            checkpoint.save(data)
+
+    for pipe in serial_pipes:
+        pipe.finish(serial_reporter)
+    for result in serial_reporter.results:
+        reporter.add_report(result)
+    checkpoint.remove()
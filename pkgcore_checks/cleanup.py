@@ -35,6 +35,7 @@ class RedundantVersionReport(Template):
     """
 
     feed_type = package_feed
+    result_cache_version = 1
     known_results = (RedundantVersionWarning,)
 
     def feed(self, pkgset, reporter):
@@ -0,0 +1,401 @@
+# License: BSD/GPL2
+
+"""Long running pcheck process keeping the addons set up between scans.
+
+C{pcheck --daemon SOCKET} instantiates the addons of all selected checks
+once (the profile addon in particular is expensive) and then serves scan
+requests sent by C{pcheck --connect SOCKET} over a unix socket.  The client
+pickles a request (targets, check selection and working directory), the
+daemon runs the scan and streams the results back in the format of
+L{pkgcore_checks.report_stream}, and the client feeds them to its own
+reporter.
+
+Before every scan the files each addon was set up from (see
+L{pkgcore_checks.base.Addon.source_paths} and C{source_options}) are
+checked for changes.  Addons whose files changed are instantiated again,
+together with every addon depending on them.  The package listings of the repositories are dropped
+before every scan.
+"""
+
+import os
+
+from pkgcore.plugin import get_plugins
+from snakeoil import lists
+
+from pkgcore_checks import base, plugins
+
+from snakeoil.demandload import demandload
+demandload(
+    'errno',
+    'gc',
+    'signal',
+    'socket',
+    'stat',
+    'traceback',
+    'pkgcore.ebuild:repo_objs,repository',
+    'pkgcore.repository:prototype',
+    'pkgcore.util:parserestrict',
+    'snakeoil:pickling',
+    'snakeoil.osutils:pjoin',
+    'pkgcore_checks:errors,pcheck,report_stream',
+)
+
+
+class ScanError(object):
+
+    """Sent to the client instead of results if a scan failed."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class StreamReporter(base.Reporter):
+
+    """Reporter pickling results to a file (the client connection)."""
+
+    def __init__(self, stream):
+        base.Reporter.__init__(self)
+        self.stream = stream
+
+    def dump(self, obj):
+        pickling.dump(obj, self.stream, -1)
+
+    def start_check(self, checks, target):
+        self.dump(report_stream.StreamHeader(checks, target))
+
+    def add_report(self, result):
+        self.dump(result)
+
+
+def fingerprint(paths):
+    """Return a value that changes whenever anything under paths changes.
+
+    Paths can be files or directories (scanned recursively); missing
+    paths are fine.
+    """
+    data = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            data.append((path, None, None))
+            continue
+        if not stat.S_ISDIR(st.st_mode):
+            data.append((path, st.st_mtime, st.st_size))
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                try:
+                    st = os.stat(pjoin(root, name))
+                except EnvironmentError:
+                    continue
+                data.append((pjoin(root, name), st.st_mtime, st.st_size))
+    return tuple(data)
+
+
+def stale_addons(addons, changed):
+    """Return the addons in changed plus the addons depending on them."""
+    stale = set(changed)
+    todo = True
+    while todo:
+        todo = False
+        for addon in addons:
+            if addon not in stale and stale.intersection(
+                    addon.required_addons):
+                stale.add(addon)
+                todo = True
+    return stale
+
+
+def refresh_repo(repo):
+    """Drop the cached package listing and eclass data of a repo."""
+    if not isinstance(repo, prototype.tree):
+        return
+    repo.categories = prototype.CategoryIterValLazyDict(
+        repo._get_categories, repo._get_categories)
+    repo.packages = prototype.PackageMapping(
+        repo.categories, repo._get_packages)
+    repo.versions = prototype.VersionMapping(
+        repo.packages, repo._get_versions)
+    # jit attributes: profiles/categories and the eclass listing.
+    try:
+        del repo._hardcoded_categories
+    except AttributeError:
+        pass
+    eclass_cache = getattr(repo, 'eclass_cache', None)
+    if eclass_cache is not None:
+        try:
+            del eclass_cache._eclasses
+        except AttributeError:
+            pass
+
+
+def reload_repo_config(repo):
+    """Replace the (cached) layout.conf and profiles data of an ebuild repo."""
+    if not isinstance(repo, repository.UnconfiguredTree):
+        return
+    config = repo.config
+    repo.config = repo_objs.RepoConfig(
+        config.location,
+        profiles_base=os.path.relpath(config.profiles_base, config.location),
+        disable_inst_caching=True)
+
+
+def replay(stream, reporter):
+    """Feed results read from a daemon connection to reporter.
+
+    :return: the error message sent by the daemon, or C{None}.
+    """
+    started = False
+    error = None
+    for item in pickling.iter_stream(stream):
+        if isinstance(item, ScanError):
+            error = item.message
+        elif isinstance(item, report_stream.StreamHeader):
+            if started:
+                reporter.end_check()
+            reporter.start_check(item.checks, item.criteria)
+            started = True
+        else:
+            reporter.add_report(item)
+    if started:
+        reporter.end_check()
+    return error
+
+
+def connect(options, out, err):
+    """Have a daemon run the scan described by options."""
+    try:
+        reporter = options.reporter(out)
+    except errors.ReporterInitError, e:
+        err.write(
+            err.fg('red'), err.bold, '!!! ', err.reset,
+            'Error initializing reporter: ', e)
+        return 1
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(options.connect)
+    except socket.error, e:
+        err.write(
+            err.fg('red'), err.bold, '!!! ', err.reset,
+            'Error connecting to daemon at %s: %s' % (options.connect, e))
+        return 1
+    try:
+        stream = sock.makefile('rwb')
+        pickling.dump(dict(
+            targets=list(options.targets),
+            cwd=os.getcwd(),
+            checks_to_run=options.checks_to_run or [],
+            checks_to_disable=options.checks_to_disable or [],
+            ), stream, -1)
+        stream.flush()
+        reporter.start()
+        error = replay(stream, reporter)
+        reporter.finish()
+    finally:
+        sock.close()
+    out.stream.flush()
+    if error is not None:
+        err.write(err.fg('red'), err.bold, '!!! ', err.reset, error)
+        return 1
+    return 0
+
+
+def terminate(signum, frame):
+    raise SystemExit(0)
+
+
+class Daemon(object):
+
+    """Serves scans with the addons set up once, see the module docs."""
+
+    def __init__(self, options, out, err, debug=None):
+        self.options = options
+        self.out = out
+        self.err = err
+        self.debug = debug
+        self.transforms = list(get_plugins('transform', plugins))
+        self.addons_map = {}
+        self.fingerprints = {}
+
+    def fingerprint(self, addon):
+        return fingerprint(base.addon_source_paths(addon, self.options))
+
+    def refresh(self):
+        """Instantiate the addons, again if their source files changed.
+
+        The new fingerprints are only kept once all addons got set up, so
+        a failed refresh is retried by the next scan.
+        """
+        changed = []
+        fingerprints = {}
+        for addon in self.options.addons:
+            if not (addon.source_paths or addon.source_options):
+                continue
+            current = self.fingerprint(addon)
+            if self.fingerprints.get(addon, current) != current:
+                changed.append(addon)
+            fingerprints[addon] = current
+        repos = set((self.options.target_repo, self.options.src_repo))
+        if changed:
+            stale = stale_addons(self.options.addons, changed)
+            self.err.write('reloading %s' % (', '.join(
+                sorted(addon.__name__ for addon in stale)),))
+            for addon in stale:
+                self.addons_map.pop(addon, None)
+            for repo in repos:
+                reload_repo_config(repo)
+            # Get rid of the profile nodes and such the old addons
+            # held on to, they are instance cached.
+            gc.collect()
+        for repo in repos.union([self.options.search_repo]):
+            refresh_repo(repo)
+        pcheck.init_addons(
+            self.options, self.err, self.options.addons, self.addons_map)
+        self.fingerprints.update(fingerprints)
+
+    def select_sinks(self, request):
+        checks = self.options.checks
+        if request['checks_to_run']:
+            whitelist = base.Whitelist(request['checks_to_run'])
+            checks = list(whitelist.filter(checks))
+        if request['checks_to_disable']:
+            blacklist = base.Blacklist(request['checks_to_disable'])
+            checks = list(blacklist.filter(checks))
+        if not checks:
+            raise ValueError('No active checks')
+        addons = base.required_addons(checks)
+        return list(addon for klass, addon in self.addons_map.iteritems()
+                    if klass in addons and getattr(addon, 'feed_type', False))
+
+    def limiters(self, request):
+        repo_base = getattr(self.options.target_repo, 'base', None)
+        if request['targets']:
+            limiters = []
+            for target in request['targets']:
+                # Relative paths are relative to the client.
+                path = pjoin(request['cwd'], target)
+                if pcheck.is_ebuild_path(path):
+                    limiter = None
+                    if repo_base is not None:
+                        limiter = pcheck.ebuild_limiter(repo_base, path)
+                    if limiter is None:
+                        raise ValueError(
+                            '%s is not an ebuild of the target repo' % (
+                                target,))
+                else:
+                    try:
+                        limiter = parserestrict.parse_match(target)
+                    except parserestrict.ParseError, e:
+                        raise ValueError(str(e))
+                limiters.append(limiter)
+            return lists.stable_unique(limiters)
+        limiters = None
+        if repo_base:
+            limiters = pcheck.cwd_limiters(repo_base, request['cwd'])
+        if limiters is None:
+            raise ValueError(
+                'Working dir (%s) is not inside target repo (%s). Fix '
+                'that or specify one or more extended atoms to scan.' % (
+                    request['cwd'], repo_base))
+        return limiters
+
+    def handle(self, conn):
+        stream = conn.makefile('rwb')
+        reporter = StreamReporter(stream)
+        try:
+            request = pickling.load(stream)
+            try:
+                limiters = self.limiters(request)
+            except ValueError, e:
+                reporter.dump(ScanError(str(e)))
+                return
+            try:
+                self.refresh()
+            except (KeyboardInterrupt, socket.error):
+                raise
+            except Exception, e:
+                tb = traceback.format_exc()
+                self.err.write(tb)
+                reporter.dump(ScanError(
+                    'setting up the checks failed: %s\n%s' % (e, tb)))
+                return
+            try:
+                sinks = self.select_sinks(request)
+            except ValueError, e:
+                reporter.dump(ScanError(str(e)))
+                return
+            if self.debug is not None:
+                for filterer in limiters:
+                    self.debug('limiter: %r', filterer)
+            try:
+                pcheck.scan(
+                    self.options, self.out, self.err, reporter, sinks,
+                    self.transforms, limiters, self.debug)
+                pcheck.save_profile_cache(self.addons_map)
+            except (KeyboardInterrupt, socket.error):
+                raise
+            except Exception, e:
+                self.err.write(traceback.format_exc())
+                reporter.dump(ScanError('scan failed: %s' % (e,)))
+        except socket.error, e:
+            # The client went away; nothing to tell anyone.
+            if e.errno != errno.EPIPE:
+                self.err.write('lost connection: %s' % (e,))
+        finally:
+            try:
+                stream.close()
+            except socket.error:
+                pass
+
+    def bind(self, path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(path):
+            try:
+                sock.connect(path)
+            except socket.error:
+                # Left behind by a daemon that did not shut down cleanly.
+                os.unlink(path)
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            else:
+                sock.close()
+                raise ValueError(
+                    'a daemon is already listening on %s' % (path,))
+        # Requests are pickles, so nobody else may connect.
+        umask = os.umask(077)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(umask)
+        sock.listen(5)
+        return sock
+
+    def serve(self, path):
+        """Serve scans on the unix socket at path until killed."""
+        try:
+            sock = self.bind(path)
+        except (ValueError, socket.error), e:
+            self.err.write(
+                self.err.fg('red'), self.err.bold, '!!! ', self.err.reset,
+                'Error setting up daemon socket: %s' % (e,))
+            return 1
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            self.refresh()
+            self.err.write('listening on %s' % (path,))
+            self.err.stream.flush()
+            while True:
+                conn, addr = sock.accept()
+                try:
+                    self.handle(conn)
+                finally:
+                    conn.close()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            sock.close()
+            os.unlink(path)
+            pcheck.save_plans(self.options, self.err)
+        return 0
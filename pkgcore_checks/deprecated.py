@@ -3,7 +3,7 @@
 
 from snakeoil.mappings import ImmutableDict
 
-from pkgcore_checks.base import Template, versioned_feed, Result
+from pkgcore_checks.base import Template, versioned_feed, Result, feed_each
 
 
 class DeprecatedEAPI(Result):
@@ -25,13 +25,30 @@ class DeprecatedEAPI(Result):
 class DeprecatedEAPIReport(Template):
 
     feed_type = versioned_feed
+    result_cache_version = 1
+    # eapis-deprecated
+    source_paths = ('metadata/layout.conf',)
     known_results = (DeprecatedEAPI,)
 
     __doc__ = "scan for deprecated EAPIs"
 
     def feed(self, pkg, reporter):
-        if str(pkg.eapi) in pkg.repo.config.eapis_deprecated:
-            reporter.add_report(DeprecatedEAPI(pkg))
+        self.feed_batch((pkg,), reporter)
+
+    def feed_batch(self, pkgs, reporter):
+        # (repo, eapi) -> deprecated or not
+        deprecated = {}
+
+        def feed(pkg, reporter):
+            key = (pkg.repo, pkg.eapi)
+            bad = deprecated.get(key)
+            if bad is None:
+                bad = deprecated[key] = (
+                    str(pkg.eapi) in pkg.repo.config.eapis_deprecated)
+            if bad:
+                reporter.add_report(DeprecatedEAPI(pkg))
+
+        feed_each(self, pkgs, feed, reporter)
 
 
 class DeprecatedEclass(Result):
@@ -61,6 +78,7 @@ class DeprecatedEclass(Result):
 class DeprecatedEclassReport(Template):
 
     feed_type = versioned_feed
+    result_cache_version = 1
     known_results = (DeprecatedEclass,)
 
     blacklist = ImmutableDict({
@@ -129,8 +147,23 @@ class DeprecatedEclassReport(Template):
     __doc__ = "scan for deprecated eclass usage\n\ndeprecated eclasses:%s\n" % \
         ", ".join(sorted(blacklist))
 
+    blacklisted = frozenset(blacklist)
+
     def feed(self, pkg, reporter):
-        bad = set(self.blacklist.keys()).intersection(pkg.inherited)
-        if bad:
-            eclasses = ImmutableDict({old: new for old, new in self.blacklist.iteritems() if old in bad})
-            reporter.add_report(DeprecatedEclass(pkg, eclasses))
+        self.feed_batch((pkg,), reporter)
+
+    def feed_batch(self, pkgs, reporter):
+        # Versions of a package mostly inherit the same eclasses.
+        seen = {}
+
+        def feed(pkg, reporter):
+            inherited = pkg.inherited
+            eclasses = seen.get(inherited)
+            if eclasses is None:
+                bad = self.blacklisted.intersection(inherited)
+                eclasses = seen[inherited] = ImmutableDict(
+                    (old, self.blacklist[old]) for old in bad)
+            if eclasses:
+                reporter.add_report(DeprecatedEclass(pkg, eclasses))
+
+        feed_each(self, pkgs, feed, reporter)
@@ -27,6 +27,8 @@ class DroppedKeywordsReport(Template):
     """scan pkgs for keyword dropping across versions"""
 
     feed_type = package_feed
+    result_cache_version = 1
+    fingerprint_options = ('arches',)
     known_results = (DroppedKeywordWarning,)
 
     def __init__(self, options):
@@ -6,3 +6,15 @@
 
 class ReporterInitError(Exception):
     """Raise this if a reporter factory fails."""
+
+
+class VCSError(Exception):
+    """Raise this if querying version control fails."""
+
+
+class FatalError(Exception):
+    """Raise this to abort the scan; checks are not isolated from it."""
+
+
+class CheckpointError(Exception):
+    """Raise this if a scan cannot be resumed from a checkpoint."""
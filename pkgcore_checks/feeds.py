@@ -3,12 +3,24 @@
 
 """Feed classes: pass groups of packages to other addons."""
 
-from operator import attrgetter
+from collections import deque
+import heapq
+from operator import attrgetter, itemgetter
+import os
+import stat
 
-from pkgcore.restrictions import util
+from pkgcore.ebuild.atom import atom
+from pkgcore.restrictions import boolean, packages, util, values
+from snakeoil.demandload import demandload
+from snakeoil.osutils import listdir, pjoin
 
 from pkgcore_checks import base
 
+demandload('threading')
+
+# Version control dirs, not walked into by DirSnapshot.
+vcs_dirs = frozenset(["cvs", ".svn", ".bzr"])
+
 
 class VersionToEbuild(base.Transform):
 
@@ -32,6 +44,8 @@ class EbuildToVersion(base.Transform):
     scope = base.version_scope
     cost = 5
 
+    unwrap = staticmethod(itemgetter(0))
+
     def feed(self, pair, reporter):
         self.child.feed(pair[0], reporter)
 
@@ -92,19 +106,116 @@ class VersionToCategory(_Collapse):
     keyfunc = attrgetter('category')
 
 
+class DirSnapshot(object):
+
+    """The listing of a directory along with the lstat of every entry.
+
+    Taken the first time it is looked at, and only then, so the checks
+    sharing it (and the threads they defer their file I/O to, see
+    L{base.defer}) never list or stat the directory again.
+
+    :ivar path: the directory.
+    :ivar entries: mapping of the names in it to (mode, size, mtime)
+        tuples.
+    :ivar files: C{None} if there is no files dir (or it was not asked
+        for), otherwise a list of (path relative to the directory, mode,
+        size, mtime) tuples for what is under files/ (version control
+        dirs skipped), parents before their children.
+    """
+
+    def __init__(self, path, walk_files=False):
+        self.path = path
+        self._walk_files = walk_files
+        self._lock = threading.Lock()
+        self._entries = self._files = None
+
+    def _load(self):
+        with self._lock:
+            if self._entries is not None:
+                return
+            entries = {}
+            for name in listdir(self.path):
+                st = os.lstat(pjoin(self.path, name))
+                entries[name] = (st.st_mode, st.st_size, st.st_mtime)
+            files = None
+            mode = entries.get('files', (0,))[0]
+            if self._walk_files and stat.S_ISDIR(mode):
+                files = []
+                unprocessed_dirs = deque(["files"])
+                while unprocessed_dirs:
+                    cwd = unprocessed_dirs.pop()
+                    for name in listdir(pjoin(self.path, cwd)):
+                        path = pjoin(cwd, name)
+                        st = os.lstat(pjoin(self.path, path))
+                        files.append((path, st.st_mode, st.st_size,
+                                      st.st_mtime))
+                        if stat.S_ISDIR(st.st_mode) and \
+                                name not in vcs_dirs:
+                            unprocessed_dirs.append(path)
+            self._files = files
+            self._entries = entries
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._load()
+        return self._entries
+
+    @property
+    def files(self):
+        if self._entries is None:
+            self._load()
+        return self._files
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.path)
+
+
+class PackageToPkgDir(base.Transform):
+
+    """Pair package tuples with a L{DirSnapshot} of their package dir."""
+
+    source = base.package_feed
+    dest = base.pkgdir_feed
+    scope = base.package_scope
+    cost = 10
+
+    def feed(self, pkgset, reporter):
+        self.child.feed(
+            (pkgset, DirSnapshot(os.path.dirname(pkgset[0].path), True)),
+            reporter)
+
+
+class CategoryToCatDir(base.Transform):
+
+    """Pair category tuples with a L{DirSnapshot} of their category dir."""
+
+    source = base.category_feed
+    dest = base.catdir_feed
+    scope = base.category_scope
+    cost = 10
+
+    def feed(self, catset, reporter):
+        self.child.feed(
+            (catset, DirSnapshot(
+                os.path.dirname(os.path.dirname(catset[0].path)))),
+            reporter)
+
+
 class _PackageOrCategoryToRepo(base.Transform):
 
-    def start(self):
-        base.Transform.start(self)
-        self.repo = []
+    """Stream package or category tuples into the repository feed.
 
-    def feed(self, item, reporter):
-        self.repo.append(item)
+    Nothing is held back: the child gets every tuple as it comes in and
+    the end of the repository through its finish method (see
+    L{base.repository_feed}), so these get inlined by
+    L{base.compile_pipeline}.
+    """
 
-    def finish(self, reporter):
-        self.child.feed(repo, reporter)
-        base.Transform.finish(self, reporter)
-        self.repo = None
+    unwrap = staticmethod(lambda item: item)
+
+    def feed(self, item, reporter):
+        self.child.feed(item, reporter)
 
 
 class PackageToRepo(_PackageOrCategoryToRepo):
@@ -153,6 +264,39 @@ class PackageToCategory(base.Transform):
         self.chunk = None
 
 
+def limiter_scope(limiter):
+    """Return the scope of the packages matching limiter."""
+    for scope, attrs in ((base.version_scope, ['fullver', 'version', 'rev']),
+                         (base.package_scope, ['package']),
+                         (base.category_scope, ['category'])):
+        if any(util.collect_package_restrictions(limiter, attrs)):
+            return scope
+    return base.repository_scope
+
+
+def limiter_key(limiter):
+    """Return the (category, package) everything limiter matches is in.
+
+    :return: a tuple, or C{None} if limiter is not limited to one package
+        (or it is not obvious it is).
+    """
+    if isinstance(limiter, atom):
+        return limiter.category, limiter.package
+    if not isinstance(limiter, boolean.AndRestriction) or limiter.negate:
+        return None
+    key = {}
+    for restrict in limiter.restrictions:
+        if isinstance(restrict, packages.PackageRestriction) and \
+                not restrict.negate and \
+                restrict.attr in ('category', 'package') and \
+                isinstance(restrict.restriction, values.StrExactMatch) and \
+                not restrict.restriction.negate:
+            key[restrict.attr] = restrict.restriction.exact
+    if len(key) != 2:
+        return None
+    return key['category'], key['package']
+
+
 class RestrictedRepoSource(object):
 
     feed_type = base.versioned_feed
@@ -161,13 +305,161 @@ class RestrictedRepoSource(object):
     def __init__(self, repo, limiter):
         self.repo = repo
         self.limiter = limiter
-        for scope, attrs in ((base.version_scope, ['fullver', 'version', 'rev']),
-                             (base.package_scope, ['package']),
-                             (base.category_scope, ['category'])):
-            if any(util.collect_package_restrictions(limiter, attrs)):
-                self.scope = scope
-                return
-        self.scope = base.repository_scope
+        self.scope = limiter_scope(limiter)
 
     def feed(self):
         return self.repo.itermatch(self.limiter, sorter=sorted)
+
+
+class MultiTargetSource(object):
+
+    """Source feeding the packages matching any of a number of limiters.
+
+    Limiters tied to one package (plain atoms, mostly) are indexed by
+    that package, so thousands of them cost no more than a few; the rest
+    are matched against every package.  Packages are fed once, in sorted
+    order, even if several limiters match them.  Each (and its package and
+    category) is recorded with the first limiter (in the order given)
+    matching it, see L{target}.
+    """
+
+    feed_type = base.versioned_feed
+    cost = 10
+
+    def __init__(self, repo, limiters):
+        self.repo = repo
+        self.limiters = tuple(limiters)
+        self.limiter = packages.OrRestriction(*self.limiters)
+        # Checks only get what all limiters cover fully.
+        self.scope = min(limiter_scope(x) for x in self.limiters)
+        # (category, package) -> [(index, limiter)]
+        self.keyed = {}
+        self.unkeyed = []
+        for index, limiter in enumerate(self.limiters):
+            key = limiter_key(limiter)
+            if key is None:
+                self.unkeyed.append((index, limiter))
+            else:
+                self.keyed.setdefault(key, []).append((index, limiter))
+        # (category[, package[, fullver]]) -> index of the limiter.
+        self.owners = {}
+
+    def match(self, pkg):
+        """Return the index of the first limiter matching pkg, or C{None}."""
+        candidates = heapq.merge(
+            self.keyed.get((pkg.category, pkg.package), ()), self.unkeyed)
+        for index, limiter in candidates:
+            if limiter.match(pkg):
+                return index
+        return None
+
+    def _iter_keyed(self):
+        for category, package in sorted(self.keyed):
+            restrict = packages.AndRestriction(
+                packages.PackageRestriction(
+                    'category', values.StrExactMatch(category)),
+                packages.PackageRestriction(
+                    'package', values.StrExactMatch(package)))
+            for pkg in self.repo.itermatch(restrict, sorter=sorted):
+                index = self.match(pkg)
+                if index is not None:
+                    yield pkg, index
+
+    def _iter_unkeyed(self):
+        if not self.unkeyed:
+            return
+        restrict = packages.OrRestriction(
+            *(limiter for index, limiter in self.unkeyed))
+        for pkg in self.repo.itermatch(restrict, sorter=sorted):
+            # Those are fed (and matched against everything) by _iter_keyed.
+            if (pkg.category, pkg.package) not in self.keyed:
+                yield pkg, self.match(pkg)
+
+    def feed(self):
+        self.owners.clear()
+        owners = self.owners
+        for pkg, index in heapq.merge(self._iter_keyed(), self._iter_unkeyed()):
+            for key in ((pkg.category,), (pkg.category, pkg.package)):
+                owners[key] = min(owners.get(key, index), index)
+            owners[(pkg.category, pkg.package, pkg.fullver)] = index
+            yield pkg
+
+    def target(self, result):
+        """Return the limiter the package a result is about was fed for.
+
+        :return: a limiter, or C{None} for results not about a fed
+            package (repository wide results for example).
+        """
+        key = ()
+        for attr in ('category', 'package', 'version'):
+            value = getattr(result, attr, None)
+            if value is None:
+                break
+            key += (value,)
+        while key:
+            index = self.owners.get(key)
+            if index is not None:
+                return self.limiters[index]
+            key = key[:-1]
+        return None
+
+
+class TargetReporter(base.Reporter):
+
+    """Splits the results of a L{MultiTargetSource} scan up per target.
+
+    Wraps the real reporter, calling its start_check and end_check methods
+    whenever results start coming in for another target, so reporters see
+    the same targets they would if each was scanned on its own.
+    """
+
+    def __init__(self, reporter, source):
+        base.Reporter.__init__(self)
+        self.reporter = reporter
+        self.source = source
+        self.checks = None
+        self.current = None
+
+    def _switch(self, target):
+        if self.current is not None:
+            self.reporter.end_check()
+        self.reporter.start_check(self.checks, target)
+        self.current = target
+
+    def start_check(self, checks, target):
+        self.checks = checks
+        self._switch(self.source.limiters[0])
+
+    def add_report(self, result):
+        target = self.source.target(result)
+        if target is not None and target is not self.current:
+            self._switch(target)
+        self.reporter.add_report(result)
+
+    def end_check(self):
+        self.reporter.end_check()
+        self.current = None
+
+
+def target_sources(repo, limiters):
+    """Return the sources to scan the packages matching limiters with.
+
+    Limiters of the same scope (see L{limiter_scope}) share a
+    L{MultiTargetSource}, so the checks are set up and fed once for all of
+    them instead of once per limiter.
+    """
+    by_scope = {}
+    scopes = []
+    for limiter in limiters:
+        scope = limiter_scope(limiter)
+        if scope not in by_scope:
+            scopes.append(scope)
+        by_scope.setdefault(scope, []).append(limiter)
+    sources = []
+    for scope in scopes:
+        group = by_scope[scope]
+        if len(group) == 1:
+            sources.append(RestrictedRepoSource(repo, group[0]))
+        else:
+            sources.append(MultiTargetSource(repo, group))
+    return sources
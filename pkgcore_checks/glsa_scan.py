@@ -56,6 +56,8 @@ class TreeVulnerabilitiesReport(base.Template):
 
     feed_type = base.versioned_feed
     known_results = (VulnerablePackage,)
+    source_paths = ('metadata/glsa',)
+    source_options = ('glsa_location',)
 
     @staticmethod
     def mangle_option_parser(parser):
@@ -108,11 +110,14 @@ class TreeVulnerabilitiesReport(base.Template):
         self.options = options
         self.glsa_dir = options.glsa_location
         self.enabled = False
-        self.vulns = {}
+        self.vulns = None
 
     def start(self):
-        if not self.options.glsa_enabled:
+        if not self.options.glsa_enabled or self.vulns is not None:
             return
+        # Parsed once per instance; pcheck --daemon keeps it around
+        # between scans until the glsa dir changes.
+        self.vulns = {}
         # this is a bit brittle
         for r in GlsaDirSet(self.glsa_dir):
             if len(r) > 2:
@@ -121,9 +126,6 @@ class TreeVulnerabilitiesReport(base.Template):
             else:
                 self.vulns.setdefault(r[0].key, []).append(r[1])
 
-    def finish(self, reporter):
-        self.vulns.clear()
-
     def feed(self, pkg, reporter):
         if not self.options.glsa_enabled:
             return
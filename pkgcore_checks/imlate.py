@@ -35,6 +35,8 @@ class ImlateReport(StableCheckAddon):
     """
 
     feed_type = package_feed
+    result_cache_version = 1
+    fingerprint_options = ('arches', 'reference_arches')
     required_addons = (ArchesAddon,)
     known_results = (LaggingStableInfo,)
 
@@ -0,0 +1,404 @@
+# License: BSD/GPL2
+
+"""Memory profiling: which checks and addons a scan's memory goes to.
+
+There is no tracemalloc for python 2, so this works from what is
+available, and the numbers are approximations:
+
+ - Every check and transform of a planned pipeline gets wrapped (see
+   L{pkgcore_checks.base.wrap_checks}) with a L{MemoryCheck} recording
+   the growth of the resident set size during its start, feed and finish
+   calls, exclusive of the checks fed by a transform.  Memory freed back
+   by other code shows up as negative growth; python rarely hands memory
+   back to the system, so small allocations often show up as no growth.
+ - Right before and after its finish call the memory retained by each
+   check is measured by walking what it references (see L{deep_size});
+   addons are measured the same way once the scan is done.  The options,
+   repositories and other addons are not walked into, but whatever else
+   several of them reference is charged to each.
+ - The peak resident set size is noted at the end of every start, feed
+   and finish call, giving the peak per pipeline phase.
+ - Automatic garbage collection is turned off for the scan; instead the
+   generation thresholds are checked after every feed call and the
+   collections they call for are run (and timed) right there.
+"""
+
+import gc
+import sys
+import time
+import types
+
+from pkgcore_checks import base
+
+from snakeoil.demandload import demandload
+demandload(
+    'collections',
+    'resource',
+    'snakeoil.demandload:Placeholder',
+)
+
+phases = ('start', 'feed', 'finish')
+
+# Not descended into (or counted) by deep_size: code and classes, shared
+# by everything.
+_opaque = (
+    type, types.ClassType, types.ModuleType, types.FunctionType,
+    types.BuiltinFunctionType, types.MethodType, types.CodeType,
+    types.FrameType)
+
+
+def current_rss():
+    """Return the resident set size in bytes, or C{None} if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (EnvironmentError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """Return the peak resident set size of the process in bytes."""
+    # kilobytes on linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _referents(obj):
+    if isinstance(obj, dict):
+        for item in obj.iteritems():
+            for x in item:
+                yield x
+        return
+    if isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        for x in obj:
+            yield x
+        return
+    # Not going through getattr: that could trigger __getattr__ hooks
+    # (lazily loading package metadata, say).
+    try:
+        d = object.__getattribute__(obj, '__dict__')
+    except Exception:
+        d = getattr(obj, '__dict__', None) \
+            if isinstance(obj, types.InstanceType) else None
+    if isinstance(d, dict):
+        yield d
+    for klass in type(obj).__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        if isinstance(slots, basestring):
+            slots = (slots,)
+        for slot in slots:
+            if slot in ('__dict__', '__weakref__'):
+                continue
+            descriptor = klass.__dict__.get(slot)
+            if descriptor is None:
+                # Name mangled private slot.
+                descriptor = klass.__dict__.get(
+                    '_%s%s' % (klass.__name__.lstrip('_'), slot))
+            try:
+                yield descriptor.__get__(obj, klass)
+            except Exception:
+                pass
+
+
+def deep_size(obj, skip=()):
+    """Return the approximate number of bytes obj and what it references
+    take, in bytes.
+
+    :param skip: ids of objects not to count or descend into; objects
+        shared with others (options, repositories, other addons).
+    """
+    seen = set(skip)
+    todo = [obj]
+    total = 0
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, _opaque) or type(obj) is Placeholder:
+            continue
+        try:
+            total += sys.getsizeof(obj, 0)
+        except Exception:
+            pass
+        todo.extend(_referents(obj))
+    return total
+
+
+class CheckMemory(object):
+
+    """Memory data for one check or transform class."""
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        # bytes the resident set grew by during the calls of each phase.
+        self.growth = dict.fromkeys(phases, 0)
+        # bytes retained right before and right after finishing.
+        self.retained = self.retained_after = 0
+
+    def merge(self, other):
+        for phase in phases:
+            self.growth[phase] += other.growth[phase]
+        self.retained = max(self.retained, other.retained)
+        self.retained_after = max(self.retained_after, other.retained_after)
+
+    def detach(self):
+        """Return a copy holding the data gathered so far, and reset."""
+        other = CheckMemory(self.name, self.kind)
+        other.merge(self)
+        self.growth = dict.fromkeys(phases, 0)
+        self.retained = self.retained_after = 0
+        return other
+
+    def dump(self):
+        return dict(name=self.name, kind=self.kind, growth=dict(self.growth),
+                    retained=self.retained,
+                    retained_after_finish=self.retained_after)
+
+
+class GCStats(object):
+
+    """Collections run, time spent in them and objects freed per
+    generation."""
+
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.pause = [0.0, 0.0, 0.0]
+        self.max_pause = [0.0, 0.0, 0.0]
+        self.collected = [0, 0, 0]
+
+    def add(self, generation, pause, collected):
+        self.collections[generation] += 1
+        self.pause[generation] += pause
+        self.max_pause[generation] = max(self.max_pause[generation], pause)
+        self.collected[generation] += collected
+
+    def merge(self, other):
+        for i in xrange(3):
+            self.collections[i] += other.collections[i]
+            self.pause[i] += other.pause[i]
+            self.max_pause[i] = max(self.max_pause[i], other.max_pause[i])
+            self.collected[i] += other.collected[i]
+
+    def dump(self):
+        return list(
+            dict(generation=i, collections=self.collections[i],
+                 pause=self.pause[i], max_pause=self.max_pause[i],
+                 collected=self.collected[i])
+            for i in xrange(3))
+
+
+class MemoryCheck(base.CheckWrapper):
+
+    """Wraps a check or transform, charging its memory to a
+    L{MemoryProfile}."""
+
+    def __init__(self, wrapped, profile):
+        base.CheckWrapper.__init__(self, wrapped)
+        self._profile = profile
+        self._target, self._stats = profile.get_stats(wrapped)
+
+    def start(self):
+        token = self._profile.enter()
+        try:
+            self.wrapped.start()
+        finally:
+            self._profile.leave(token, self._stats, 'start')
+
+    def feed(self, item, reporter):
+        token = self._profile.enter()
+        try:
+            self.wrapped.feed(item, reporter)
+        finally:
+            self._profile.leave(token, self._stats, 'feed')
+        self._profile.maybe_collect()
+
+    def feed_batch(self, items, reporter):
+        token = self._profile.enter()
+        try:
+            self.wrapped.feed_batch(items, reporter)
+        finally:
+            self._profile.leave(token, self._stats, 'feed')
+        self._profile.maybe_collect()
+
+    def finish(self, reporter):
+        profile = self._profile
+        stats = self._stats
+        stats.retained = max(stats.retained, profile.size_of(self._target))
+        token = profile.enter()
+        try:
+            self.wrapped.finish(reporter)
+        finally:
+            profile.leave(token, stats, 'finish')
+        stats.retained_after = max(
+            stats.retained_after, profile.size_of(self._target))
+
+
+class MemoryProfile(object):
+
+    """Collects L{CheckMemory} for every wrapped check and transform.
+
+    Follows the instrument protocol of L{pkgcore_checks.parallel}.
+    """
+
+    def __init__(self, shared=()):
+        """Initialize.
+
+        :param shared: objects not charged to the checks, such as the
+            options, the repositories and the addons (see
+            L{measure_addons}).
+        """
+        self.stats = {}
+        self.addons = {}
+        self.peaks = dict.fromkeys(phases, 0)
+        self.gc = GCStats()
+        self._shared = set(id(x) for x in shared)
+        # ids of the wrapped objects, not charged to each other.
+        self._objects = set()
+        # per active call, the rss growth in nested wrapped calls.
+        self._nested = []
+        self._gc_was_enabled = None
+
+    def get_stats(self, obj):
+        """Return the unwrapped object and its L{CheckMemory}."""
+        self._objects.add(id(obj))
+        while isinstance(obj, base.CheckWrapper):
+            obj = obj.wrapped
+            self._objects.add(id(obj))
+        name = '%s.%s' % (obj.__class__.__module__, obj.__class__.__name__)
+        stats = self.stats.get(name)
+        if stats is None:
+            if isinstance(obj, base.Transform):
+                kind = 'transform'
+            else:
+                kind = 'check'
+            stats = self.stats[name] = CheckMemory(name, kind)
+        return obj, stats
+
+    def wrap(self, obj):
+        return MemoryCheck(obj, self)
+
+    def size_of(self, obj):
+        skip = self._shared.union(self._objects)
+        skip.discard(id(obj))
+        return deep_size(obj, skip)
+
+    def measure_addons(self, addons):
+        """Note the memory retained by each of the addons."""
+        skip = self._shared.union(self._objects)
+        skip.update(id(x) for x in addons)
+        for addon in addons:
+            name = '%s.%s' % (
+                addon.__class__.__module__, addon.__class__.__name__)
+            skip.discard(id(addon))
+            size = deep_size(addon, skip)
+            skip.add(id(addon))
+            self.addons[name] = max(self.addons.get(name, 0), size)
+
+    def enter(self):
+        self._nested.append(0)
+        return current_rss()
+
+    def leave(self, token, stats, phase):
+        rss = current_rss()
+        nested = self._nested.pop()
+        if rss is not None and token is not None:
+            growth = rss - token
+            if self._nested:
+                self._nested[-1] += growth
+            stats.growth[phase] += growth - nested
+        self.peaks[phase] = max(self.peaks[phase], peak_rss())
+
+    def start_gc(self):
+        """Take over from the automatic garbage collection."""
+        self._gc_was_enabled = gc.isenabled()
+        gc.disable()
+
+    def stop_gc(self):
+        if self._gc_was_enabled:
+            gc.enable()
+        self._gc_was_enabled = None
+
+    def maybe_collect(self):
+        """Run the collection the automatic collector would have run by
+        now, if any."""
+        if self._gc_was_enabled is None:
+            return
+        counts = gc.get_count()
+        thresholds = gc.get_threshold()
+        generation = None
+        for i in xrange(3):
+            if thresholds[i] and counts[i] > thresholds[i]:
+                generation = i
+        if generation is None:
+            return
+        start = time.time()
+        collected = gc.collect(generation)
+        self.gc.add(generation, time.time() - start, collected)
+
+    def collect(self):
+        """Return the data gathered so far and reset.
+
+        Used to ship data from worker processes to the parent, which
+        feeds it to L{merge}.
+        """
+        data = (dict((name, stats.detach())
+                     for name, stats in self.stats.iteritems()),
+                self.addons, self.peaks, self.gc)
+        self.addons = {}
+        self.peaks = dict.fromkeys(phases, 0)
+        self.gc = GCStats()
+        return data
+
+    def merge(self, data):
+        stats, addons, peaks, gc_stats = data
+        for name, other in stats.iteritems():
+            ours = self.stats.get(name)
+            if ours is None:
+                self.stats[name] = other
+            else:
+                ours.merge(other)
+        for name, size in addons.iteritems():
+            self.addons[name] = max(self.addons.get(name, 0), size)
+        for phase in phases:
+            self.peaks[phase] = max(self.peaks[phase], peaks[phase])
+        self.gc.merge(gc_stats)
+
+    def sorted_stats(self):
+        return sorted(self.stats.itervalues(),
+                      key=lambda x: (-x.retained, x.name))
+
+    def dump(self):
+        """Return the gathered data as a json serializable structure."""
+        return dict(
+            timestamp=time.time(),
+            checks=list(x.dump() for x in self.sorted_stats()),
+            addons=list(dict(name=name, retained=size) for name, size in
+                        sorted(self.addons.iteritems())),
+            peak_rss=dict(self.peaks), gc=self.gc.dump())
+
+    def write_table(self, out):
+        """Write tables of the gathered data to a formatter."""
+        mb = 1024.0 * 1024
+        out.write('%-55s %-9s %10s %10s %10s %11s %11s' % (
+            'check', 'kind', 'start(MB)', 'feed(MB)', 'finish(MB)',
+            'retained', 'after fin.'))
+        for stats in self.sorted_stats():
+            out.write('%-55s %-9s %10.2f %10.2f %10.2f %11.2f %11.2f' % (
+                stats.name, stats.kind, stats.growth['start'] / mb,
+                stats.growth['feed'] / mb, stats.growth['finish'] / mb,
+                stats.retained / mb, stats.retained_after / mb))
+        out.write()
+        out.write('%-55s %11s' % ('addon', 'retained'))
+        for name, size in sorted(self.addons.iteritems(),
+                                 key=lambda x: (-x[1], x[0])):
+            out.write('%-55s %11.2f' % (name, size / mb))
+        out.write()
+        out.write('peak rss: %s' % (', '.join(
+            '%s %.1fMB' % (phase, self.peaks[phase] / mb)
+            for phase in phases),))
+        out.write('gc: %s' % (', '.join(
+            'gen%i %i collections %.3fs (max %.1fms) %i freed' % (
+                i, self.gc.collections[i], self.gc.pause[i],
+                self.gc.max_pause[i] * 1000, self.gc.collected[i])
+            for i in xrange(3)),))
@@ -51,6 +51,7 @@ class LicenseMetadataReport(base.Template):
     known_results = (MetadataError, MissingLicense) + \
         addons.UseAddon.known_results
     feed_type = base.versioned_feed
+    result_cache_version = 1
 
     required_addons = (
         addons.UseAddon, addons.ProfileAddon, addons.LicenseAddon)
@@ -108,6 +109,7 @@ class IUSEMetadataReport(base.Template):
     known_results = (MetadataError,) + addons.UseAddon.known_results
 
     feed_type = base.versioned_feed
+    result_cache_version = 1
 
     def __init__(self, options, iuse_handler):
         base.Template.__init__(self, options)
@@ -151,6 +153,7 @@ class UnusedLocalFlagsReport(base.Template):
     """
 
     feed_type = base.package_feed
+    result_cache_version = 1
     required_addons = (addons.UseAddon,)
     known_results = (UnusedLocalFlags,) + addons.UseAddon.known_results
 
@@ -177,6 +180,7 @@ class DependencyReport(base.Template):
     blocks_getter = attrgetter('blocks')
 
     feed_type = base.versioned_feed
+    result_cache_version = 1
 
     attrs = tuple((x, attrgetter(x)) for x in
                   ("depends", "rdepends", "post_rdepends"))
@@ -229,10 +233,18 @@ class KeywordsReport(base.Template):
     """
 
     feed_type = base.versioned_feed
+    result_cache_version = 1
     known_results = (StupidKeywords, MetadataError)
 
     def feed(self, pkg, reporter):
-        if "-*" in pkg.keywords and len(pkg.keywords) == 1:
+        self.feed_batch((pkg,), reporter)
+
+    def feed_batch(self, pkgs, reporter):
+        base.feed_each(self, pkgs, self._feed, reporter)
+
+    @staticmethod
+    def _feed(pkg, reporter):
+        if len(pkg.keywords) == 1 and "-*" in pkg.keywords:
             reporter.add_report(StupidKeywords(pkg))
 
 
@@ -277,6 +289,7 @@ class SrcUriReport(base.Template):
 
     required_addons = (addons.UseAddon,)
     feed_type = base.versioned_feed
+    result_cache_version = 1
     known_results = (BadProto, MissingUri, MetadataError) + \
         addons.UseAddon.known_results
 
@@ -354,30 +367,45 @@ class DescriptionReport(base.Template):
     """
 
     feed_type = base.versioned_feed
+    result_cache_version = 1
     known_results = (CrappyDescription,)
 
     def feed(self, pkg, reporter):
+        self.feed_batch((pkg,), reporter)
+
+    def feed_batch(self, pkgs, reporter):
+        # Versions of a package mostly share their description.
+        verdicts = {}
+
+        def feed(pkg, reporter):
+            key = (pkg.key, pkg.description)
+            try:
+                msg = verdicts[key]
+            except KeyError:
+                msg = verdicts[key] = self._check(pkg)
+            if msg is not None:
+                reporter.add_report(CrappyDescription(pkg, msg))
+
+        base.feed_each(self, pkgs, feed, reporter)
+
+    @staticmethod
+    def _check(pkg):
         s = pkg.description.lower()
 
         if s.startswith("based on") and "eclass" in s:
-            reporter.add_report(CrappyDescription(
-                pkg, "generic eclass defined description"))
+            return "generic eclass defined description"
 
         elif pkg.package == s or pkg.key == s:
-            reporter.add_report(CrappyDescription(
-                pkg, "using the pkg name as the description isn't very helpful"))
+            return "using the pkg name as the description isn't very helpful"
 
-        else:
-            l = len(pkg.description)
-            if not l:
-                reporter.add_report(CrappyDescription(
-                    pkg, "empty/unset"))
-            elif l > 250:
-                reporter.add_report(CrappyDescription(
-                    pkg, "over 250 chars in length, bit long"))
-            elif l < 5:
-                reporter.add_report(CrappyDescription(
-                    pkg, "under 10 chars in length- too short"))
+        l = len(pkg.description)
+        if not l:
+            return "empty/unset"
+        elif l > 250:
+            return "over 250 chars in length, bit long"
+        elif l < 5:
+            return "under 10 chars in length- too short"
+        return None
 
 
 class BadRestricts(base.Result):
@@ -409,6 +437,7 @@ class BadRestricts(base.Result):
 
 class RestrictsReport(base.Template):
     feed_type = base.versioned_feed
+    result_cache_version = 1
     known_restricts = frozenset((
         "binchecks", "bindist", "fetch", "installsources", "mirror",
         "primaryuri", "splitdebug", "strip", "test", "userpriv",
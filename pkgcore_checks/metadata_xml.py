@@ -26,6 +26,7 @@ demandload(
     'snakeoil.osutils:pjoin',
     'snakeoil:fileutils',
     'tempfile:NamedTemporaryFile',
+    'threading',
 )
 
 
@@ -153,7 +154,6 @@ class base_check(base.Template):
         self.dtd_file = None
 
     def start(self):
-        self.last_seen = None
         refetch = False
         write_path = read_path = self.options.metadata_dtd
         if write_path is None:
@@ -197,19 +197,26 @@ class base_check(base.Template):
     def feed(self, thing, reporter):
         raise NotImplementedError(self.feed)
 
-    def finish(self, reporter):
-        self.last_seen = None
+    def check_file(self, snapshot, *args):
+        """Return the results for the metadata.xml of a directory.
 
-    def check_file(self, loc):
-        if not os.path.exists(loc):
-            return self.missing_error
+        :param snapshot: L{pkgcore_checks.feeds.DirSnapshot} of the
+            directory.
+
+        args are passed on to the result classes after the path of the
+        metadata.xml.  Only does file I/O (and runs xmllint), so it can run
+        in a thread, see L{base.defer}.
+        """
+        loc = pjoin(snapshot.path, "metadata.xml")
+        if "metadata.xml" not in snapshot.entries:
+            return [self.missing_error(loc, *args)]
         ret = self.validator(loc)
         if ret == 0:
-            return None
+            return []
         elif ret == 1:
-            return self.misformed_error
+            return [self.misformed_error(loc, *args)]
         elif ret == 2:
-            return self.invalid_error
+            return [self.invalid_error(loc, *args)]
         raise AssertionError(
             "got %r from validator, which isn't valid" % ret)
 
@@ -217,7 +224,7 @@ class base_check(base.Template):
 class PackageMetadataXmlCheck(base_check):
     """package level metadata.xml scans"""
 
-    feed_type = base.versioned_feed
+    feed_type = base.pkgdir_feed
     scope = base.package_scope
     misformed_error = PkgBadlyFormedXml
     invalid_error = PkgInvalidXml
@@ -225,19 +232,15 @@ class PackageMetadataXmlCheck(base_check):
 
     known_results = (PkgBadlyFormedXml, PkgInvalidXml, PkgMissingMetadataXml)
 
-    def feed(self, pkg, reporter):
-        if self.last_seen == pkg.key:
-            return
-        self.last_seen = pkg.key
-        loc = pjoin(os.path.dirname(pkg.ebuild.path), "metadata.xml")
-        ret = self.check_file(loc)
-        if ret is not None:
-            reporter.add_report(ret(loc, pkg.category, pkg.package))
+    def feed(self, item, reporter):
+        pkgset, snapshot = item
+        base.defer(reporter, self.check_file,
+                   (snapshot, pkgset[0].category, pkgset[0].package))
 
 
 class CategoryMetadataXmlCheck(base_check):
     """metadata.xml scans"""
-    feed_type = base.versioned_feed
+    feed_type = base.catdir_feed
     scope = base.category_scope
     misformed_error = CatBadlyFormedXml
     invalid_error = CatInvalidXml
@@ -247,14 +250,9 @@ class CategoryMetadataXmlCheck(base_check):
 
     dtd_url = "http://www.gentoo.org/dtd/metadata.dtd"
 
-    def feed(self, pkg, reporter):
-        if self.last_seen == pkg.category:
-            return
-        self.last_seen = pkg.category
-        loc = os.path.join(self.base, pkg.category, "metadata.xml")
-        ret = self.check_file(loc)
-        if ret is not None:
-            reporter.add_report(ret(loc, pkg.category))
+    def feed(self, item, reporter):
+        catset, snapshot = item
+        base.defer(reporter, self.check_file, (snapshot, catset[0].category))
 
 
 _libxml2_module = None
@@ -278,6 +276,8 @@ class libxml_parser(object):
         self.libxml2 = module
         self.parsed_dtd = self.libxml2.parseDTD(None, loc)
         self.validator = self.libxml2.newValidCtxt()
+        # The validation context is shared, see base.defer.
+        self.lock = threading.Lock()
 
     def validate(self, loc):
         """
@@ -286,13 +286,14 @@ class libxml_parser(object):
                  1 badly formed
                  2 invalid xml
         """
-        xml = self.libxml2.createFileParserCtxt(loc)
-        xml.parseDocument()
-        if not xml.isValid():
-            return 2
-        elif not xml.doc().validateDtd(self.validator, self.parsed_dtd):
-            return 1
-        return 0
+        with self.lock:
+            xml = self.libxml2.createFileParserCtxt(loc)
+            xml.parseDocument()
+            if not xml.isValid():
+                return 2
+            elif not xml.doc().validateDtd(self.validator, self.parsed_dtd):
+                return 1
+            return 0
 
 
 class xmllint_parser(object):
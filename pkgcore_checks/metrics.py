@@ -0,0 +1,249 @@
+# License: BSD/GPL2
+
+"""Counters, gauges and histograms addons and checks can update cheaply.
+
+Metrics are created on a L{Registry}, usually the module level
+L{registry}, when the module using them is imported::
+
+    lookups = metrics.registry.counter(
+        'pcheck_query_cache_lookups_total', 'Lookups in the query cache.',
+        ('result',))
+    ...
+    lookups.inc(hits, ('hit',))
+
+Label values are passed as a tuple in the order the label names were
+given in.  Updating a metric is a dict update; code in tight loops should
+still count in local variables and update the metric once per feed.
+
+At the end of a run the registry is written out in the Prometheus text
+format (for the textfile collector of node_exporter) and/or as json.
+"""
+
+from bisect import bisect_left
+
+from snakeoil.demandload import demandload
+from snakeoil.mappings import OrderedDict
+
+demandload(
+    'os',
+)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return repr(value)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs)
+
+
+class Metric(object):
+
+    """Base class of the metric types.
+
+    :ivar values: mapping of label value tuples to the data for them.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def merge(self, values):
+        """Merge values (taken from another L{Metric}) into this one."""
+        raise NotImplementedError(self.merge)
+
+    def samples(self):
+        """Yield (name, label pairs, value) tuples for every sample."""
+        for key in sorted(self.values):
+            yield self.name, zip(self.labels, key), self.values[key]
+
+    def dump(self):
+        """Return the data as a list of dicts."""
+        return list({'labels': dict(zip(self.labels, key)),
+                     'value': self.values[key]}
+                    for key in sorted(self.values))
+
+
+class Counter(Metric):
+
+    """A count only ever going up; merged by adding."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def merge(self, values):
+        for key, value in values.iteritems():
+            self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+
+    """A value that goes up and down; merged by keeping the largest."""
+
+    kind = 'gauge'
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+    def merge(self, values):
+        for key, value in values.iteritems():
+            self.values[key] = max(self.values.get(key, value), value)
+
+
+class Histogram(Metric):
+
+    """Counts of observed values per bucket, their sum and their count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, labels=()):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        # A count per bucket (plus one for +Inf), then the sum.
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = [0] * (len(self.buckets) + 1) + [0]
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def merge(self, values):
+        for key, value in values.iteritems():
+            data = self.values.get(key)
+            if data is None:
+                self.values[key] = list(value)
+            else:
+                for i, x in enumerate(value):
+                    data[i] += x
+
+    def _cumulative(self, data):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), data):
+            total += count
+            yield bound, total
+
+    def samples(self):
+        for key in sorted(self.values):
+            data = self.values[key]
+            pairs = zip(self.labels, key)
+            count = 0
+            for bound, count in self._cumulative(data):
+                yield (self.name + '_bucket',
+                       pairs + [('le', _format_value(bound))], count)
+            yield self.name + '_sum', pairs, data[-1]
+            yield self.name + '_count', pairs, count
+
+    def dump(self):
+        result = []
+        for key in sorted(self.values):
+            data = self.values[key]
+            buckets = list(self._cumulative(data))
+            result.append({
+                'labels': dict(zip(self.labels, key)),
+                'buckets': list([_format_value(bound), count]
+                                for bound, count in buckets),
+                'sum': data[-1],
+                'count': buckets[-1][1],
+            })
+        return result
+
+
+class Registry(object):
+
+    """A set of metrics, by name.
+
+    Follows the instrument protocol of L{pkgcore_checks.parallel} so the
+    metrics updated in worker processes get merged (it wraps nothing).
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def _get(self, klass, name, *args):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = klass(name, *args)
+        elif not isinstance(metric, klass):
+            raise ValueError('metric %s is a %s, not a %s' % (
+                name, metric.kind, klass.kind))
+        return metric
+
+    def counter(self, name, help, labels=()):
+        """Return the L{Counter} named name, creating it if needed."""
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        """Return the L{Gauge} named name, creating it if needed."""
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, buckets, labels=()):
+        """Return the L{Histogram} named name, creating it if needed."""
+        return self._get(Histogram, name, help, buckets, labels)
+
+    def wrap(self, obj):
+        return obj
+
+    def collect(self):
+        data = {}
+        for name, metric in self.metrics.iteritems():
+            if metric.values:
+                data[name] = metric.values
+                metric.values = {}
+        return data
+
+    def merge(self, data):
+        for name, values in data.iteritems():
+            metric = self.metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+
+    def dump(self):
+        """Return the metrics as a json-serializable dict."""
+        return dict((name, {'type': metric.kind, 'help': metric.help,
+                            'samples': metric.dump()})
+                    for name, metric in self.metrics.iteritems())
+
+    def write_prometheus(self, f):
+        """Write the metrics to file object f in the Prometheus format."""
+        for name, metric in self.metrics.iteritems():
+            f.write('# HELP %s %s\n' % (
+                name, metric.help.replace('\\', '\\\\').replace('\n', '\\n')))
+            f.write('# TYPE %s %s\n' % (name, metric.kind))
+            for sample, pairs, value in metric.samples():
+                f.write('%s%s %s\n' % (
+                    sample, _format_labels(pairs), _format_value(value)))
+
+    def save_prometheus(self, path):
+        """Write the metrics to path in the Prometheus format, atomically.
+
+        The textfile collector may read the file at any time.
+        """
+        tmp = '%s.%i.tmp' % (path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                self.write_prometheus(f)
+            os.rename(tmp, path)
+        except EnvironmentError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+# The registry addons and checks put their metrics on.
+registry = Registry()
@@ -0,0 +1,193 @@
+# License: BSD/GPL2
+
+"""Overlap the blocking file I/O checks do for many packages.
+
+Checks hand their blocking I/O (directory listings, reading files,
+validating xml...) to L{pkgcore_checks.base.defer}.  While a pipeline is
+fed through a L{Loop} that I/O runs in a thread pool and the next items
+are fed meanwhile, up to a bound on the I/O calls in flight.  The
+callbacks processing what the I/O returned run in the scanning thread,
+oldest first.
+
+Everything reported while feeding an item is held back until the I/O
+deferred for it is done, then handed to the real reporter in exactly the
+order a plain serial run would have reported it in.
+"""
+
+from snakeoil.demandload import demandload
+
+demandload(
+    'collections',
+    'logging',
+    'multiprocessing.pool:ThreadPool',
+)
+
+
+def feed_pipeline(pipe, items, reporter, loop=None):
+    """Feed items to pipe and finish it, through loop if not C{None}.
+
+    Does not call pipe.start.
+    """
+    if loop is not None:
+        loop.run(pipe, items, reporter)
+        return
+    for item in items:
+        pipe.feed(item, reporter)
+    pipe.finish(reporter)
+
+
+class _Deferred(object):
+
+    __slots__ = ('slot', 'job', 'callback', 'results')
+
+    def __init__(self, slot, job, callback):
+        self.slot = slot
+        self.job = job
+        self.callback = callback
+        self.results = []
+
+
+class _SlotReporter(object):
+
+    """Collects what gets reported for one fed item, in order.
+
+    The entries are lists of results and the L{_Deferred}s whose results
+    go in between.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._target = []
+        self.entries = [self._target]
+        self.pending = 0
+        self.completing = False
+
+    def add_report(self, result):
+        self._target.append(result)
+
+    def defer(self, func, args, callback):
+        if self.completing:
+            # Deferring from a callback; no point in another round trip.
+            callback(func(*args))
+            return
+        deferred = _Deferred(
+            self, self._loop._pool.apply_async(func, args), callback)
+        self._target = []
+        self.entries.extend((deferred, self._target))
+        self.pending += 1
+        self._loop._queue.append(deferred)
+
+    def __getattr__(self, attr):
+        return getattr(self._loop._reporter, attr)
+
+
+class Loop(object):
+
+    """Feeds pipelines, running deferred I/O in a thread pool.
+
+    Follows the instrument protocol of L{pkgcore_checks.parallel} so the
+    counters of worker processes get merged (it wraps nothing).
+    """
+
+    def __init__(self, concurrency, threads=8):
+        """Initialize.
+
+        :param concurrency: maximum number of deferred I/O calls in flight.
+        :param threads: size of the thread pool, at most concurrency.
+        """
+        self.concurrency = concurrency
+        self.threads = max(1, min(threads, concurrency))
+        self.calls = self.waited = 0
+        self._pool = self._reporter = None
+        self._queue = self._slots = None
+
+    def run(self, pipe, items, reporter):
+        """Feed items to pipe and finish it.
+
+        The thread pool only lives for the call, so this is safe to use
+        in forked worker processes.  Does not call pipe.start.
+        """
+        self._reporter = reporter
+        self._queue = collections.deque()
+        self._slots = collections.deque()
+        self._pool = ThreadPool(self.threads)
+        try:
+            for item in items:
+                pipe.feed(item, self._slot())
+                self._progress()
+            self._drain()
+            pipe.finish(self._slot())
+            self._drain()
+        finally:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = self._reporter = None
+            self._queue = self._slots = None
+
+    def _slot(self):
+        slot = _SlotReporter(self)
+        self._slots.append(slot)
+        return slot
+
+    def _complete(self, deferred):
+        self.calls += 1
+        if not deferred.job.ready():
+            self.waited += 1
+            # Polling keeps it interruptible.
+            while not deferred.job.ready():
+                deferred.job.wait(0.1)
+        slot = deferred.slot
+        saved = slot._target
+        slot._target = deferred.results
+        slot.completing = True
+        try:
+            deferred.callback(deferred.job.get())
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            logging.exception('deferred call for %r raised', deferred.callback)
+        finally:
+            slot._target = saved
+            slot.completing = False
+            slot.pending -= 1
+
+    def _progress(self):
+        queue = self._queue
+        # Bounding the held back items too bounds the memory they take.
+        while queue and (queue[0].job.ready() or
+                         len(queue) > self.concurrency or
+                         len(self._slots) > self.concurrency):
+            self._complete(queue.popleft())
+        self._emit()
+
+    def _drain(self):
+        while self._queue:
+            self._complete(self._queue.popleft())
+        self._emit()
+
+    def _emit(self):
+        slots = self._slots
+        add_report = self._reporter.add_report
+        while slots and not slots[0].pending:
+            for entry in slots.popleft().entries:
+                if isinstance(entry, _Deferred):
+                    entry = entry.results
+                for result in entry:
+                    add_report(result)
+
+    def wrap(self, obj):
+        return obj
+
+    def collect(self):
+        counts = (self.calls, self.waited)
+        self.calls = self.waited = 0
+        return counts
+
+    def merge(self, counts):
+        self.calls += counts[0]
+        self.waited += counts[1]
+
+    def summary(self):
+        """Return a line describing the counters."""
+        return 'overlapped io: %i deferred calls, %i waited for, ' \
+            'concurrency %i' % (self.calls, self.waited, self.concurrency)
@@ -0,0 +1,226 @@
+# License: BSD/GPL2
+
+"""Fork based parallel scanning, sharding the target repo by category.
+
+Addons are instantiated once in the parent; the worker processes are
+forked afterwards and inherit them (including the expensive ones such as
+the profile addon).  Each worker runs the planned pipeline over a
+contiguous run of categories and ships the results back to the parent,
+which hands them to the real reporter in category order.
+
+Sinks that need to see the whole repository (repository scope) cannot be
+sharded; those run in the parent over the full package stream while the
+workers are busy.
+"""
+
+from pkgcore.restrictions import packages, values
+from snakeoil.demandload import demandload
+
+from pkgcore_checks import base
+
+demandload(
+    'itertools',
+    'multiprocessing',
+    'pkgcore_checks:overlap',
+)
+
+# Each worker gets this many shards on average.  More shards balance
+# uneven category sizes better but pay the pipeline start/finish cost
+# (dtd loading, glsa parsing...) once per shard.
+shards_per_job = 4
+
+
+class CollectingReporter(base.Reporter):
+
+    """Reporter just accumulating results for replaying them later."""
+
+    def __init__(self):
+        base.Reporter.__init__(self)
+        self.results = []
+
+    def add_report(self, result):
+        self.results.append(result)
+
+
+def split_sinks(sinks):
+    """Split sinks into those that can be sharded and those that cannot.
+
+    :return: two lists; sinks safe to run per category, and the
+        repository scope sinks that have to see every package. Addon
+        sinks (query caches for example) required by both end up in both.
+    """
+    by_class = dict((sink.__class__, sink) for sink in sinks)
+
+    def closure(roots):
+        result = []
+        seen = set()
+        todo = list(sink.__class__ for sink in roots)
+        while todo:
+            klass = todo.pop()
+            if klass in seen:
+                continue
+            seen.add(klass)
+            sink = by_class.get(klass)
+            if sink is not None:
+                result.append(sink)
+            todo.extend(klass.required_addons)
+        return result
+
+    sharded = closure(
+        sink for sink in sinks if sink.scope < base.repository_scope)
+    serial = closure(
+        sink for sink in sinks if sink.scope >= base.repository_scope)
+    return sharded, serial
+
+
+def shard_categories(categories, count):
+    """Split a sorted sequence of categories into contiguous shards."""
+    categories = list(categories)
+    if not categories:
+        return []
+    count = max(1, min(count, len(categories)))
+    size, extra = divmod(len(categories), count)
+    shards = []
+    start = 0
+    for i in xrange(count):
+        end = start + size + (i < extra)
+        shards.append(tuple(categories[start:end]))
+        start = end
+    return shards
+
+
+def plug_split(sinks, transforms, source, debug=None):
+    """Plug the sinks L{split_sinks} splits up separately.
+
+    :return: two lists of pipelines (not yet compiled); those running
+        per category and those that have to be fed every package.
+    """
+    pipes = []
+    for part in split_sinks(sinks):
+        plugged = ()
+        if part:
+            bad, plugged = base.plug(part, transforms, [source], debug)
+            assert not bad, \
+                'sinks became unreachable when sharding: %r' % (bad,)
+        pipes.append(list(pipe for src, pipe in plugged))
+    return pipes
+
+
+# Set in the parent right before forking, inherited by the workers.
+_worker_state = None
+
+
+def iter_shard(repo, limiter, categories):
+    """Iterate over the packages matching limiter in the given categories."""
+    return itertools.chain.from_iterable(
+        repo.itermatch(
+            packages.AndRestriction(
+                limiter,
+                packages.PackageRestriction(
+                    'category', values.StrExactMatch(category))),
+            sorter=sorted)
+        for category in categories)
+
+
+def _scan_shard(categories):
+    repo, limiter, pipes, instruments, prefetch, io_loop, progress = \
+        _worker_state
+    reporter = CollectingReporter()
+    for pipe in pipes:
+        pipe.start()
+        pkgs = iter_shard(repo, limiter, categories)
+        if prefetch is not None:
+            pkgs = prefetch.iter(pkgs)
+        if progress is not None:
+            pkgs = progress.count(pkgs)
+        overlap.feed_pipeline(pipe, pkgs, reporter, io_loop)
+    return reporter.results, list(x.collect() for x in instruments)
+
+
+def run_sharded(repo, limiter, source, sinks, transforms, reporter, jobs,
+                debug=None, instruments=(),
+                batch_size=base.default_batch_size, prefetch=None,
+                io_loop=None, progress=None):
+    """Run sinks over source using jobs worker processes.
+
+    :param repo: the repository source iterates over.
+    :param limiter: the restriction source was created for.
+    :param source: a repository scope source.
+    :param sinks: reachable sink instances.
+    :param transforms: transform classes available to plug.
+    :param reporter: reporter results are forwarded to.
+    :param jobs: number of worker processes.
+    :param debug: A logging function or C{None}.
+    :param instruments: objects with a C{wrap} method passed to
+        L{base.wrap_checks} for every pipeline, a C{collect} method
+        returning (and resetting) the gathered data and a C{merge} method
+        taking such data.  Worker data is merged into them.
+    :param batch_size: passed to L{base.compile_pipeline}.
+    :param prefetch: C{None} or a L{pkgcore_checks.prefetch.Prefetcher}
+        to warm the packages with, in the workers too.  Pass it in
+        instruments as well to get the worker counters merged.
+    :param io_loop: C{None} or a L{pkgcore_checks.overlap.Loop} to feed
+        the pipelines through, same as prefetch.
+    :param progress: C{None} or a L{pkgcore_checks.progress.Progress}
+        counting the packages the workers feed, same as prefetch.  The
+        repository wide sinks are not counted.
+    """
+    global _worker_state
+    shard_pipes, serial_pipes = plug_split(sinks, transforms, source, debug)
+    for instrument in instruments:
+        for pipe in shard_pipes + serial_pipes:
+            base.wrap_checks(pipe, instrument.wrap)
+    shard_pipes = list(base.compile_pipeline(pipe, batch_size)
+                       for pipe in shard_pipes)
+    serial_pipes = list(base.compile_pipeline(pipe, batch_size)
+                        for pipe in serial_pipes)
+
+    pool = None
+    shard_results = ()
+    if shard_pipes:
+        shards = shard_categories(
+            sorted(repo.categories), jobs * shards_per_job)
+        if progress is not None:
+            progress.expect(repo, limiter, len(shard_pipes))
+        if debug is not None:
+            debug('running %i shards in %i processes', len(shards), jobs)
+        _worker_state = (
+            repo, limiter, shard_pipes, instruments, prefetch, io_loop,
+            progress)
+        # Workers must not inherit (and report back) what was gathered so far.
+        saved = list(x.collect() for x in instruments)
+        try:
+            pool = multiprocessing.Pool(jobs)
+        finally:
+            _worker_state = None
+            for instrument, data in zip(instruments, saved):
+                instrument.merge(data)
+        # imap keeps the shard order, so results come back sorted.
+        shard_results = pool.imap(_scan_shard, shards)
+        pool.close()
+
+    try:
+        # Run the repository wide sinks while the workers are busy; their
+        # results are held back so the output order matches a serial run.
+        serial_reporter = CollectingReporter()
+        for pipe in serial_pipes:
+            pipe.start()
+            pkgs = source.feed()
+            if prefetch is not None:
+                pkgs = prefetch.iter(pkgs)
+            overlap.feed_pipeline(pipe, pkgs, serial_reporter, io_loop)
+
+        for results, data in shard_results:
+            for result in results:
+                reporter.add_report(result)
+            for instrument, x in zip(instruments, data):
+                instrument.merge(x)
+        for result in serial_reporter.results:
+            reporter.add_report(result)
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
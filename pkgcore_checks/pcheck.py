@@ -16,13 +16,17 @@ demandload(
     'logging',
     'optparse',
     'os',
+    'sys',
     'textwrap',
-    'pkgcore.ebuild:repository',
+    'pkgcore.ebuild:atom,cpv,repository',
     'pkgcore.restrictions:packages',
     'pkgcore.restrictions.values:StrExactMatch',
     'pkgcore.repository:multiplex',
-    'snakeoil.osutils:abspath',
-    'pkgcore_checks:errors',
+    'snakeoil.osutils:abspath,pjoin',
+    'json',
+    'pkgcore_checks:addons,checkpoint,daemon,errors,memory,metrics,overlap,'
+    'parallel,plugin_registry,prefetch,progress,result_cache,timing,vcs',
+    'pkgcore.ebuild:repo_objs',
 )
 
 
@@ -70,6 +74,7 @@ class OptionParser(commandline.OptionParser):
         self.set_default('guessed_target_repo', False)
         self.set_default('guessed_suite', False)
         self.set_default('default_suite', False)
+        self.set_default('profile_limiter', None)
 
         group = self.add_option_group('Check selection')
         group.add_option(
@@ -106,6 +111,127 @@ class OptionParser(commandline.OptionParser):
         self.add_option(
             '--list-reporters', action='store_true', default=False,
             help="print known reporters")
+        self.add_option(
+            '--targets-file', action='store', type='string', default=None,
+            metavar='FILE',
+            help="read extended atoms to scan from FILE ('-' for stdin), "
+            "whitespace separated, '#' starting a comment; scanned together "
+            "with any given as arguments")
+        self.add_option(
+            '--since', action='store', type='string', default=None,
+            metavar='REF',
+            help="scan what changed in the target repo's git work tree "
+            "since REF (a branch, tag or commit) instead of taking targets: "
+            "changed packages, packages inheriting changed eclasses and, "
+            "for profile changes, the packages keyworded for the affected "
+            "arches (profile dependent checks only)")
+        self.add_option(
+            '--plan-cache', action='store', type='string', default=None,
+            metavar='FILE',
+            help="keep the planned check pipelines in FILE to reuse them in "
+            "later runs (they are always reused within a run)")
+        self.add_option(
+            '--jobs', '-j', action='store', type='int', default=1,
+            help="number of processes to scan with; full repo scans are "
+            "split up by category over this many forked processes, and the "
+            "profiles are loaded by as many")
+        self.add_option(
+            '--batch-size', action='store', type='int',
+            default=base.default_batch_size, metavar='N',
+            help="feed checks able to process many packages at once up to "
+            "N at a time, 1 to feed every check one item at a time "
+            "(default %default)")
+        self.add_option(
+            '--prefetch', action='store', type='int', default=0, metavar='N',
+            help="load the metadata, ebuilds and package dirs of the next N "
+            "packages in background threads while the checks run; 0 "
+            "(the default) disables it")
+        self.add_option(
+            '--io-concurrency', action='store', type='int', default=0,
+            metavar='N',
+            help="overlap the file I/O of checks supporting it (package dir "
+            "and metadata.xml scans) for up to N packages, running it in "
+            "background threads; results are still reported in order. 0 "
+            "(the default) disables it")
+        self.add_option(
+            '--progress', action='store_true', default=False,
+            help="print the number of packages and versions scanned, the "
+            "current category, the packages scanned per second and an "
+            "estimate of the time left to stderr while scanning")
+        self.add_option(
+            '--progress-file', action='store', type='string', default=None,
+            metavar='FILE',
+            help="keep the same progress information in FILE as json, "
+            "rewritten every few seconds (for CI)")
+        self.add_option(
+            '--checkpoint', action='store', type='string', default=None,
+            metavar='DIR',
+            help="scan a full repo a category at a time, saving the "
+            "categories done, their results and the state of the repository "
+            "wide checks in DIR every minute so --resume can carry on from "
+            "there if the scan gets killed")
+        self.add_option(
+            '--resume', action='store_true', default=False,
+            help="carry on from the checkpoint left in the --checkpoint "
+            "directory, if any; the output is that of an uninterrupted scan")
+
+        caching = self.add_option_group('Result cache')
+        caching.add_option(
+            '--no-cache', action='store_false', dest='cache', default=True,
+            help="neither use nor update the on disk cache of check results")
+        caching.add_option(
+            '--rebuild-cache', action='store_true', default=False,
+            help="ignore cached check results, replacing them with fresh ones")
+        caching.add_option(
+            '--cache-dir', action='store', type='string', default=None,
+            help="directory to cache check results in, defaults to "
+            "$XDG_CACHE_HOME/pkgcore-checks/results")
+        caching.add_option(
+            '--cache-size', action='store', type='int', default=256,
+            metavar='MB',
+            help="size the result cache is kept below by evicting the least "
+            "recently checked packages, in MB (default %default)")
+
+        profiling = self.add_option_group('Profiling')
+        profiling.add_option(
+            '--timings', action='store_true', default=False,
+            help="print a table of the time spent in each check and "
+            "transform to stderr when done")
+        profiling.add_option(
+            '--timings-file', action='store', type='string', default=None,
+            help="write the per check and transform timings to this file "
+            "as json")
+        profiling.add_option(
+            '--memory-profile', action='store_true', default=False,
+            help="print tables of the memory used by each check, transform "
+            "and addon, the peak memory use per phase and the garbage "
+            "collection pauses to stderr when done; slows down the scan")
+        profiling.add_option(
+            '--memory-profile-file', action='store', type='string',
+            default=None,
+            help="write the memory profile to this file as json")
+        profiling.add_option(
+            '--metrics-file', action='store', type='string', default=None,
+            metavar='FILE',
+            help="write the hit rates of the addon and check caches (and "
+            "other metrics) to FILE in the Prometheus text format, e.g. "
+            "for the textfile collector of node_exporter")
+        profiling.add_option(
+            '--metrics-json', action='store', type='string', default=None,
+            metavar='FILE',
+            help="write the same metrics to FILE as json")
+
+        server = self.add_option_group('Daemon')
+        server.add_option(
+            '--daemon', action='store', type='string', default=None,
+            metavar='SOCKET',
+            help="set up the addons once and serve scans requested with "
+            "--connect on this unix socket instead of scanning")
+        server.add_option(
+            '--connect', action='store', type='string', default=None,
+            metavar='SOCKET',
+            help="have the pcheck --daemon listening on this unix socket "
+            "run the scan; results are written by the local reporter")
 
         overlay = self.add_option_group('Overlay')
         overlay.add_option(
@@ -114,30 +240,115 @@ class OptionParser(commandline.OptionParser):
             help="if the target repository is an overlay, specify the "
             "repository name to pull profiles/license from")
 
-        all_addons = set()
+        # The options of the addons are added once they are known to be
+        # needed: for the checks selected in check_values, for options
+        # given on the command line (see _match_long_opt and
+        # _process_short_opts) or for --help.
+        self.plugin_registry = plugin_registry.load()
+        self.mangled_addons = set()
 
-        def add_addon(addon):
-            if addon not in all_addons:
-                all_addons.add(addon)
-                for dep in addon.required_addons:
-                    add_addon(dep)
-        for check in get_plugins('check', plugins):
-            add_addon(check)
-        for addon in all_addons:
-            addon.mangle_option_parser(self)
+    def add_addon_options(self, addons):
+        """Add the options of addons (classes), unless already added."""
+        for addon in addons:
+            if addon not in self.mangled_addons:
+                self.mangled_addons.add(addon)
+                addon.mangle_option_parser(self)
+
+    def _load_addon_options(self, names):
+        self.add_addon_options(
+            self.plugin_registry.load_addon(name) for name in names)
+
+    def _match_long_opt(self, opt):
+        self._load_addon_options(self.plugin_registry.option_addons(opt))
+        return commandline.OptionParser._match_long_opt(self, opt)
+
+    def _process_short_opts(self, rargs, values):
+        for char in rargs[0][1:]:
+            opt = '-' + char
+            option = self._short_opt.get(opt)
+            if option is None:
+                self._load_addon_options(
+                    self.plugin_registry.option_addons(opt))
+                option = self._short_opt.get(opt)
+            if option is not None and option.takes_value():
+                # The rest is its value.
+                break
+        return commandline.OptionParser._process_short_opts(
+            self, rargs, values)
+
+    def format_option_help(self, formatter=None):
+        self._load_addon_options(self.plugin_registry.addons())
+        return commandline.OptionParser.format_option_help(self, formatter)
 
     def check_values(self, values, args):
         values, args = commandline.OptionParser.check_values(
             self, values, args)
-        # XXX hack...
-        values.checks = sorted(lists.unstable_unique(
-            get_plugins('check', plugins)),
-            key=lambda x: x.__name__)
+        # Stand-ins for the check classes, loaded once the selection is done.
+        values.checks = sorted(
+            self.plugin_registry.checks(), key=lambda x: x.__name__)
         if values.list_checks or values.list_reporters:
+            values.checks = list(x.load() for x in values.checks)
             if values.list_reporters == values.list_checks:
                 raise optparse.OptionValueError(
                     "--list-checks and --list-reporters are mutually exclusive")
             return values, ()
+        if values.jobs < 1:
+            self.error('--jobs must be at least 1, got %i' % (values.jobs,))
+        if values.resume and values.checkpoint is None:
+            self.error('--resume requires --checkpoint')
+        if values.checkpoint is not None and values.jobs > 1:
+            self.error('--checkpoint and --jobs are mutually exclusive')
+        if values.prefetch < 0:
+            self.error('--prefetch must not be negative, got %i' % (
+                values.prefetch,))
+        if values.io_concurrency < 0:
+            self.error('--io-concurrency must not be negative, got %i' % (
+                values.io_concurrency,))
+        if values.batch_size < 1:
+            self.error('--batch-size must be at least 1, got %i' % (
+                values.batch_size,))
+        if values.cache_size < 0:
+            self.error('--cache-size must not be negative, got %i' % (
+                values.cache_size,))
+        if values.cache_dir is None:
+            values.cache_dir = result_cache.default_location()
+        if values.targets_file is not None:
+            try:
+                if values.targets_file == '-':
+                    args = list(args) + read_targets(sys.stdin)
+                else:
+                    with open(values.targets_file) as f:
+                        args = list(args) + read_targets(f)
+            except EnvironmentError, e:
+                self.error('failed reading --targets-file: %s' % (e,))
+            if not args:
+                # Do not fall back to scanning based on cwd.
+                self.error('no targets to scan in %s' % (
+                    values.targets_file,))
+        if values.connect is not None:
+            if values.daemon is not None:
+                self.error('--daemon and --connect are mutually exclusive')
+            if values.since is not None:
+                self.error('--since and --connect are mutually exclusive')
+            # Everything else is up to the daemon.
+            self.check_reporter(values)
+            values.targets = args
+            return values, ()
+        if values.daemon is not None and args:
+            self.error('--daemon takes no targets, pass them to --connect')
+        if values.since is not None:
+            if args:
+                self.error('--since and targets are mutually exclusive')
+            if values.daemon is not None:
+                self.error('--since and --daemon are mutually exclusive')
+        ebuild_paths = [x for x in args if is_ebuild_path(x)]
+        if ebuild_paths and values.target_repo is None:
+            # The ebuild paths name their repo, no need to guess.
+            values.target_repo = ebuild_repo(values.config, ebuild_paths[0])
+            if values.target_repo is None:
+                self.error(
+                    '%s is not an ebuild of a configured ebuild repo' % (
+                        ebuild_paths[0],))
         cwd = None
         if values.suite is None:
             # No suite explicitly specified. Use the repo to guess the suite.
@@ -218,36 +429,7 @@ class OptionParser(commandline.OptionParser):
                         ', '.join(str(repo) for repo in candidates),))
             values.target_repo = tuple(candidates)[0]
 
-        if values.reporter is None:
-            values.reporter = values.config.get_default(
-                'pcheck_reporter_factory')
-            if values.reporter is None:
-                values.reporter = get_plugin('reporter', plugins)
-            if values.reporter is None:
-                self.error(
-                    'no config defined reporter found, nor any default '
-                    'plugin based reporters')
-        else:
-            func = values.config.pcheck_reporter_factory.get(values.reporter)
-            if func is None:
-                func = list(base.Whitelist([values.reporter]).filter(
-                    get_plugins('reporter', plugins)))
-                if not func:
-                    self.error(
-                        "no reporter matches %r\n"
-                        "please see --list-reporter for a list of "
-                        "valid reporters" % values.reporter)
-                elif len(func) > 1:
-                    self.error(
-                        "--reporter %r matched multiple reporters, "
-                        "must match one. %r" % (
-                            values.reporter,
-                            tuple(sorted("%s.%s" % (x.__module__, x.__name__)
-                                         for x in func))
-                        )
-                    )
-                func = func[0]
-            values.reporter = func
+        self.check_reporter(values)
         if values.src_repo is None:
             values.src_repo = values.target_repo
             values.search_repo = values.target_repo
@@ -261,8 +443,40 @@ class OptionParser(commandline.OptionParser):
                 values.repo_bases.append(abspath(repo.base))
 
         if args:
-            values.limiters = lists.stable_unique(
-                map(parserestrict.parse_match, args))
+            limiters = []
+            for target in args:
+                if target in ebuild_paths:
+                    repo_base = getattr(values.target_repo, 'base', None)
+                    limiter = None
+                    if repo_base is not None:
+                        limiter = ebuild_limiter(repo_base, target)
+                    if limiter is None:
+                        self.error(
+                            '%s is not an ebuild of the target repo' % (
+                                target,))
+                else:
+                    limiter = parserestrict.parse_match(target)
+                limiters.append(limiter)
+            values.limiters = lists.stable_unique(limiters)
+        elif values.since is not None:
+            if not isinstance(values.target_repo, repository.UnconfiguredTree):
+                self.error(
+                    '--since needs a target repo that is a single ebuild '
+                    'repo, got %r' % (values.target_repo,))
+            if getattr(values, 'profiles_dir', None):
+                profiles_obj = repo_objs.BundledProfiles(values.profiles_dir)
+            else:
+                profiles_obj = values.target_repo.config.profiles
+            try:
+                changes = vcs.changes_since(
+                    values.target_repo, profiles_obj, values.since)
+            except errors.VCSError, e:
+                self.error(str(e))
+            values.limiters, values.profile_limiter = vcs.limiters(
+                values.target_repo, changes)
+        elif values.daemon is not None:
+            # Targets come with each scan request.
+            values.limiters = []
         else:
             repo_base = getattr(values.target_repo, 'base', None)
             if not repo_base:
@@ -270,25 +484,13 @@ class OptionParser(commandline.OptionParser):
                     'Either specify a target repo that is not multi-tree or '
                     'one or more extended atoms to scan '
                     '("*" for the entire repo).')
-            cwd = abspath(os.getcwd())
-            repo_base = abspath(repo_base)
-            if not cwd.startswith(repo_base):
+            cwd = os.getcwd()
+            values.limiters = cwd_limiters(repo_base, cwd)
+            if values.limiters is None:
                 self.error(
                     'Working dir (%s) is not inside target repo (%s). Fix '
                     'that or specify one or more extended atoms to scan.' % (
-                        cwd, repo_base))
-            bits = list(p for p in cwd[len(repo_base):].split(os.sep) if p)
-            if not bits:
-                values.limiters = [packages.AlwaysTrue]
-            elif len(bits) == 1:
-                values.limiters = [packages.PackageRestriction(
-                    'category', StrExactMatch(bits[0]))]
-            else:
-                values.limiters = [packages.AndRestriction(
-                    packages.PackageRestriction(
-                        'category', StrExactMatch(bits[0])),
-                    packages.PackageRestriction(
-                        'package', StrExactMatch(bits[1])))]
+                        abspath(cwd), abspath(repo_base)))
 
         if values.checkset is None:
             values.checkset = values.config.get_default('pcheck_checkset')
@@ -305,6 +507,7 @@ class OptionParser(commandline.OptionParser):
 
         if not values.checks:
             self.error('No active checks')
+        values.checks = list(x.load() for x in values.checks)
 
         values.addons = set()
 
@@ -315,6 +518,12 @@ class OptionParser(commandline.OptionParser):
                     add_addon(dep)
         for check in values.checks:
             add_addon(check)
+        self.add_addon_options(values.addons)
+        # Give the options added just now their defaults.
+        defaults = self.get_default_values()
+        for dest in self.defaults:
+            if not hasattr(values, dest):
+                setattr(values, dest, getattr(defaults, dest))
         try:
             for addon in values.addons:
                 addon.check_values(values)
@@ -325,6 +534,136 @@ class OptionParser(commandline.OptionParser):
 
         return values, ()
 
+    def check_reporter(self, values):
+        """Resolve values.reporter to a reporter factory."""
+        if values.reporter is None:
+            values.reporter = values.config.get_default(
+                'pcheck_reporter_factory')
+            if values.reporter is None:
+                values.reporter = get_plugin('reporter', plugins)
+            if values.reporter is None:
+                self.error(
+                    'no config defined reporter found, nor any default '
+                    'plugin based reporters')
+        else:
+            func = values.config.pcheck_reporter_factory.get(values.reporter)
+            if func is None:
+                func = list(base.Whitelist([values.reporter]).filter(
+                    get_plugins('reporter', plugins)))
+                if not func:
+                    self.error(
+                        "no reporter matches %r\n"
+                        "please see --list-reporter for a list of "
+                        "valid reporters" % values.reporter)
+                elif len(func) > 1:
+                    self.error(
+                        "--reporter %r matched multiple reporters, "
+                        "must match one. %r" % (
+                            values.reporter,
+                            tuple(sorted("%s.%s" % (x.__module__, x.__name__)
+                                         for x in func))
+                        )
+                    )
+                func = func[0]
+            values.reporter = func
+
+
+def save_plans(options, err):
+    """Save the planned pipelines if --plan-cache was passed."""
+    if options.plan_cache is None:
+        return
+    try:
+        base.plan_cache.save(options.plan_cache)
+    except EnvironmentError, e:
+        err.write(
+            err.fg('red'), err.bold, '!!! ', err.reset,
+            'Error saving pipeline plans: ', e)
+    if options.debug:
+        err.write('plan cache: %i hits, %i misses' % (
+            base.plan_cache.hits, base.plan_cache.misses))
+
+
+def save_profile_cache(addons_map):
+    """Save the profile data loaded while scanning, see L{pkgcore_checks.profile_cache}."""
+    profile_addon = addons_map.get(addons.ProfileAddon)
+    if profile_addon is not None:
+        profile_addon.save_cache()
+
+
+def read_targets(stream):
+    """Return the whitespace separated targets in a file, minus comments."""
+    targets = []
+    for line in stream:
+        targets.extend(line.split('#', 1)[0].split())
+    return targets
+
+
+def cwd_limiters(repo_base, cwd):
+    """Return the limiters scanning what cwd points at in a repo.
+
+    :return: a list of restrictions, or C{None} if cwd is not inside
+        repo_base.
+    """
+    cwd = abspath(cwd)
+    repo_base = abspath(repo_base)
+    if not cwd.startswith(repo_base):
+        return None
+    bits = list(p for p in cwd[len(repo_base):].split(os.sep) if p)
+    if not bits:
+        return [packages.AlwaysTrue]
+    elif len(bits) == 1:
+        return [packages.PackageRestriction(
+            'category', StrExactMatch(bits[0]))]
+    return [packages.AndRestriction(
+        packages.PackageRestriction('category', StrExactMatch(bits[0])),
+        packages.PackageRestriction('package', StrExactMatch(bits[1])))]
+
+
+def is_ebuild_path(target):
+    """Return whether target (from the commandline) is an ebuild file."""
+    return target.endswith('.ebuild') and os.path.isfile(target)
+
+
+def ebuild_repo(config, path):
+    """Return the configured repo the ebuild at path is in, or C{None}.
+
+    Only the repo the path itself points at (three levels up) counts,
+    nothing is guessed from the current directory or the suites.
+    """
+    repo_base = os.path.dirname(os.path.dirname(os.path.dirname(
+        abspath(path))))
+    candidates = set(
+        repo for repo in config.repo.itervalues()
+        if isinstance(repo, repository.UnconfiguredTree) and
+        abspath(repo.base) == repo_base)
+    if len(candidates) != 1:
+        return None
+    return candidates.pop()
+
+
+def ebuild_limiter(repo_base, path):
+    """Return the restriction matching the ebuild at path of a repo.
+
+    :return: an atom matching exactly that version, or C{None} if path is
+        not an ebuild of a package dir of repo_base.
+    """
+    path = abspath(path)
+    repo_base = abspath(repo_base)
+    if not path.startswith(repo_base + os.sep):
+        return None
+    bits = path[len(repo_base):].split(os.sep)[1:]
+    if len(bits) != 3:
+        return None
+    category, package, filename = bits
+    try:
+        pkg = cpv.versioned_CPV(
+            '%s/%s' % (category, filename[:-len('.ebuild')]))
+    except cpv.InvalidCPV:
+        return None
+    if pkg.package != package:
+        return None
+    return atom.atom('=%s' % (pkg.cpvstr,))
+
 
 def dump_docstring(out, obj, prefix=None):
     if prefix is not None:
@@ -422,47 +761,50 @@ def display_reporters(out, config, config_reporters, plugin_reporters):
             "run correctly without a reporter to use!")
         out.write()
 
-def main(options, out, err):
-    """Do stuff."""
+def profile_checks(checks):
+    """Return the checks (classes) that look at profiles."""
+    return set(check for check in checks
+               if addons.ProfileAddon in base.required_addons([check]))
 
-    if options.list_checks:
-        display_checks(out, options.checks)
-        return 0
 
-    if options.list_reporters:
-        display_reporters(
-            out, options.config,
-            options.config.pcheck_reporter_factory.values(),
-            list(get_plugins('reporter', plugins)))
-        return 0
+def out_of_scope_checks(options, transforms, scans, debug=None):
+    """Return the checks no scan can run, but a full repo scan could.
 
-    if not options.repo_bases:
-        err.write(
-            'Warning: could not determine repository base for profiles. '
-            'Some checks will not work. Either specify a plain target repo '
-            '(not combined trees) or specify a PORTDIR repo '
-            'with --overlayed-repo.', wrap=True)
-        err.write()
+    Works on the check classes, so the addons only those checks need do
+    not have to be instantiated.
 
-    if options.guessed_suite:
-        if options.default_suite:
-            err.write('Tried to guess a suite to use but got multiple matches')
-            err.write('and fell back to the default.')
-        else:
-            err.write('using suite guessed from working directory')
+    :param scans: sequence of (check classes, limiters) tuples, one per
+        call to L{scan}.
+    """
+    considered = set()
+    reachable = set()
+    for checks, limiters in scans:
+        checks = list(checks)
+        for source in feeds.target_sources(options.target_repo, limiters):
+            considered.update(checks)
+            bad = set(base.unreachable_sinks(
+                checks, transforms, [source], debug))
+            reachable.update(check for check in checks if check not in bad)
+    out_of_scope = considered - reachable
+    if out_of_scope:
+        # scan reports those missing transforms, leave them to it.
+        full_scope = feeds.RestrictedRepoSource(
+            options.target_repo, packages.AlwaysTrue)
+        out_of_scope.difference_update(base.unreachable_sinks(
+            list(out_of_scope), transforms, [full_scope], debug))
+    return out_of_scope
 
-    if options.guessed_target_repo:
-        err.write('using repository guessed from working directory')
 
-    try:
-        reporter = options.reporter(out)
-    except errors.ReporterInitError, e:
-        err.write(
-            err.fg('red'), err.bold, '!!! ', err.reset,
-            'Error initializing reporter: ', e)
-        return 1
+def init_addons(options, err, addons, addons_map=None):
+    """Instantiate addons and the addons they require.
 
-    addons_map = {}
+    :param addons: addon classes to instantiate.
+    :param addons_map: dict mapping addon classes to already created
+        instances, which are reused. Updated in place.
+    :return: addons_map.
+    """
+    if addons_map is None:
+        addons_map = {}
 
     def init_addon(klass):
         res = addons_map.get(klass)
@@ -478,30 +820,28 @@ def main(options, out, err):
             raise
         return res
 
-    for addon in options.addons:
+    for addon in addons:
         # Ignore the return value, we just need to populate addons_map.
         init_addon(addon)
+    return addons_map
 
-    if options.debug:
-        err.write('target repo: ', repr(options.target_repo))
-        err.write('source repo: ', repr(options.src_repo))
-        err.write('base dirs: ', repr(options.repo_bases))
-        for filterer in options.limiters:
-            err.write('limiter: ', repr(filterer))
-        debug = logging.debug
-    else:
-        debug = None
 
-    transforms = list(get_plugins('transform', plugins))
-    # XXX this is pretty horrible.
-    sinks = list(addon for addon in addons_map.itervalues()
-                 if getattr(addon, 'feed_type', False))
-
-    reporter.start()
+def scan(options, out, err, reporter, sinks, transforms, limiters,
+         debug=None, instruments=(), prefetcher=None, io_loop=None,
+         progress=None, scan_checkpoint=None):
+    """Run sinks over the target repo packages matching the limiters.
 
-    for filterer in options.limiters:
-        sources = [feeds.RestrictedRepoSource(options.target_repo, filterer)]
-        bad_sinks, pipes = base.plug(sinks, transforms, sources, debug)
+    Limiters of the same scope are scanned in one go, see
+    L{feeds.target_sources}.  Does not call the start and finish methods
+    of reporter.  Packages are fed through prefetcher, if given (a
+    L{prefetch.Prefetcher}), and the pipelines through io_loop, if given
+    (an L{overlap.Loop}).  progress, if given (a L{progress.Progress}),
+    counts the packages fed.  A full repo scan is checkpointed to (and
+    resumed from) scan_checkpoint, if given (a L{checkpoint.Checkpoint}).
+    """
+    for source in feeds.target_sources(options.target_repo, limiters):
+        filterer = source.limiter
+        bad_sinks, pipes = base.plug(sinks, transforms, [source], debug)
         if bad_sinks:
             # We want to report the ones that would work if this was a
             # full repo scan separately from the ones that are
@@ -509,7 +849,8 @@ def main(options, out, err):
             bad_sinks = set(bad_sinks)
             full_scope = feeds.RestrictedRepoSource(
                 options.target_repo, packages.AlwaysTrue)
-            really_bad, ignored = base.plug(sinks, transforms, [full_scope])
+            really_bad, ignored = base.plug(
+                sinks, transforms, [full_scope], debug)
             really_bad = set(really_bad)
             assert bad_sinks >= really_bad, \
                 '%r unreachable with no limiters but reachable with?' % (
@@ -527,18 +868,263 @@ def main(options, out, err):
         else:
             if options.debug:
                 err.write('Running %i tests' % (len(sinks) - len(bad_sinks),))
+            if isinstance(source, feeds.MultiTargetSource):
+                pipe_reporter = feeds.TargetReporter(reporter, source)
+            else:
+                pipe_reporter = reporter
+            if source.scope == base.repository_scope and (
+                    options.jobs > 1 or scan_checkpoint is not None):
+                good_sinks = list(x for x in sinks if x not in bad_sinks)
+                pipe_reporter.start_check(
+                    list(base.collect_checks_classes(good_sinks)), filterer)
+                if scan_checkpoint is not None:
+                    checkpoint.run_checkpointed(
+                        options.target_repo, filterer, source, good_sinks,
+                        transforms, pipe_reporter, scan_checkpoint, debug,
+                        instruments, options.batch_size, prefetcher,
+                        io_loop, progress)
+                else:
+                    parallel.run_sharded(
+                        options.target_repo, filterer, source, good_sinks,
+                        transforms, pipe_reporter, options.jobs, debug,
+                        instruments, options.batch_size, prefetcher,
+                        io_loop, progress)
+                pipe_reporter.end_check()
+                continue
             for source, pipe in pipes:
+                for instrument in instruments:
+                    base.wrap_checks(pipe, instrument.wrap)
+                pipe = base.compile_pipeline(pipe, options.batch_size)
                 pipe.start()
-                reporter.start_check(
+                pipe_reporter.start_check(
                     list(base.collect_checks_classes(pipe)), filterer)
-                for thing in source.feed():
-                    pipe.feed(thing, reporter)
-                pipe.finish(reporter)
-                reporter.end_check()
+                things = source.feed()
+                if prefetcher is not None:
+                    things = prefetcher.iter(things)
+                if progress is not None:
+                    progress.expect(options.target_repo, source.limiter)
+                    things = progress.iter(things)
+                overlap.feed_pipeline(pipe, things, pipe_reporter, io_loop)
+                pipe_reporter.end_check()
+
+
+def main(options, out, err):
+    """Do stuff."""
+
+    if options.list_checks:
+        display_checks(out, options.checks)
+        return 0
+
+    if options.list_reporters:
+        display_reporters(
+            out, options.config,
+            options.config.pcheck_reporter_factory.values(),
+            list(get_plugins('reporter', plugins)))
+        return 0
+
+    if options.connect is not None:
+        return daemon.connect(options, out, err)
+
+    if not options.repo_bases:
+        err.write(
+            'Warning: could not determine repository base for profiles. '
+            'Some checks will not work. Either specify a plain target repo '
+            '(not combined trees) or specify a PORTDIR repo '
+            'with --overlayed-repo.', wrap=True)
+        err.write()
+
+    if options.guessed_suite:
+        if options.default_suite:
+            err.write('Tried to guess a suite to use but got multiple matches')
+            err.write('and fell back to the default.')
+        else:
+            err.write('using suite guessed from working directory')
 
+    if options.guessed_target_repo:
+        err.write('using repository guessed from working directory')
+
+    if options.debug:
+        debug = logging.debug
+    else:
+        debug = None
+
+    if options.plan_cache is not None:
+        base.plan_cache.load(options.plan_cache)
+
+    if options.daemon is not None:
+        return daemon.Daemon(options, out, err, debug).serve(options.daemon)
+
+    try:
+        reporter = options.reporter(out)
+    except errors.ReporterInitError, e:
+        err.write(
+            err.fg('red'), err.bold, '!!! ', err.reset,
+            'Error initializing reporter: ', e)
+        return 1
+
+    transforms = list(get_plugins('transform', plugins))
+    # Work out what can run before instantiating anything; the addons of
+    # checks out of scope (ProfileAddon for repository wide checks of a
+    # package scan, say) are not built at all.
+    scans = [(options.checks, options.limiters)]
+    if options.profile_limiter is not None:
+        scans.append((profile_checks(options.checks),
+                      [options.profile_limiter]))
+    out_of_scope = out_of_scope_checks(options, transforms, scans, debug)
+    for check in sorted(out_of_scope, key=lambda x: x.__name__):
+        err.warn('not running %s (not a full repo scan)' % (check.__name__,))
+    addons_map = init_addons(
+        options, err,
+        list(check for check in options.checks if check not in out_of_scope))
+
+    if options.debug:
+        err.write('target repo: ', repr(options.target_repo))
+        err.write('source repo: ', repr(options.src_repo))
+        err.write('base dirs: ', repr(options.repo_bases))
+        for filterer in options.limiters:
+            err.write('limiter: ', repr(filterer))
+
+    instruments = []
+    cache = None
+    repo_id = getattr(options.target_repo, 'repo_id', None)
+    if options.cache and repo_id:
+        cache = result_cache.ResultCache(
+            pjoin(options.cache_dir, repo_id.replace(os.sep, '_')),
+            options.cache_size * 1024 * 1024, options,
+            read=not options.rebuild_cache)
+        instruments.append(cache)
+    timings = None
+    if options.timings or options.timings_file:
+        timings = timing.Timings()
+        instruments.append(timings)
+    prefetcher = None
+    if options.prefetch:
+        prefetcher = prefetch.Prefetcher(options.prefetch)
+        instruments.append(prefetcher)
+    io_loop = None
+    if options.io_concurrency:
+        io_loop = overlap.Loop(options.io_concurrency)
+        instruments.append(io_loop)
+    scan_progress = None
+    if options.progress or options.progress_file:
+        stream = None
+        if options.progress:
+            stream = err.stream
+        scan_progress = progress.Progress(stream, options.progress_file)
+        if not scan_progress.tty:
+            scan_progress.interval = 5
+        elif out.stream.isatty():
+            reporter = progress.ClearingReporter(reporter, scan_progress)
+        instruments.append(scan_progress)
+    if options.metrics_file or options.metrics_json:
+        instruments.append(metrics.registry)
+    memory_profile = None
+    if options.memory_profile or options.memory_profile_file:
+        # Addons get measured separately.
+        shared = [options, options.config] + addons_map.values()
+        for repo in (options.target_repo, options.src_repo,
+                     options.search_repo):
+            shared.extend((repo, getattr(repo, 'package_class', None)))
+        memory_profile = memory.MemoryProfile(shared)
+        instruments.append(memory_profile)
+        memory_profile.start_gc()
+
+    # XXX this is pretty horrible.
+    sinks = list(addon for addon in addons_map.itervalues()
+                 if getattr(addon, 'feed_type', False))
+
+    if options.since is not None and not options.limiters and \
+            options.profile_limiter is None:
+        err.write('nothing to scan, no changes since %s' % (options.since,))
+
+    scan_checkpoint = None
+    if options.checkpoint is not None:
+        scan_checkpoint = checkpoint.Checkpoint(
+            options.checkpoint, options.resume)
+
+    reporter.start()
+    try:
+        scan(options, out, err, reporter, sinks, transforms, options.limiters,
+             debug, instruments, prefetcher, io_loop, scan_progress,
+             scan_checkpoint)
+        if options.profile_limiter is not None:
+            # Only packages whose visibility may have changed; run just the
+            # checks looking at profiles.
+            wanted = base.required_addons(profile_checks(
+                sink.__class__ for sink in sinks))
+            scan(options, out, err, reporter,
+                 list(sink for sink in sinks if sink.__class__ in wanted),
+                 transforms, [options.profile_limiter], debug, instruments,
+                 prefetcher, io_loop, scan_progress)
+    except (errors.CheckpointError, errors.FatalError), e:
+        err.error(str(e))
+        return 1
+    if scan_progress is not None:
+        scan_progress.finish()
+    if memory_profile is not None:
+        memory_profile.stop_gc()
+        memory_profile.measure_addons(addons_map.values())
     reporter.finish()
+    save_plans(options, err)
+    save_profile_cache(addons_map)
+
+    if cache is not None:
+        cache.flush()
+        try:
+            cache.evict()
+        except EnvironmentError, e:
+            err.write(
+                err.fg('red'), err.bold, '!!! ', err.reset,
+                'Error evicting cached results: ', e)
+        if options.debug:
+            err.write('result cache: %i hits, %i misses' % (
+                cache.hits, cache.misses))
+    if options.debug:
+        for instrument in (prefetcher, io_loop):
+            if instrument is not None:
+                err.write(instrument.summary())
 
     # flush stdout first; if they're directing it all to a file, this makes
     # results not get the final message shoved in midway
     out.stream.flush()
+
+    if timings is not None:
+        if options.timings:
+            timings.write_table(err)
+        if options.timings_file:
+            try:
+                with open(options.timings_file, 'w') as f:
+                    json.dump(timings.dump(), f, indent=2, sort_keys=True)
+            except EnvironmentError, e:
+                err.write(
+                    err.fg('red'), err.bold, '!!! ', err.reset,
+                    'Error writing timings: ', e)
+                return 1
+
+    if memory_profile is not None:
+        if options.memory_profile:
+            memory_profile.write_table(err)
+        if options.memory_profile_file:
+            try:
+                with open(options.memory_profile_file, 'w') as f:
+                    json.dump(memory_profile.dump(), f, indent=2,
+                              sort_keys=True)
+            except EnvironmentError, e:
+                err.write(
+                    err.fg('red'), err.bold, '!!! ', err.reset,
+                    'Error writing the memory profile: ', e)
+                return 1
+
+    try:
+        if options.metrics_file:
+            metrics.registry.save_prometheus(options.metrics_file)
+        if options.metrics_json:
+            with open(options.metrics_json, 'w') as f:
+                json.dump(metrics.registry.dump(), f, indent=2,
+                          sort_keys=True)
+    except EnvironmentError, e:
+        err.write(
+            err.fg('red'), err.bold, '!!! ', err.reset,
+            'Error writing metrics: ', e)
+        return 1
     return 0
@@ -2,16 +2,13 @@
 # License: BSD/GPL2
 
 import codecs
-from collections import deque
 import os
 import stat
 
-from snakeoil.demandload import demandload
-from snakeoil.osutils import listdir, pjoin
+from snakeoil.osutils import pjoin
 
-from pkgcore_checks.base import Result, Template, package_feed
-
-demandload('errno')
+from pkgcore_checks.base import (
+    Result, Template, defer, package_feed, pkgdir_feed)
 
 allowed_filename_chars = "a-zA-Z0-9._-+:"
 allowed_filename_chars_set = set()
@@ -111,71 +108,72 @@ class InvalidUtf8(Result):
         return "file %s is not valid utf8- %s" % (self.filename, self.err)
 
 
-def utf8_check(pkg, base, filename, reporter):
+def utf8_check(pkg, base, filename, results):
+    """Add an L{InvalidUtf8} to the results list if needed.
+
+    Only does file I/O, so it can run in a thread.
+    """
     try:
         codecs.open(pjoin(base, filename), mode="rb",
                     encoding="utf8", buffering=8192).read()
     except UnicodeDecodeError, e:
-        reporter.add_report(InvalidUtf8(pkg, filename, str(e)))
+        results.append(InvalidUtf8(pkg, filename, str(e)))
         del e
 
 
 class PkgDirReport(Template):
     """actual ebuild directory scans; file size, glep31 rule enforcement."""
 
-    feed_type = package_feed
-
-    ignore_dirs = set(["cvs", ".svn", ".bzr"])
+    feed_type = pkgdir_feed
+    result_cache_version = 1
     known_results = (MissingFile, ExecutableFile, SizeViolation,
                      Glep31Violation, InvalidUtf8)
 
-    def feed(self, pkgset, reporter):
-        base = os.path.dirname(pkgset[0].ebuild.path)
-        # note we don't use os.walk, we need size info also
-        for filename in listdir(base):
+    def feed(self, item, reporter):
+        pkgset, snapshot = item
+        defer(reporter, self.scan_dir, (pkgset[0], snapshot))
+
+    def scan_dir(self, pkg, snapshot):
+        """Return the results for the package dir snapshot of pkg.
+
+        Only does file I/O, so it can run in a thread, see L{defer}.
+        """
+        results = []
+        base = snapshot.path
+        for filename, (mode, size, mtime) in sorted(
+                snapshot.entries.iteritems()):
             # while this may seem odd, written this way such that the
             # filtering happens all in the genexp.  if the result was being
             # handed to any, it's a frame switch each
             # char, which adds up.
 
             if any(True for x in filename if x not in allowed_filename_chars_set):
-                reporter.add_report(Glep31Violation(pkgset[0], filename))
+                results.append(Glep31Violation(pkg, filename))
 
             if filename.endswith(".ebuild") or filename in \
                     ("Manifest", "ChangeLog", "metadata.xml"):
-                if os.stat(pjoin(base, filename)).st_mode & 0111:
-                    reporter.add_report(ExecutableFile(pkgset[0], filename))
+                if stat.S_ISLNK(mode):
+                    mode = os.stat(pjoin(base, filename)).st_mode
+                if mode & 0111:
+                    results.append(ExecutableFile(pkg, filename))
 
             if filename.endswith(".ebuild"):
-                utf8_check(pkgset[0], base, filename, reporter)
-
-        try:
-            utf8_check(pkgset[0], base, "ChangeLog", reporter)
-        except IOError, e:
-            if e.errno != errno.ENOENT:
-                raise
-            del e
-            reporter.add_report(MissingFile(pkgset[0], "ChangeLog"))
-
-        if not os.path.exists(pjoin(base, 'files')):
-            return
-        unprocessed_dirs = deque(["files"])
-        while unprocessed_dirs:
-            cwd = unprocessed_dirs.pop()
-            for fn in listdir(pjoin(base, cwd)):
-                afn = pjoin(base, cwd, fn)
-                st = os.lstat(afn)
-
-                if stat.S_ISDIR(st.st_mode):
-                    if fn not in self.ignore_dirs:
-                        unprocessed_dirs.append(pjoin(cwd, fn))
-
-                elif stat.S_ISREG(st.st_mode):
-                    if st.st_mode & 0111:
-                        reporter.add_report(ExecutableFile(pkgset[0],
-                                                           pjoin(cwd, fn)))
-                    if not fn.startswith("digest-"):
-                        if st.st_size > 20480:
-                            reporter.add_report(SizeViolation(pkgset[0], fn, st.st_size))
-                        if any(True for x in fn if x not in allowed_filename_chars_set):
-                            reporter.add_report(Glep31Violation(pkgset[0], pjoin(cwd, fn)))
+                utf8_check(pkg, base, filename, results)
+
+        if "ChangeLog" in snapshot.entries:
+            utf8_check(pkg, base, "ChangeLog", results)
+        else:
+            results.append(MissingFile(pkg, "ChangeLog"))
+
+        for path, mode, size, mtime in snapshot.files or ():
+            if not stat.S_ISREG(mode):
+                continue
+            fn = os.path.basename(path)
+            if mode & 0111:
+                results.append(ExecutableFile(pkg, path))
+            if not fn.startswith("digest-"):
+                if size > 20480:
+                    results.append(SizeViolation(pkg, fn, size))
+                if any(True for x in fn if x not in allowed_filename_chars_set):
+                    results.append(Glep31Violation(pkg, path))
+        return results
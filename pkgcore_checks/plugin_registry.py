@@ -0,0 +1,220 @@
+# License: BSD/GPL2
+
+"""Cached index of the check plugins, so pcheck only imports what it runs.
+
+Getting at the check plugins imports L{pkgcore_checks.plugins.core_checks}
+and with it every check module, and setting up the options of every addon
+imports the rest.  The index records, for every check and addon:
+
+ - its name (module and class);
+ - the names of the addons it requires;
+ - the option strings its C{mangle_option_parser} adds;
+
+so pcheck can pick the checks to run by name, import only their modules
+and add the options of only their addons (plus those of any addon whose
+options appear on the command line).
+
+The index is kept as json in the user's cache dir along with the size
+and modification time of the plugin files and of the modules it
+describes; it is rebuilt (importing everything, once) as soon as any of
+those change.
+"""
+
+import errno
+import json
+import optparse
+import os
+
+from snakeoil.demandload import demandload
+from snakeoil.osutils import pjoin
+
+from pkgcore_checks import plugins
+
+demandload(
+    'logging',
+    'pkgcore.plugin:get_plugins',
+    'pkgcore.util:commandline',
+    'snakeoil.modules:load_attribute',
+)
+
+# Bump when the format of the index changes.
+version = 1
+
+
+def default_location():
+    return pjoin(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'pkgcore-checks', 'plugins.json')
+
+
+def qualname(klass):
+    """Return the name the index knows klass under."""
+    return '%s.%s' % (klass.__module__, klass.__name__)
+
+
+def _source(path):
+    if path.endswith(('.pyc', '.pyo')):
+        return path[:-1]
+    return path
+
+
+def plugin_files():
+    """Return the paths of the modules of the pkgcore_checks plugins."""
+    paths = []
+    for plugin_dir in plugins.__path__:
+        try:
+            names = os.listdir(plugin_dir)
+        except EnvironmentError:
+            continue
+        paths.extend(pjoin(plugin_dir, name) for name in sorted(names)
+                     if name.endswith('.py'))
+    return paths
+
+
+def stat_files(paths):
+    """Return a dict of (mtime, size) lists (or C{None}) for paths."""
+    stats = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            stats[path] = None
+        else:
+            stats[path] = [st.st_mtime, st.st_size]
+    return stats
+
+
+def addon_options(addon):
+    """Return the option strings addon adds to an option parser."""
+    parser = optparse.OptionParser(
+        option_class=commandline.Option, add_help_option=False,
+        conflict_handler='resolve')
+    addon.mangle_option_parser(parser)
+    return sorted(set(parser._short_opt) | set(parser._long_opt))
+
+
+def build():
+    """Import every check plugin and return the index data for them."""
+    checks = set(get_plugins('check', plugins))
+    addons = {}
+    todo = list(checks)
+    while todo:
+        addon = todo.pop()
+        if qualname(addon) not in addons:
+            addons[qualname(addon)] = addon
+            todo.extend(addon.required_addons)
+    options = {}
+    modules = set()
+    for name, addon in addons.iteritems():
+        for option in addon_options(addon):
+            options.setdefault(option, []).append(name)
+        module = __import__(addon.__module__, fromlist=['__name__'])
+        modules.add(_source(module.__file__))
+    return {
+        'version': version,
+        'files': stat_files(plugin_files() + sorted(modules)),
+        'checks': sorted(qualname(check) for check in checks),
+        'addons': dict(
+            (name, sorted(qualname(x) for x in addon.required_addons))
+            for name, addon in addons.iteritems()),
+        'options': dict(
+            (option, sorted(names)) for option, names in options.iteritems()),
+    }
+
+
+def fresh(data):
+    """Return whether the index data still describes the installed plugins."""
+    if not isinstance(data, dict) or data.get('version') != version:
+        return False
+    files = data['files']
+    # A plugin file being added is a change too.
+    if not set(plugin_files()).issubset(files):
+        return False
+    return stat_files(files) == files
+
+
+class CheckEntry(object):
+
+    """Stands in for a check class until it is loaded.
+
+    Has the C{__module__} and C{__name__} attributes check sets
+    (L{pkgcore_checks.base.Whitelist} and friends) filter by.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.__module__, self.__name__ = name.rsplit('.', 1)
+
+    def load(self):
+        """Import and return the check class."""
+        return load_attribute(self.name)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.name)
+
+
+class PluginRegistry(object):
+
+    """The index of the check plugins."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def checks(self):
+        """Return a L{CheckEntry} for every check."""
+        return list(CheckEntry(name) for name in self.data['checks'])
+
+    def option_addons(self, prefix):
+        """Return the names of the addons adding options starting with prefix.
+
+        Long options can be abbreviated on the command line, so every
+        option prefix could be meant to be is matched.
+        """
+        names = set()
+        for option, addons in self.data['options'].iteritems():
+            if option.startswith(prefix):
+                names.update(addons)
+        return sorted(names)
+
+    def addons(self):
+        """Return the names of all addons (checks included)."""
+        return sorted(self.data['addons'])
+
+    @staticmethod
+    def load_addon(name):
+        """Import and return the addon class called name."""
+        return load_attribute(name)
+
+
+def load(path=None):
+    """Return the L{PluginRegistry}, rebuilding the index if it is stale.
+
+    :param path: file the index is kept in, defaults to
+        L{default_location}.
+    """
+    if path is None:
+        path = default_location()
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (EnvironmentError, ValueError):
+        data = None
+    if fresh(data):
+        return PluginRegistry(data)
+    data = build()
+    tmp = '%s.%i.tmp' % (path, os.getpid())
+    try:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except EnvironmentError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.rename(tmp, path)
+    except EnvironmentError, e:
+        # Not fatal, it just gets rebuilt next time too.
+        logging.debug('not saving the plugin index to %s: %s', path, e)
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return PluginRegistry(data)
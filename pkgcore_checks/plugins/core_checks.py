@@ -2,13 +2,17 @@
 # License: BSD/GPL2
 
 
-"""Default checks."""
+"""Default checks.
+
+Transforms and reporters are in separate plugin modules, so looking
+them up does not import every check.
+"""
 
 # Please keep the imports and plugins sorted.
 from pkgcore_checks import (
-    cleanup, codingstyle, deprecated, dropped_keywords, feeds, glsa_scan, imlate,
-    metadata_checks, metadata_xml, pkgdir_checks, repo_metadata, report_stream,
-    reporters, stale_unstable, unstable_only, visibility, whitespace,
+    cleanup, codingstyle, deprecated, dropped_keywords, glsa_scan, imlate,
+    metadata_checks, metadata_xml, pkgdir_checks, repo_metadata,
+    stale_unstable, unstable_only, visibility, whitespace,
 )
 
 pkgcore_plugins = {
@@ -39,21 +43,4 @@ pkgcore_plugins = {
         visibility.VisibilityReport,
         whitespace.WhitespaceCheck,
         ],
-    'transform': [
-        feeds.VersionToEbuild,
-        feeds.EbuildToVersion,
-        feeds.VersionToPackage,
-        feeds.VersionToCategory,
-        feeds.PackageToRepo,
-        feeds.CategoryToRepo,
-        feeds.PackageToCategory,
-        ],
-    'reporter': [
-        reporters.StrReporter,
-        reporters.FancyReporter,
-        reporters.XmlReporter,
-        reporters.NullReporter,
-        report_stream.PickleStream,
-        report_stream.BinaryPickleStream,
-        ]
     }
@@ -0,0 +1,19 @@
+# Copyright: 2006 Marien Zwart <marienz@gentoo.org>
+# License: BSD/GPL2
+
+
+"""Default reporters."""
+
+# Please keep the imports sorted.
+from pkgcore_checks import report_stream, reporters
+
+pkgcore_plugins = {
+    'reporter': [
+        reporters.StrReporter,
+        reporters.FancyReporter,
+        reporters.XmlReporter,
+        reporters.NullReporter,
+        report_stream.PickleStream,
+        report_stream.BinaryPickleStream,
+        ],
+    }
@@ -0,0 +1,21 @@
+# Copyright: 2006 Marien Zwart <marienz@gentoo.org>
+# License: BSD/GPL2
+
+
+"""Default transforms."""
+
+from pkgcore_checks import feeds
+
+pkgcore_plugins = {
+    'transform': [
+        feeds.VersionToEbuild,
+        feeds.EbuildToVersion,
+        feeds.VersionToPackage,
+        feeds.VersionToCategory,
+        feeds.PackageToRepo,
+        feeds.CategoryToRepo,
+        feeds.PackageToCategory,
+        feeds.PackageToPkgDir,
+        feeds.CategoryToCatDir,
+        ],
+    }
@@ -0,0 +1,139 @@
+# License: BSD/GPL2
+
+"""Warm caches for the packages about to be scanned in background threads.
+
+Reading the metadata cache entry of a version, opening its ebuild
+(L{pkgcore_checks.feeds.VersionToEbuild}) and listing its package dir
+(L{pkgcore_checks.pkgdir_checks.PkgDirReport}) all block the scanning
+thread.  A L{Prefetcher} keeps a thread pool working on the next few
+packages of the stream while the checks run on the current one:
+
+ - the metadata is loaded, which pkgcore keeps on the package object;
+ - the ebuild is read, leaving it in the page cache;
+ - the package dir is walked and stat'ed, leaving the inodes cached.
+
+A package is only handed on once its warming is done, so the checks and
+the pool never work on the same package object at once.  Packages whose
+warming was already done count as hits, the ones waited for as misses.
+"""
+
+import os
+
+from snakeoil.demandload import demandload
+
+demandload(
+    'collections',
+    'multiprocessing.pool:ThreadPool',
+    'snakeoil.osutils:pjoin',
+)
+
+
+def warm(pkg, walk_dir):
+    """Load pkg's metadata and read its ebuild (and package dir).
+
+    Errors are ignored: the checks run into them again and report them.
+    """
+    try:
+        getattr(pkg, 'data', None)
+    except Exception:
+        pass
+    path = getattr(pkg, 'path', None)
+    if path is None:
+        return
+    try:
+        with open(path, 'rb') as f:
+            while f.read(65536):
+                pass
+    except EnvironmentError:
+        pass
+    if walk_dir:
+        for root, dirs, files in os.walk(os.path.dirname(path)):
+            for name in files:
+                try:
+                    os.lstat(pjoin(root, name))
+                except EnvironmentError:
+                    pass
+
+
+class Prefetcher(object):
+
+    """Runs L{warm} in a thread pool for the packages ahead in a stream.
+
+    Follows the instrument protocol of L{pkgcore_checks.parallel} so the
+    counters of worker processes get merged (it wraps nothing).
+    """
+
+    def __init__(self, depth, threads=4):
+        """Initialize.
+
+        :param depth: number of packages to warm ahead of the one handed on.
+        :param threads: size of the thread pool, at most depth.
+        """
+        self.depth = depth
+        self.threads = max(1, min(threads, depth))
+        self.hits = self.misses = 0
+        # Summed over every package handed on: how many of the packages
+        # queued behind it were warm already.
+        self.ready_ahead = 0
+
+    def iter(self, pkgs):
+        """Iterate over pkgs, warming the next depth ones in the background.
+
+        The pool is created on the first package (so after forking, for
+        worker processes) and shut down when done.
+        """
+        pending = collections.deque()
+        pool = None
+        last_dir = None
+        try:
+            for pkg in pkgs:
+                if pool is None:
+                    pool = ThreadPool(self.threads)
+                pkg_dir = os.path.dirname(getattr(pkg, 'path', '') or '')
+                pending.append(
+                    (pkg, pool.apply_async(warm, (pkg, pkg_dir != last_dir))))
+                last_dir = pkg_dir
+                if len(pending) > self.depth:
+                    yield self._next(pending)
+            while pending:
+                yield self._next(pending)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def _next(self, pending):
+        pkg, job = pending.popleft()
+        if job.ready():
+            self.hits += 1
+        else:
+            self.misses += 1
+            # Polling keeps it interruptible.
+            while not job.ready():
+                job.wait(0.1)
+        self.ready_ahead += sum(1 for x, y in pending if y.ready())
+        return pkg
+
+    def wrap(self, obj):
+        return obj
+
+    def collect(self):
+        counts = (self.hits, self.misses, self.ready_ahead)
+        self.hits = self.misses = self.ready_ahead = 0
+        return counts
+
+    def merge(self, counts):
+        self.hits += counts[0]
+        self.misses += counts[1]
+        self.ready_ahead += counts[2]
+
+    def summary(self):
+        """Return a line describing the counters."""
+        total = self.hits + self.misses
+        if total:
+            ahead = float(self.ready_ahead) / total
+        else:
+            ahead = 0.0
+        return 'prefetch: %i hits, %i misses, queue depth %i, ' \
+            '%.1f warm packages queued on average' % (
+                self.hits, self.misses, self.depth, ahead)
@@ -0,0 +1,207 @@
+# License: BSD/GPL2
+
+"""On disk cache of the per profile data L{addons.ProfileAddon} computes.
+
+Setting up the addon parses the mask and use.* files of every profile
+and builds the masked and forced use flag mappings of every profile for
+both stable and unstable keywords.  That data is kept, per profiles
+directory, in a pickle in the user's cache dir along with the size and
+modification time of every file in the directories of the profile
+stack (the profiles dir itself and directories of files such as
+package.mask/ included); it is used again as long as none of those
+change.
+
+The use flag mappings hold pkgcore internals that do not pickle as they
+are, so they are stored as plain tuples (see L{dump_flags} and
+L{load_flags}).
+"""
+
+import hashlib
+import os
+
+from pkgcore.ebuild.misc import ChunkedDataDict, chunked_data
+from pkgcore.restrictions import packages
+from snakeoil.demandload import demandload
+from snakeoil.mappings import ImmutableDict
+from snakeoil.osutils import pjoin
+
+demandload(
+    'errno',
+    'logging',
+    'snakeoil:pickling',
+)
+
+# Bump when the format of the cache (or what ProfileAddon stores) changes.
+version = 1
+
+
+def default_location():
+    return pjoin(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'pkgcore-checks', 'profiles')
+
+
+# Profile files that may be directories of files (layout.conf
+# profile-formats); any other subdirectory is a nested profile.
+dir_files = frozenset([
+    'package.accept_keywords', 'package.keywords', 'package.mask',
+    'package.provided', 'package.unmask', 'package.use',
+    'package.use.force', 'package.use.mask', 'package.use.stable.force',
+    'package.use.stable.mask', 'use.force', 'use.mask', 'use.stable.force',
+    'use.stable.mask',
+])
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except EnvironmentError:
+        return (path, None, None)
+    return (path, st.st_mtime, st.st_size)
+
+
+def profile_stamp(profile):
+    """Return the (path, mtime, size) tuples of the files profile uses.
+
+    Directories of files (package.mask, use.force and friends) are walked
+    too.
+    """
+    stamp = []
+    for node in profile.stack:
+        try:
+            names = sorted(os.listdir(node.path))
+        except EnvironmentError:
+            stamp.append((node.path, None, None))
+            continue
+        for name in names:
+            path = pjoin(node.path, name)
+            if not os.path.isdir(path):
+                stamp.append(_stat(path))
+            elif name in dir_files:
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames.sort()
+                    stamp.extend(
+                        _stat(pjoin(dirpath, x)) for x in sorted(filenames))
+    return tuple(stamp)
+
+
+def _dump_chunks(chunks):
+    return tuple(
+        (None if x.key is packages.AlwaysTrue else x.key, x.neg, x.pos)
+        for x in chunks)
+
+
+def _load_chunks(chunks, shared):
+    chunks = tuple(
+        chunked_data(packages.AlwaysTrue if key is None else key, neg, pos)
+        for key, neg, pos in chunks)
+    # Identical chunks get shared across profiles like
+    # ChunkedDataDict.optimize does with a cache.
+    return shared.setdefault(chunks, chunks)
+
+
+def dump_flags(flags):
+    """Return a frozen C{ChunkedDataDict} as picklable tuples."""
+    return (
+        tuple((key, _dump_chunks(chunks))
+              for key, chunks in flags._dict.iteritems()),
+        _dump_chunks(flags._global_settings))
+
+
+def load_flags(data, shared=None):
+    """Return the frozen C{ChunkedDataDict} L{dump_flags} returned data for.
+
+    :param shared: dict to share identical chunks through.
+    """
+    if shared is None:
+        shared = {}
+    flags = ChunkedDataDict()
+    items, global_settings = data
+    flags._dict = ImmutableDict(
+        (key, _load_chunks(chunks, shared)) for key, chunks in items)
+    flags._global_settings = _load_chunks(global_settings, shared)
+    return flags
+
+
+class ProfileCache(object):
+
+    """The cached data of the profiles in one profiles directory."""
+
+    def __init__(self, location, profiles_dir):
+        """Initialize.
+
+        :param location: directory the caches are kept in.
+        :param profiles_dir: the profiles directory cached for.
+        """
+        self.path = pjoin(
+            location, hashlib.sha1(profiles_dir).hexdigest() + '.pickle')
+        self.entries = None
+        self.changed = False
+        self.hits = self.misses = 0
+
+    def load(self):
+        """Read the cache in; done by L{get} and L{add} if needed."""
+        self.entries = {}
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickling.load(f)
+        except EnvironmentError, e:
+            if e.errno != errno.ENOENT:
+                logging.debug('not using profile cache %s: %s', self.path, e)
+            return
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception, e:
+            logging.debug('ignoring corrupt profile cache %s: %s',
+                          self.path, e)
+            return
+        if isinstance(data, tuple) and len(data) == 2 and data[0] == version:
+            self.entries = data[1]
+
+    def get(self, key, stamp):
+        """Return the data cached under key for stamp, or C{None}.
+
+        :param key: hashable identifying what the data was computed for.
+        :param stamp: L{profile_stamp} of the profile the data is of.
+        """
+        if self.entries is None:
+            self.load()
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != stamp:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def add(self, key, stamp, data):
+        """Cache data under key for stamp."""
+        if self.entries is None:
+            self.load()
+        self.entries[key] = (stamp, data)
+        self.changed = True
+
+    def save(self):
+        """Write the cache out if anything was added, atomically."""
+        if not self.changed:
+            return
+        tmp = '%s.%i.tmp' % (self.path, os.getpid())
+        try:
+            try:
+                os.makedirs(os.path.dirname(self.path))
+            except EnvironmentError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            with open(tmp, 'wb') as f:
+                pickling.dump((version, self.entries), f, -1)
+            os.rename(tmp, self.path)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception, e:
+            # Not fatal (unpicklable restrictions in the use flag data
+            # included), the profiles just get parsed again next time.
+            logging.debug('not saving the profile cache to %s: %s',
+                          self.path, e)
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return
+        self.changed = False
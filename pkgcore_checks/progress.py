@@ -0,0 +1,300 @@
+# License: BSD/GPL2
+
+"""Report how far along a scan is while it runs.
+
+A L{Progress} counts the packages and versions handed to the check
+pipelines and, at most every few seconds, writes a status line (to a
+terminal or log) and/or a json status file (for CI) with the current
+category, the packages scanned per second and an estimate of the time
+left.  The total it estimates that from is counted from the category and
+package listings of the repository (see L{count_packages}), so no
+package metadata is loaded for it.
+
+Counting costs a couple of attribute lookups per version and one clock
+read per package; nothing is written more often than the interval.
+"""
+
+import os
+import time
+
+from pkgcore.restrictions import boolean, packages
+from snakeoil.demandload import demandload
+
+from pkgcore_checks import feeds
+
+demandload(
+    'errno',
+    'json',
+    'logging',
+)
+
+
+def _narrowing(limiter):
+    """Return the category and package restrictions limiter requires.
+
+    :return: two lists of value restrictions, or C{None} if limiter is
+        not something those can be pulled out of.
+    """
+    if isinstance(limiter, packages.PackageRestriction):
+        restricts = [limiter]
+    elif isinstance(limiter, boolean.AndRestriction) and not limiter.negate:
+        restricts = limiter.restrictions
+    else:
+        return None
+    by_attr = {'category': [], 'package': []}
+    for restrict in restricts:
+        if isinstance(restrict, packages.PackageRestriction) and \
+                not restrict.negate and restrict.attr in by_attr:
+            by_attr[restrict.attr].append(restrict.restriction)
+    return by_attr['category'], by_attr['package']
+
+
+def _matching_keys(repo, limiter):
+    if limiter == packages.AlwaysTrue:
+        return set((category, package) for category in repo.categories
+                   for package in repo.packages.get(category, ()))
+    key = feeds.limiter_key(limiter)
+    if key is not None:
+        if key[1] in repo.packages.get(key[0], ()):
+            return set([key])
+        return set()
+    if isinstance(limiter, boolean.OrRestriction) and not limiter.negate:
+        keys = set()
+        for restrict in limiter.restrictions:
+            matched = _matching_keys(repo, restrict)
+            if matched is None:
+                return None
+            keys.update(matched)
+        return keys
+    narrowing = _narrowing(limiter)
+    if narrowing is None:
+        return None
+    category_restricts, package_restricts = narrowing
+    keys = set()
+    for category in repo.categories:
+        if all(x.match(category) for x in category_restricts):
+            keys.update(
+                (category, package)
+                for package in repo.packages.get(category, ())
+                if all(x.match(package) for x in package_restricts))
+    return keys
+
+
+def count_packages(repo, limiter):
+    """Estimate the number of packages in repo limiter matches.
+
+    Only restrictions on the category and package names are looked at,
+    so this is an upper bound if limiter also restricts versions (or
+    anything else) beyond those.
+
+    :return: an int, or C{None} if limiter is too complicated to tell.
+    """
+    keys = _matching_keys(repo, limiter)
+    if keys is None:
+        return None
+    return len(keys)
+
+
+def format_duration(seconds):
+    """Format a number of seconds like 1h02m03s."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%ih%02im%02is' % (hours, minutes, seconds)
+    if minutes:
+        return '%im%02is' % (minutes, seconds)
+    return '%is' % (seconds,)
+
+
+class Progress(object):
+
+    """Counts the packages fed to the pipelines and reports on them.
+
+    Follows the instrument protocol of L{pkgcore_checks.parallel} so the
+    counts of worker processes get merged (it wraps nothing); the status
+    is updated as they come in.
+    """
+
+    def __init__(self, stream=None, path=None, interval=0.5, clock=time.time):
+        """Initialize.
+
+        :param stream: file object to write status lines to, or C{None}.
+            If it is a terminal the line is rewritten in place.
+        :param path: file to keep a json status in, or C{None}.
+        :param interval: minimum number of seconds between updates.
+        :param clock: function returning the current time.
+        """
+        self.stream = stream
+        self.path = path
+        self.interval = interval
+        self.clock = clock
+        self.tty = stream is not None and getattr(stream, 'isatty', bool)()
+        self.packages = self.versions = 0
+        self.category = None
+        # None once a part of the scan could not be estimated.
+        self.total = 0
+        self.started = None
+        self._due = 0
+        self._shown = False
+
+    def expect(self, repo, limiter, times=1):
+        """Add the packages limiter matches in repo to the total.
+
+        :param times: number of times these packages get fed.
+        """
+        if self.started is None:
+            self.started = self.clock()
+        if self.total is None:
+            return
+        count = count_packages(repo, limiter)
+        if count is None:
+            self.total = None
+        else:
+            self.total += count * times
+
+    def iter(self, pkgs):
+        """Iterate over pkgs, counting them and updating the status."""
+        return self._count(pkgs, True)
+
+    def count(self, pkgs):
+        """Iterate over pkgs, only counting them.
+
+        For worker processes, which report their counts through
+        L{collect}.
+        """
+        return self._count(pkgs, False)
+
+    def _count(self, pkgs, report):
+        category = package = None
+        for pkg in pkgs:
+            self.versions += 1
+            if pkg.package != package or pkg.category != category:
+                category = pkg.category
+                package = pkg.package
+                self.packages += 1
+                self.category = category
+                if report and self.clock() >= self._due:
+                    self.update()
+            yield pkg
+
+    def status(self):
+        """Return a dict describing how far along the scan is."""
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = max(0.0, self.clock() - self.started)
+        rate = eta = None
+        if elapsed:
+            rate = self.packages / elapsed
+        if rate and self.total is not None:
+            eta = max(0, self.total - self.packages) / rate
+        return {
+            'packages': self.packages,
+            'versions': self.versions,
+            'total': self.total,
+            'category': self.category,
+            'elapsed': elapsed,
+            'rate': rate,
+            'eta': eta,
+        }
+
+    def format(self, status):
+        """Return a status line for status (from L{status})."""
+        if status['total']:
+            line = '%i/%i packages (%i%%)' % (
+                status['packages'], status['total'],
+                min(100, 100 * status['packages'] // status['total']))
+        else:
+            line = '%i packages' % (status['packages'],)
+        line += ', %i versions' % (status['versions'],)
+        if status['category'] is not None:
+            line += ', %s' % (status['category'],)
+        if status['rate'] is not None:
+            line += ', %.1f packages/s' % (status['rate'],)
+        if status['eta'] is not None:
+            line += ', ETA %s' % (format_duration(status['eta']),)
+        return 'progress: ' + line
+
+    def update(self, done=False):
+        """Write the current status out."""
+        self._due = self.clock() + self.interval
+        status = self.status()
+        if self.stream is not None:
+            line = self.format(status)
+            if self.tty:
+                self.stream.write('\r\x1b[K' + line)
+                self._shown = True
+                if done:
+                    self.stream.write('\n')
+                    self._shown = False
+            else:
+                self.stream.write(line + '\n')
+            self.stream.flush()
+        if self.path is not None:
+            status['done'] = done
+            self._write_status(status)
+
+    def _write_status(self, status):
+        tmp = '%s.%i.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(status, f, sort_keys=True)
+            # Readers never see a partially written file.
+            os.rename(tmp, self.path)
+        except EnvironmentError, e:
+            logging.warning('not updating %s any more: %s', self.path, e)
+            self.path = None
+            try:
+                os.unlink(tmp)
+            except EnvironmentError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def clear(self):
+        """Remove the status line from the terminal, if it is shown.
+
+        It gets shown again on the next update.
+        """
+        if self._shown:
+            self.stream.write('\r\x1b[K')
+            self.stream.flush()
+            self._shown = False
+
+    def finish(self):
+        """Write the final status."""
+        self.update(done=True)
+
+    def wrap(self, obj):
+        return obj
+
+    def collect(self):
+        counts = (self.packages, self.versions, self.category)
+        self.packages = self.versions = 0
+        return counts
+
+    def merge(self, counts):
+        self.packages += counts[0]
+        self.versions += counts[1]
+        if counts[2] is not None:
+            self.category = counts[2]
+        if self.clock() >= self._due:
+            self.update()
+
+
+class ClearingReporter(object):
+
+    """Reporter wrapper removing the status line before every result.
+
+    Keeps a L{Progress} writing to the terminal the results are printed
+    on from garbling them.
+    """
+
+    def __init__(self, reporter, progress):
+        self._reporter = reporter
+        self._progress = progress
+
+    def add_report(self, result):
+        self._progress.clear()
+        self._reporter.add_report(result)
+
+    def __getattr__(self, attr):
+        return getattr(self._reporter, attr)
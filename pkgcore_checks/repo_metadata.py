@@ -61,6 +61,14 @@ class UnusedGlobalFlags(base.Template):
         if self.flags:
             self.flags.difference_update(pkg.iuse_stripped)
 
+    def save_state(self):
+        if self.flags is None:
+            return None
+        return set(self.flags)
+
+    def restore_state(self, state):
+        self.flags = state
+
     def finish(self, reporter):
         if self.flags:
             reporter.add_report(UnusedGlobalFlagsResult(self.flags))
@@ -112,6 +120,12 @@ class UnusedLicense(base.Template):
     def feed(self, pkg, reporter):
         self.licenses.difference_update(iflatten_instance(pkg.license))
 
+    def save_state(self):
+        return set(self.licenses)
+
+    def restore_state(self, state):
+        self.licenses = state
+
     def finish(self, reporter):
         if self.licenses:
             reporter.add_report(UnusedLicenseReport(self.licenses))
@@ -180,6 +194,7 @@ class RequiredChksums(base.Template):
 
     feed_type = base.package_feed
     known_results = (MissingChksum,)
+    source_paths = ('metadata/layout.conf',)
 
     repo_grabber = attrgetter("repo")
 
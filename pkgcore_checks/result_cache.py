@@ -0,0 +1,441 @@
+# License: BSD/GPL2
+
+"""On disk cache of check results, skipping packages that did not change.
+
+Checks opt in by setting C{result_cache_version} (and bumping it whenever
+their logic changes).  The results they report while fed an item are
+stored under a hash of:
+
+ - the check class and its C{result_cache_version};
+ - the contents of the C{source_paths} and C{source_options} of the
+   check and the addons it requires, and the values of the options listed in their
+   C{fingerprint_options} (profile, arch and license selection...);
+ - the contents of every file in the package dir; for package dir
+   items, the listing of the L{pkgcore_checks.feeds.DirSnapshot} they
+   carry (names, modes and sizes, files/ included) and the contents of
+   the files directly in the package dir;
+ - the contents of the eclasses inherited by the versions in the item.
+
+When an item hashes to stored results, those are handed to the reporter
+and the check is not fed.  Only checks whose results depend on nothing
+else can opt in: L{pkgcore_checks.visibility.VisibilityReport} for example
+depends on the other packages of the repository and is never cached, and
+neither are checks keeping state from one item to the next.
+
+Results are stored per package, one file per category/package holding
+the results of all checks.  Once the cache exceeds its size limit the
+least recently used packages are evicted.
+"""
+
+import os
+
+from pkgcore_checks import base
+
+from snakeoil.demandload import demandload
+demandload(
+    'errno',
+    'hashlib',
+    'stat',
+    'snakeoil:pickling',
+    'snakeoil.fileutils:AtomicWriteFile',
+    'snakeoil.osutils:ensure_dirs,listdir_dirs,listdir_files,pjoin',
+)
+
+
+def default_location():
+    return pjoin(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'pkgcore-checks', 'results')
+
+
+def hash_path(path):
+    """Return a hex digest of the contents of a file or directory tree.
+
+    Missing paths hash to a fixed value.
+    """
+    chf = hashlib.sha1()
+    try:
+        st = os.lstat(path)
+    except EnvironmentError, e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            raise
+        chf.update('missing')
+        return chf.hexdigest()
+    if not stat.S_ISDIR(st.st_mode):
+        _hash_file(chf, path, st.st_mode)
+        return chf.hexdigest()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            fp = pjoin(root, name)
+            chf.update('%s\0' % (os.path.relpath(fp, path),))
+            _hash_file(chf, fp, os.lstat(fp).st_mode)
+    return chf.hexdigest()
+
+
+def hash_snapshot(snapshot):
+    """Return a hex digest of a package dir from its snapshot.
+
+    Only the files directly in the directory are read, what is under
+    files/ is covered by its listing (names, modes and sizes).
+
+    :param snapshot: a L{pkgcore_checks.feeds.DirSnapshot}.
+    """
+    chf = hashlib.sha1()
+    for name, (mode, size, mtime) in sorted(snapshot.entries.iteritems()):
+        chf.update('%s\0%o\0%i\0' % (name, mode, size))
+        if stat.S_ISREG(mode) or stat.S_ISLNK(mode):
+            _hash_file(chf, pjoin(snapshot.path, name), mode)
+    for path, mode, size, mtime in sorted(snapshot.files or ()):
+        chf.update('%s\0%o\0%i\0' % (path, mode, size))
+    return chf.hexdigest()
+
+
+def _hash_file(chf, path, mode):
+    # The executable bits are part of the content as far as checks go.
+    chf.update('%o\0' % (stat.S_IMODE(mode) & 0111,))
+    if stat.S_ISLNK(mode):
+        chf.update(os.readlink(path))
+        return
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            chf.update(chunk)
+
+
+def item_packages(item, feed_type):
+    """Return the package versions a feed item is about."""
+    if feed_type == base.versioned_feed:
+        return (item,)
+    elif feed_type == base.package_feed:
+        return item
+    elif feed_type == base.ebuild_feed:
+        return (item[0],)
+    elif feed_type == base.pkgdir_feed:
+        return item[0]
+    raise ValueError('uncacheable feed type %r' % (feed_type,))
+
+
+def result_cpv(obj):
+    """Return the category, package and version of a result or package."""
+    if isinstance(obj, base.Result):
+        return (getattr(obj, 'category', None), getattr(obj, 'package', None),
+                getattr(obj, 'version', None))
+    return obj.category, obj.package, obj.fullver
+
+
+def cacheable(check):
+    return (
+        getattr(check, 'result_cache_version', None) is not None and
+        check.scope <= base.package_scope and
+        check.feed_type in (
+            base.versioned_feed, base.package_feed, base.ebuild_feed,
+            base.pkgdir_feed))
+
+
+class RecordingReporter(object):
+
+    """Forwards results to a reporter, keeping a list of them."""
+
+    def __init__(self, reporter):
+        self.reporter = reporter
+        self.results = []
+
+    def add_report(self, result):
+        self.results.append(result)
+        self.reporter.add_report(result)
+
+    def __getattr__(self, attr):
+        return getattr(self.reporter, attr)
+
+
+class CollectingReporter(object):
+
+    """Keeps the results reported to it.
+
+    Not supporting C{defer}, deferred I/O (see L{base.defer}) runs right
+    away.
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def add_report(self, result):
+        self.results.append(result)
+
+
+class CachedCheck(base.CheckWrapper):
+
+    """Wraps a check, replaying stored results for unchanged items."""
+
+    def __init__(self, wrapped, cache):
+        base.CheckWrapper.__init__(self, wrapped)
+        self._cache = cache
+        self._name = '%s.%s' % (
+            wrapped.__class__.__module__, wrapped.__class__.__name__)
+
+    def feed(self, item, reporter):
+        key = self._cache.key(self.wrapped, item)
+        if key is None:
+            self.wrapped.feed(item, reporter)
+            return
+        results = self._cache.lookup(self._name, key)
+        if results is None:
+            recorder = RecordingReporter(reporter)
+            self.wrapped.feed(item, recorder)
+            # Results of deferred I/O (see base.defer) are added to this
+            # list later on, but before finish flushes it to disk.
+            results = recorder.results
+        else:
+            for result in results:
+                reporter.add_report(result)
+        self._cache.store(self._name, key, results)
+
+    def feed_batch(self, items, reporter):
+        if self.wrapped.feed_type not in (base.versioned_feed,
+                                          base.ebuild_feed):
+            for item in items:
+                self.feed(item, reporter)
+            return
+        # Results are reported in item order, cached ones included, so
+        # the output does not depend on what was cached.
+        replayed = {}
+        misses = []
+        for index, item in enumerate(items):
+            key = self._cache.key(self.wrapped, item)
+            results = None
+            if key is not None:
+                results = self._cache.lookup(self._name, key)
+            if results is None:
+                misses.append((index, item, key))
+                continue
+            replayed[index] = results
+            self._cache.store(self._name, key, results)
+        unclear = []
+        if misses:
+            collector = CollectingReporter()
+            self.wrapped.feed_batch(
+                list(item for index, item, key in misses), collector)
+            # Hand the results back to the version they are about; if that
+            # is not clear for all of them nothing gets stored.
+            stored = dict(
+                (result_cpv(item_packages(item, self.wrapped.feed_type)[0]),
+                 []) for index, item, key in misses)
+            for result in collector.results:
+                results = stored.get(result_cpv(result))
+                if results is None:
+                    unclear.append(result)
+                else:
+                    results.append(result)
+            for index, item, key in misses:
+                pkg = item_packages(item, self.wrapped.feed_type)[0]
+                results = replayed[index] = stored[result_cpv(pkg)]
+                if key is not None and not unclear:
+                    self._cache.store(self._name, key, results)
+        for index in xrange(len(items)):
+            for result in replayed[index]:
+                reporter.add_report(result)
+        for result in unclear:
+            reporter.add_report(result)
+
+    def finish(self, reporter):
+        self.wrapped.finish(reporter)
+        # Runs in the worker processes for --jobs too.
+        self._cache.flush()
+
+
+class ResultCache(object):
+
+    """The on disk cache, see the module docs.
+
+    Follows the instrument protocol of L{pkgcore_checks.parallel}: C{wrap}
+    is passed to L{base.wrap_checks} and C{collect}/C{merge} carry the
+    hit and miss counts across processes.
+    """
+
+    def __init__(self, location, max_size, options, read=True):
+        """Initialize.
+
+        :param location: directory holding the cache of a repository.
+        :param max_size: size in bytes to keep the cache (all repositories
+            in the parent directory of location) below.
+        :param options: the optparse values, for the fingerprints.
+        :param read: if false existing results are ignored (and replaced).
+        """
+        self.location = location
+        self.max_size = max_size
+        self.options = options
+        self.read = read
+        self.hits = self.misses = 0
+        self._fingerprints = {}
+        self._hashes = {}
+        # (category, package) -> check name -> item key -> results
+        self._loaded = {}
+        self._stored = {}
+
+    def wrap(self, obj):
+        if isinstance(obj, base.Template) and cacheable(obj):
+            return CachedCheck(obj, self)
+        return obj
+
+    def _hash_path(self, path):
+        digest = self._hashes.get(path)
+        if digest is None:
+            digest = self._hashes[path] = hash_path(path)
+        return digest
+
+    def fingerprint(self, klass):
+        """Return a hex digest of what results of klass depend on,
+        besides the package itself."""
+        digest = self._fingerprints.get(klass)
+        if digest is not None:
+            return digest
+        chf = hashlib.sha1()
+        chf.update('%s.%s:%s\0' % (
+            klass.__module__, klass.__name__, klass.result_cache_version))
+        for addon in sorted(base.required_addons([klass]),
+                            key=lambda x: (x.__module__, x.__name__)):
+            for path in base.addon_source_paths(addon, self.options):
+                chf.update(self._hash_path(path))
+            for attr in addon.fingerprint_options:
+                value = getattr(self.options, attr, None)
+                if isinstance(value, (set, frozenset)):
+                    value = sorted(value)
+                chf.update('%s=%r\0' % (attr, value))
+        digest = self._fingerprints[klass] = chf.hexdigest()
+        return digest
+
+    def key(self, check, item):
+        """Return the (category, package) and hex digest to store the
+        results of check for item under, or C{None} if uncacheable."""
+        try:
+            pkgs = item_packages(item, check.feed_type)
+            chf = hashlib.sha1(self.fingerprint(check.__class__))
+            if check.feed_type == base.pkgdir_feed:
+                # the snapshot already has the listing, no need to walk
+                # the dir again.
+                chf.update(hash_snapshot(item[1]))
+            else:
+                chf.update(self._hash_path(os.path.dirname(pkgs[0].path)))
+            for pkg in pkgs:
+                chf.update('%s\0' % (pkg.cpvstr,))
+                eclasses = pkg.repo.eclass_cache.eclasses
+                for eclass in sorted(pkg.inherited):
+                    chf.update('%s\0' % (eclass,))
+                    chf.update(self._hash_path(eclasses[eclass].path))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            # Broken metadata and such; leave that to the check.
+            return None
+        return (pkgs[0].category, pkgs[0].package), chf.hexdigest()
+
+    def _bucket_path(self, key):
+        return pjoin(self.location, *key)
+
+    def _load(self, key):
+        bucket = self._loaded.get(key)
+        if bucket is None:
+            bucket = {}
+            if self.read:
+                try:
+                    with open(self._bucket_path(key), 'rb') as f:
+                        bucket = pickling.load(f)
+                except EnvironmentError, e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                except Exception:
+                    # Corrupted or written by an incompatible version.
+                    bucket = {}
+            self._loaded[key] = bucket
+        return bucket
+
+    def lookup(self, check, key):
+        cp, digest = key
+        results = self._load(cp).get(check, {}).get(digest)
+        if results is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return results
+
+    def store(self, check, key, results):
+        cp, digest = key
+        self._stored.setdefault(cp, {}).setdefault(check, {})[digest] = results
+
+    def flush(self):
+        """Write the results stored since the last flush to disk.
+
+        The results of a check for a package replace everything kept for
+        that check and package, so entries for old versions go away.
+        """
+        for cp, stored in self._stored.iteritems():
+            loaded = self._load(cp)
+            bucket = dict(loaded)
+            bucket.update(stored)
+            path = self._bucket_path(cp)
+            if bucket == loaded:
+                # Nothing new; just mark it as recently used.
+                try:
+                    os.utime(path, None)
+                    continue
+                except EnvironmentError, e:
+                    if e.errno != errno.ENOENT:
+                        raise
+            ensure_dirs(os.path.dirname(path))
+            f = AtomicWriteFile(path, binary=True)
+            try:
+                pickling.dump(bucket, f, -1)
+            except:
+                f.discard()
+                raise
+            f.close()
+        self._stored.clear()
+        self._loaded.clear()
+
+    def evict(self):
+        """Remove least recently used packages until below the size limit."""
+        root = os.path.dirname(self.location)
+        try:
+            repos = listdir_dirs(root)
+        except EnvironmentError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            # nothing stored yet.
+            return
+        entries = []
+        total = 0
+        for repo in repos:
+            for category in listdir_dirs(pjoin(root, repo)):
+                for package in listdir_files(pjoin(root, repo, category)):
+                    path = pjoin(root, repo, category, package)
+                    try:
+                        st = os.stat(path)
+                    except EnvironmentError:
+                        continue
+                    entries.append((st.st_mtime, path, st.st_size))
+                    total += st.st_size
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for mtime, path, size in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except EnvironmentError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            total -= size
+            try:
+                os.rmdir(os.path.dirname(path))
+            except EnvironmentError:
+                pass
+
+    def collect(self):
+        counts = (self.hits, self.misses)
+        self.hits = self.misses = 0
+        return counts
+
+    def merge(self, counts):
+        self.hits += counts[0]
+        self.misses += counts[1]
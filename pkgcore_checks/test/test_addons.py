@@ -1,20 +1,22 @@
 # Copyright: 2007 Brian Harring <ferringb@gmail.com>
 # License: BSD/GPL2
 
+import gc
 import itertools
 import optparse
 import os
 import shutil
 import sys
 
-from pkgcore.ebuild import repo_objs
-from pkgcore.restrictions import packages
+from pkgcore.ebuild import domain, repo_objs
+from pkgcore.ebuild.atom import atom
+from pkgcore.restrictions import packages, values
 from pkgcore.test import TestCase
 from snakeoil.fileutils import write_file
 from snakeoil.osutils import pjoin, ensure_dirs
 from snakeoil.test import mixins
 
-from pkgcore_checks import addons, base
+from pkgcore_checks import addons, base, errors
 from pkgcore_checks.test.misc import FakePkg, FakeProfile, Options
 
 
@@ -154,6 +156,38 @@ class Test_profile_data(TestCase):
         self.assertResults(profile, ["lib", "bar"], ["lib"], [])
 
 
+class Test_mask_filter(TestCase):
+
+    def test_it(self):
+        masks = [atom('dev-util/diffball'), atom('<dev-util/bsdiff-2'),
+                 packages.PackageRestriction(
+                     'category', values.StrExactMatch('dev-lang'))]
+        unmasks = [atom('=dev-util/diffball-0.2'), atom('dev-lang/python')]
+        keywords = packages.PackageRestriction(
+            'keywords', values.ContainmentMatch('x86'))
+        pkgs = [FakePkg(x, data={'KEYWORDS': kw}) for x in (
+            'dev-util/diffball-0.1', 'dev-util/diffball-0.2',
+            'dev-util/bsdiff-1', 'dev-util/bsdiff-2', 'dev-lang/perl-5',
+            'dev-lang/python-2.7', 'app-misc/foo-1')
+            for kw in ('x86', 'ppc')]
+        vfilter = addons.mask_filter(masks, unmasks)
+        x86_filter = vfilter.restrict(keywords)
+        for restrict, mask_filter in (
+                (domain.generate_filter(masks, unmasks), vfilter),
+                (domain.generate_filter(masks, unmasks, keywords),
+                 x86_filter)):
+            self.assertEqual(
+                [x.cpvstr for x in pkgs if mask_filter.match(x)],
+                [x.cpvstr for x in pkgs if restrict.match(x)])
+        self.assertEqual(
+            [x.cpvstr for x in pkgs if x86_filter.match(x)],
+            ['dev-util/diffball-0.2', 'dev-util/bsdiff-2',
+             'dev-lang/python-2.7', 'app-misc/foo-1'])
+        # unmasks are ignored without masks.
+        self.assertTrue(all(addons.mask_filter((), unmasks).match(x)
+                            for x in pkgs))
+
+
 class QuietRepoConfig(repo_objs.RepoConfig):
 
     def load_config(self):
@@ -170,6 +204,8 @@ class profile_mixin(mixins.TempDirMixin, base_test):
 
     def process_check(self, profile_base, *args, **kwds):
         options = base_test.process_check(self, *args, **kwds)
+        # Keep the tests out of the user's profile cache.
+        options.profile_cache_dir = None
         options.search_repo = Options()
         if profile_base is None:
             repo = QuietRepoConfig(self.dir)
@@ -208,7 +244,8 @@ class TestProfileAddon(profile_mixin):
 
     def assertProfiles(self, check, key, *profile_names):
         self.assertEqual(
-            sorted(x.name for y in check.profile_evaluate_dict[key] for x in y),
+            sorted(x.name for y in check.profile_evaluate_dict[key]
+                   for z in y for x in z.members),
             sorted(profile_names))
 
     def test_defaults(self):
@@ -297,6 +334,186 @@ class TestProfileAddon(profile_mixin):
         check = self.addon_kls(options)
         self.assertProfiles(check, 'x86', 'default-linux')
 
+    def test_profile_cache(self):
+        self.mk_profiles({
+            "default-linux": ["x86"],
+            "default-linux/x86": ["x86"]},
+            base='foo')
+        use_mask = pjoin(self.dir, 'foo', 'default-linux', 'use.mask')
+        write_file(use_mask, 'w', 'dar\n')
+        pkg = FakePkg('d-b/ab-1')
+
+        def masked_use():
+            options = self.process_check(pjoin(self.dir, 'foo'), [])
+            options.profile_cache_dir = pjoin(self.dir, 'cache')
+            check = self.addon_kls(options)
+            masked = dict(
+                (x.name, x.masked_use.pull_data(pkg))
+                for x in check.profile_filters['x86'])
+            check.save_cache()
+            return masked
+
+        def hits():
+            return addons.profile_data_cache_lookups.values.get(('hit',), 0)
+
+        start = hits()
+        # Written out once loading is done, not by every keyword loaded.
+        options = self.process_check(pjoin(self.dir, 'foo'), [])
+        options.profile_cache_dir = pjoin(self.dir, 'cache')
+        check = self.addon_kls(options)
+        check.profile_filters['x86']
+        check.profile_filters['~x86']
+        self.assertFalse(os.path.exists(pjoin(self.dir, 'cache')))
+        del check
+        self.assertEqual(masked_use()['default-linux'], set(['dar']))
+        self.assertEqual(hits(), start)
+        self.assertEqual(masked_use()['default-linux'], set(['dar']))
+        self.assertEqual(hits(), start + 2)
+        # Changing a profile invalidates its data, and only its.
+        write_file(use_mask, 'w', 'dar\nfoo\n')
+        # pkgcore reuses the parsed profile nodes still alive.
+        gc.collect()
+        self.assertEqual(masked_use()['default-linux'], set(['dar', 'foo']))
+        self.assertEqual(hits(), start + 3)
+
+    def test_profile_cache_dirs(self):
+        self.mk_profiles({"default-linux/x86": ["x86"]}, base='profiles')
+        # Directories of files need a non PMS profile format.
+        os.mkdir(pjoin(self.dir, 'metadata'))
+        write_file(pjoin(self.dir, 'metadata', 'layout.conf'), 'w',
+                   'masters =\nprofile-formats = portage-2\n')
+        mask_dir = pjoin(self.dir, 'profiles', 'default-linux', 'x86',
+                         'package.mask')
+        os.mkdir(mask_dir)
+        write_file(pjoin(mask_dir, 'a'), 'w', 'd-b/ab\n')
+        pkg = FakePkg('d-b/ab-1', data={'KEYWORDS': 'x86'})
+
+        def visible():
+            options = self.process_check(pjoin(self.dir, 'profiles'), [])
+            options.profile_cache_dir = pjoin(self.dir, 'cache')
+            check = self.addon_kls(options)
+            visible = check.profile_filters['x86'][0].visible(pkg)
+            check.save_cache()
+            return visible
+
+        start = addons.profile_data_cache_lookups.values.get(('hit',), 0)
+        self.assertFalse(visible())
+        self.assertFalse(visible())
+        self.assertEqual(
+            addons.profile_data_cache_lookups.values.get(('hit',), 0),
+            start + 1)
+        # Files in directories of the profile count too.
+        write_file(pjoin(mask_dir, 'a'), 'w', 'd-b/abc\n')
+        gc.collect()
+        self.assertTrue(visible())
+
+    def test_broken_profile(self):
+        self.mk_profiles({
+            "default-linux": ["x86"],
+            "default-linux/x86": ["x86"]},
+            base='foo')
+        write_file(pjoin(self.dir, 'foo', 'default-linux', 'package.mask'),
+                   'w', 'not an atom\n')
+        check = self.addon_kls(self.process_check(pjoin(self.dir, 'foo'), []))
+        loads = []
+        load_keywords = check._load_keywords
+        check._load_keywords = lambda keys: (
+            loads.append(keys), load_keywords(keys))
+        try:
+            check.profile_filters['x86']
+        except errors.FatalError, e:
+            pass
+        else:
+            self.fail('no FatalError raised')
+        # Not retried by every package looking at the profiles.
+        for key in ('x86', '~x86'):
+            try:
+                check.profile_evaluate_dict[key]
+            except errors.FatalError, e2:
+                self.assertIdentical(e2, e)
+            else:
+                self.fail('no FatalError raised')
+        self.assertEqual(loads, [['x86']])
+
+    def test_jobs(self):
+        self.mk_profiles({
+            "default-linux": ["x86"],
+            "default-linux/x86": ["x86"],
+            "default-linux/ppc": ["ppc", False, True]},
+            base='foo')
+        write_file(pjoin(self.dir, 'foo', 'default-linux', 'use.mask'),
+                   'w', 'dar\n')
+        write_file(pjoin(self.dir, 'foo', 'default-linux', 'package.mask'),
+                   'w', 'd-b/ab\n')
+        pkg = FakePkg('d-b/ab-1', data={'KEYWORDS': 'x86'})
+
+        def loaded(jobs, cache_dir=None):
+            options = self.process_check(
+                pjoin(self.dir, 'foo'), ['--profile-disable-deprecated'])
+            options.jobs = jobs
+            options.profile_cache_dir = cache_dir
+            check = self.addon_kls(options)
+            return sorted(
+                (key, x.name, sorted(x.masked_use.pull_data(pkg)),
+                 sorted(x.forced_use.pull_data(pkg)), x.visible(pkg))
+                for key, profiles in check.profile_filters.iteritems()
+                for x in profiles)
+
+        expected = loaded(1)
+        self.assertEqual(
+            [x[1:] for x in expected if x[0] == 'x86'],
+            [('default-linux', ['dar', 'ppc'], ['x86'], False),
+             ('default-linux/x86', ['ppc'], ['x86'], True)])
+        self.assertEqual(loaded(2), expected)
+        # and through the profile cache, filled by the workers.
+        cache_dir = pjoin(self.dir, 'cache')
+        self.assertEqual(loaded(2, cache_dir), expected)
+        self.assertEqual(loaded(2, cache_dir), expected)
+
+    def test_equivalence_classes(self):
+        self.mk_profiles({
+            "default-linux": ["x86"],
+            "default-linux/x86": ["x86"],
+            "default-linux/x86/server": ["x86"]},
+            base='foo')
+        write_file(pjoin(self.dir, 'foo', 'default-linux', 'x86', 'server',
+                         'package.mask'), 'w', 'd-b/ab\n')
+        check = self.addon_kls(self.process_check(pjoin(self.dir, 'foo'), []))
+        for key in ('x86', '~x86'):
+            classes = sorted(
+                sorted(x.name for x in profile.members)
+                for group in check.profile_evaluate_dict[key]
+                for profile in group)
+            self.assertEqual(classes, [
+                ['default-linux', 'default-linux/x86'],
+                ['default-linux/x86/server']])
+            # every profile is still listed, sharing the data of its class.
+            profiles = dict(
+                (x.name, x) for x in check.profile_filters[key])
+            self.assertEqual(sorted(profiles), [
+                'default-linux', 'default-linux/x86',
+                'default-linux/x86/server'])
+            self.assertIdentical(
+                profiles['default-linux'].visible,
+                profiles['default-linux/x86'].visible)
+
+    def test_lazy_loading(self):
+        self.mk_profiles({
+            "default-linux/x86": ["x86"],
+            "default-linux/ppc": ["ppc"]},
+            base='foo')
+        options = self.process_check(pjoin(self.dir, 'foo'), [])
+        check = self.addon_kls(options)
+        self.assertEqual(sorted(check.profile_filters),
+                         ['ppc', 'x86', '~ppc', '~x86'])
+        self.assertFalse(check._loaded)
+        l = check.identify_profiles(FakePkg("d-b/ab-1", data={'KEYWORDS': '~ppc'}))
+        self.assertEqual([x.name for y in l for x in y], ['default-linux/ppc'])
+        self.assertEqual(sorted(check._loaded), ['ppc', '~ppc'])
+        self.assertEqual([x.name for x in check.profile_filters['x86']],
+                         ['default-linux/x86'])
+        self.assertEqual(sorted(check._loaded), ['ppc', 'x86', '~ppc', '~x86'])
+
     def test_identify_profiles(self):
         self.mk_profiles({
             'default-linux': ['x86'],
@@ -315,16 +532,16 @@ class TestProfileAddon(profile_mixin):
 
         options = run_check()
         check = self.addon_kls(options)
-        # assert they're collapsed properly.
+        # assert they're collapsed properly; into one equivalence class.
         self.assertProfiles(check, 'x86', 'default-linux', 'default-linux/x86')
         self.assertEqual(len(check.profile_evaluate_dict['x86']), 1)
-        self.assertEqual(len(check.profile_evaluate_dict['x86'][0]), 2)
+        self.assertEqual(len(check.profile_evaluate_dict['x86'][0]), 1)
         self.assertProfiles(check, 'ppc', 'default-linux/ppc')
 
         l = check.identify_profiles(FakePkg("d-b/ab-1", data={'KEYWORDS': 'x86'}))
         self.assertEqual(len(l), 1, msg="checking for profile collapsing: %r" % l)
-        self.assertEqual(len(l[0]), 2, msg="checking for proper # of profiles: %r" % l[0])
-        self.assertEqual(sorted(x.name for x in l[0]),
+        self.assertEqual(len(l[0]), 1, msg="checking for proper # of profiles: %r" % l[0])
+        self.assertEqual(sorted(x.name for x in l[0][0].members),
                          sorted(['default-linux', 'default-linux/x86']))
 
         # check keyword collapsing
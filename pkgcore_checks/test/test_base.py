@@ -1,9 +1,14 @@
 # Copyright: 2006 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+import logging
+
 from pkgcore.test import TestCase
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
 
-from pkgcore_checks import base
+from pkgcore_checks import base, errors
+from pkgcore_checks.test import misc
 
 
 dummies = list('dummy-%s' % (i,) for i in xrange(0, 10))
@@ -21,6 +26,20 @@ class UtilitiesTest(TestCase):
         self.assertFalse(base.convert_check_filter('baz.spork')('foo.bar.baz'))
         self.assertFalse(base.convert_check_filter('bar.foo')('foo.bar.baz'))
 
+    def test_required_addons(self):
+        class Base(base.Addon):
+            pass
+        class Middle(base.Addon):
+            required_addons = (Base,)
+        class Top(base.Addon):
+            required_addons = (Middle,)
+        class Other(base.Addon):
+            pass
+        self.assertEqual(base.required_addons([Top]),
+                         set([Top, Middle, Base]))
+        self.assertEqual(base.required_addons([Other, Middle]),
+                         set([Other, Middle, Base]))
+
 
 class DummySource(object):
 
@@ -126,7 +145,9 @@ class PlugTest(TestCase):
         if kw:
             raise TypeError('unsupported kwargs %r' % (kw.keys(),))
         try:
-            actual_bad_sinks, pipes = base.plug(sinks, transforms, sources)
+            # A fresh plan cache, so each call actually plans.
+            actual_bad_sinks, pipes = base.plug(
+                sinks, transforms, sources, plans=base.PlanCache())
         except KeyboardInterrupt:
             raise
         except Exception:
@@ -135,7 +156,7 @@ class PlugTest(TestCase):
             # Rerun in debug mode.
             def _debug(message, *args):
                 print message % args
-            base.plug(sinks, transforms, sources, _debug)
+            base.plug(sinks, transforms, sources, _debug, base.PlanCache())
             # Should not reach this since base.plug should raise again.
             raise
         actual_pipes = set(pipes)
@@ -147,7 +168,7 @@ class PlugTest(TestCase):
             message = ['', '']
             def _debug(format, *args):
                 message.append(format % args)
-            base.plug(sinks, transforms, sources, _debug)
+            base.plug(sinks, transforms, sources, _debug, base.PlanCache())
             message.extend(['', 'Expected:'])
             for pipe in expected_pipes:
                 message.append(str(pipe))
@@ -295,3 +316,197 @@ class PlugTest(TestCase):
             [source],
             (source, base.CheckRunner([
                 trans_fast(base.CheckRunner([sinks[2]]))])))
+
+    def test_many_types(self):
+        # Far too many combinations to try them all.
+        self.assertPipes(
+            sinks,
+            trans_everything,
+            [sources[0]],
+            (sources[0], base.CheckRunner([sinks[0]] + list(
+                trans(0, i)(base.CheckRunner([sinks[i]]))
+                for i in xrange(1, len(dummies))))))
+        self.assertPipes(
+            [sinks[len(dummies) - 1]],
+            trans_up + trans_down + (trans(0, len(dummies) - 1, cost=85),),
+            [sources[0]],
+            (sources[0], base.CheckRunner([
+                trans(0, len(dummies) - 1, cost=85)(base.CheckRunner([
+                    sinks[len(dummies) - 1]]))])))
+
+
+class RecordingSink(base.Template):
+
+    def __init__(self, feed_type, fail=False):
+        base.Template.__init__(self, None)
+        self.feed_type = feed_type
+        self.fail = fail
+        self.seen = []
+
+    def feed(self, item, reporter):
+        self.seen.append(item)
+        if self.fail:
+            raise ValueError(item)
+
+
+class FatalSink(RecordingSink):
+
+    def feed(self, item, reporter):
+        RecordingSink.feed(self, item, reporter)
+        raise errors.FatalError(item)
+
+
+class BatchSink(RecordingSink):
+
+    def feed_batch(self, items, reporter):
+        self.seen.append(list(items))
+
+
+class Unwrap(base.Transform):
+
+    source = dummies[1]
+    dest = dummies[0]
+    scope = base.version_scope
+    cost = 1
+    unwrap = staticmethod(lambda item: item[0])
+
+
+class Wrap(base.Transform):
+
+    source = dummies[0]
+    dest = dummies[1]
+    scope = base.version_scope
+    cost = 1
+
+    def feed(self, item, reporter):
+        self.child.feed((item,), reporter)
+
+
+class CompilePipelineTest(TestCase):
+
+    def test_compile(self):
+        first = RecordingSink(dummies[0])
+        broken = RecordingSink(dummies[0], fail=True)
+        last = RecordingSink(dummies[0])
+        wrapped = RecordingSink(dummies[1])
+        pipe = base.CheckRunner([
+            first,
+            Unwrap(base.CheckRunner([
+                broken, Wrap(base.CheckRunner([wrapped]))])),
+            last])
+        compiled = base.compile_pipeline(pipe)
+        self.assertIsInstance(compiled, base.Dispatcher)
+        # The unwrapping transform is gone, the other one is kept.
+        self.assertEqual(
+            [x.__class__ for x in compiled.checks],
+            [RecordingSink, RecordingSink, Wrap, RecordingSink])
+        self.assertIsInstance(compiled.checks[2].child, base.Dispatcher)
+        self.assertEqual(
+            base.collect_checks(compiled),
+            set([first, broken, last, wrapped]))
+
+        compiled.start()
+        logging.disable(logging.CRITICAL)
+        try:
+            compiled.feed(('a',), None)
+        finally:
+            logging.disable(logging.NOTSET)
+        compiled.finish(None)
+        self.assertEqual(first.seen, [('a',)])
+        # A failing check does not keep the others from being fed.
+        self.assertEqual(broken.seen, ['a'])
+        self.assertEqual(wrapped.seen, [('a',)])
+        self.assertEqual(last.seen, [('a',)])
+
+    def test_fatal(self):
+        fatal = FatalSink(dummies[0])
+        last = RecordingSink(dummies[0])
+        compiled = base.compile_pipeline(base.CheckRunner([fatal, last]))
+        compiled.start()
+        self.assertRaises(errors.FatalError, compiled.feed, ('a',), None)
+        self.assertEqual(last.seen, [])
+        self.assertRaises(
+            errors.FatalError, base.feed_each, fatal, ['b', 'c'],
+            fatal.feed, None)
+        self.assertEqual(fatal.seen, [('a',), 'b'])
+
+    def test_batches(self):
+        plain = RecordingSink(dummies[0])
+        batched = BatchSink(dummies[0])
+        wrapped = base.CheckWrapper(BatchSink(dummies[0]))
+        pipe = base.CheckRunner([plain, Unwrap(base.CheckRunner([batched])),
+                                 wrapped])
+        compiled = base.compile_pipeline(pipe, batch_size=2)
+        compiled.start()
+        for item in ('a', 'b', 'c'):
+            compiled.feed((item,), None)
+        self.assertEqual(batched.seen, [['a', 'b']])
+        compiled.finish(None)
+        self.assertEqual(plain.seen, [('a',), ('b',), ('c',)])
+        self.assertEqual(batched.seen, [['a', 'b'], ['c']])
+        self.assertEqual(wrapped.wrapped.seen, [[('a',), ('b',)], [('c',)]])
+
+        # Batches end with the package.
+        batched = BatchSink(dummies[0])
+        compiled = base.compile_pipeline(
+            base.CheckRunner([batched]), batch_size=10)
+        pkgs = list(misc.FakePkg(x) for x in (
+            'dev-util/foo-1', 'dev-util/foo-2', 'dev-util/bar-1'))
+        for pkg in pkgs:
+            compiled.feed(pkg, None)
+        self.assertEqual(batched.seen, [pkgs[:2]])
+        compiled.finish(None)
+        self.assertEqual(batched.seen, [pkgs[:2], pkgs[2:]])
+
+        batched = BatchSink(dummies[0])
+        compiled = base.compile_pipeline(
+            base.CheckRunner([batched]), batch_size=1)
+        compiled.feed('a', None)
+        self.assertEqual(batched.seen, ['a'])
+
+
+class PlanCacheTest(TempDirMixin, TestCase):
+
+    def test_plan_cache(self):
+        plans = base.PlanCache()
+        args = ([sinks[2], sinks[0]], trans_up, [sources[0]])
+        expected = base.plug(*args, plans=plans)
+        self.assertEqual((plans.hits, plans.misses), (0, 1))
+        # The order of sinks and transforms does not matter.
+        self.assertEqual(
+            base.plug(list(reversed(args[0])), tuple(reversed(trans_up)),
+                      args[2], plans=plans),
+            expected)
+        self.assertEqual((plans.hits, plans.misses), (1, 1))
+
+        path = pjoin(self.dir, 'plans')
+        plans.save(path)
+        self.assertFalse(plans.dirty)
+        loaded = base.PlanCache()
+        loaded.load(path)
+        self.assertEqual(base.plug(*args, plans=loaded), expected)
+        self.assertEqual((loaded.hits, loaded.misses), (1, 0))
+
+        with open(path, 'w') as f:
+            f.write('garbage')
+        loaded = base.PlanCache()
+        loaded.load(path)
+        loaded.load(pjoin(self.dir, 'missing'))
+        self.assertEqual(loaded.plans, {})
+
+    def test_unreachable(self):
+        plans = base.PlanCache()
+        args = ([sinks[2], sinks[1]], [], [sources[1]])
+        self.assertEqual(base.plug(*args, plans=plans), ([sinks[2]], [
+            (sources[1], base.CheckRunner([sinks[1]]))]))
+        self.assertEqual(base.plug(*args, plans=plans), ([sinks[2]], [
+            (sources[1], base.CheckRunner([sinks[1]]))]))
+        self.assertEqual(plans.hits, 1)
+        # Looked up without building anything, classes work too.
+        class Sink(base.Template):
+            feed_type = sinks[2].feed_type
+            scope = sinks[2].scope
+        self.assertEqual(base.unreachable_sinks(
+            [Sink, sinks[1]], [], [sources[1]], plans=plans), [Sink])
+        self.assertEqual(plans.hits, 2)
+        self.assertEqual(base.unreachable_sinks([], [], [sources[1]]), [])
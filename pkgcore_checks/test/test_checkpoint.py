@@ -0,0 +1,132 @@
+# License: BSD/GPL2
+
+import os
+
+from pkgcore.repository.util import SimpleTree
+from pkgcore.restrictions import packages
+from pkgcore.test import TestCase
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore_checks import base, checkpoint, errors, feeds, parallel
+
+
+class CountResult(base.Result):
+
+    __slots__ = ('name', 'count')
+
+    def __init__(self, name, count):
+        base.Result.__init__(self)
+        self.name = name
+        self.count = count
+
+    def __eq__(self, other):
+        return (self.name, self.count) == (other.name, other.count)
+
+    def __repr__(self):
+        return 'CountResult(%r, %r)' % (self.name, self.count)
+
+
+class CategoryCheck(base.Template):
+
+    feed_type = base.category_feed
+    scope = base.category_scope
+
+    # Category to act like the scan got killed at.
+    killed_at = None
+
+    def feed(self, chunk, reporter):
+        if chunk[0].category == self.killed_at:
+            raise KeyboardInterrupt
+        reporter.add_report(CountResult(chunk[0].category, len(chunk)))
+
+
+class RepoCheck(base.Template):
+
+    feed_type = base.versioned_feed
+    scope = base.repository_scope
+
+    def start(self):
+        self.seen = 0
+
+    def feed(self, pkg, reporter):
+        self.seen += 1
+
+    def save_state(self):
+        return self.seen
+
+    def restore_state(self, state):
+        self.seen = state
+
+    def finish(self, reporter):
+        reporter.add_report(CountResult('repo', self.seen))
+
+
+class UnsavedRepoCheck(RepoCheck):
+
+    save_state = None
+
+
+class TestCheckpoint(TempDirMixin, TestCase):
+
+    repo = SimpleTree({
+        'a': {'x': ('1', '2'), 'y': ('1',)},
+        'b': {'x': ('1',)},
+        'c': {'z': ('1', '2', '3')},
+        'd': {'x': ('1',)},
+    })
+
+    expected = [
+        CountResult('a', 3), CountResult('b', 1), CountResult('c', 3),
+        CountResult('d', 1), CountResult('repo', 8)]
+
+    def run_scan(self, repo_check, resume=False, killed_at=None):
+        category_check = CategoryCheck(None)
+        category_check.killed_at = killed_at
+        sinks = [category_check]
+        if repo_check is not None:
+            sinks.append(repo_check(None))
+        reporter = parallel.CollectingReporter()
+        ckpt = checkpoint.Checkpoint(self.dir, resume, interval=0)
+        source = feeds.RestrictedRepoSource(self.repo, packages.AlwaysTrue)
+        checkpoint.run_checkpointed(
+            self.repo, packages.AlwaysTrue, source, sinks,
+            [feeds.VersionToCategory], reporter, ckpt)
+        return reporter.results
+
+    def check_resume(self, repo_check):
+        path = pjoin(self.dir, checkpoint.Checkpoint.filename)
+        self.assertEqual(self.run_scan(repo_check), self.expected)
+        # Removed once the scan is complete.
+        self.assertFalse(os.path.exists(path))
+        self.assertRaises(
+            KeyboardInterrupt, self.run_scan, repo_check, killed_at='c')
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.run_scan(repo_check, True), self.expected)
+        self.assertFalse(os.path.exists(path))
+
+    def test_resume(self):
+        self.check_resume(RepoCheck)
+
+    def test_resume_unsaved_state(self):
+        # The repository wide check gets fed every category again.
+        self.check_resume(UnsavedRepoCheck)
+
+    def test_restorable(self):
+        sinks = [CategoryCheck(None), RepoCheck(None)]
+        source = feeds.RestrictedRepoSource(self.repo, packages.AlwaysTrue)
+
+        def restorable(sinks, transforms):
+            pipes = parallel.plug_split(sinks, transforms, source)[1]
+            return checkpoint.restorable(pipes)
+
+        self.assertTrue(restorable(sinks, [feeds.VersionToCategory]))
+        self.assertFalse(restorable(
+            sinks + [UnsavedRepoCheck(None)], [feeds.VersionToCategory]))
+
+    def test_other_scan(self):
+        self.assertRaises(
+            KeyboardInterrupt, self.run_scan, RepoCheck, killed_at='b')
+        self.assertRaises(errors.CheckpointError, self.run_scan, None, True)
+        # Not resuming starts over.
+        self.assertEqual(self.run_scan(None), self.expected[:-1])
@@ -0,0 +1,224 @@
+# License: BSD/GPL2
+
+import os
+import socket
+from StringIO import StringIO
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.test import TestCase
+from snakeoil import pickling
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore_checks import base, daemon
+from pkgcore_checks.test.misc import Options
+
+
+class Base(base.Addon):
+    pass
+
+
+class Middle(base.Addon):
+    required_addons = (Base,)
+
+
+class Top(base.Addon):
+    required_addons = (Middle,)
+
+
+class Other(base.Addon):
+    pass
+
+
+class TestAddonGraph(TestCase):
+
+    def test_stale_addons(self):
+        addons = [Base, Middle, Top, Other]
+        self.assertEqual(daemon.stale_addons(addons, [Base]),
+                         set([Base, Middle, Top]))
+        self.assertEqual(daemon.stale_addons(addons, [Top]), set([Top]))
+        self.assertEqual(daemon.stale_addons(addons, []), set())
+
+
+class TestFingerprint(TempDirMixin, TestCase):
+
+    def test_it(self):
+        path = pjoin(self.dir, 'profiles')
+        os.mkdir(path)
+        missing = daemon.fingerprint([path, pjoin(self.dir, 'missing')])
+        with open(pjoin(path, 'package.mask'), 'w') as f:
+            f.write('dev-util/foo\n')
+        first = daemon.fingerprint([path, pjoin(self.dir, 'missing')])
+        self.assertNotEqual(missing, first)
+        self.assertEqual(
+            first, daemon.fingerprint([path, pjoin(self.dir, 'missing')]))
+        with open(pjoin(path, 'package.mask'), 'a') as f:
+            f.write('dev-util/bar\n')
+        self.assertNotEqual(first, daemon.fingerprint([path]))
+        single = daemon.fingerprint([pjoin(path, 'package.mask')])
+        self.assertEqual(len(single), 1)
+
+
+class Result(base.Result):
+
+    __slots__ = ('message',)
+
+    def __init__(self, message):
+        base.Result.__init__(self)
+        self.message = message
+
+
+class Recorder(base.Reporter):
+
+    def __init__(self):
+        base.Reporter.__init__(self)
+        self.calls = []
+
+    def start_check(self, checks, target):
+        self.calls.append(('start', target))
+
+    def add_report(self, result):
+        self.calls.append(('result', result.message))
+
+    def end_check(self):
+        self.calls.append(('end',))
+
+
+class TestReplay(TestCase):
+
+    def test_replay(self):
+        stream = StringIO()
+        reporter = daemon.StreamReporter(stream)
+        reporter.start_check([], 'first')
+        reporter.add_report(Result('one'))
+        reporter.start_check([], 'second')
+        reporter.add_report(Result('two'))
+        stream.seek(0)
+        recorder = Recorder()
+        self.assertIdentical(daemon.replay(stream, recorder), None)
+        self.assertEqual(recorder.calls, [
+            ('start', 'first'), ('result', 'one'), ('end',),
+            ('start', 'second'), ('result', 'two'), ('end',)])
+
+    def test_error(self):
+        stream = StringIO()
+        daemon.StreamReporter(stream).dump(daemon.ScanError('broken'))
+        stream.seek(0)
+        recorder = Recorder()
+        self.assertEqual(daemon.replay(stream, recorder), 'broken')
+        self.assertEqual(recorder.calls, [])
+
+
+class Setting(base.Addon):
+
+    source_paths = ('setting',)
+
+    def __init__(self, options, *args):
+        base.Addon.__init__(self, options)
+        with open(pjoin(options.repo_bases[0], 'setting')) as f:
+            self.value = f.read()
+        if self.value == 'broken':
+            raise ValueError('broken setting')
+
+
+class Dependent(base.Addon):
+    required_addons = (Setting,)
+
+
+class Sink(list):
+
+    def write(self, *args):
+        self.append(args)
+
+
+class TestRefresh(TempDirMixin, TestCase):
+
+    def write(self, value):
+        with open(pjoin(self.dir, 'setting'), 'w') as f:
+            f.write(value)
+        # Make sure the fingerprint differs despite the same size.
+        st = os.stat(pjoin(self.dir, 'setting'))
+        os.utime(pjoin(self.dir, 'setting'), (st.st_atime, st.st_mtime + 1))
+
+    def request(self, server, targets):
+        sock = server.bind(pjoin(self.dir, 'socket'))
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(pjoin(self.dir, 'socket'))
+            stream = client.makefile('rwb')
+            pickling.dump(dict(
+                targets=targets, cwd=self.dir, checks_to_run=[],
+                checks_to_disable=[]), stream, -1)
+            stream.flush()
+            conn = sock.accept()[0]
+            server.handle(conn)
+            conn.close()
+            return daemon.replay(stream, Recorder())
+        finally:
+            client.close()
+            sock.close()
+            os.unlink(pjoin(self.dir, 'socket'))
+
+    def test_failed_refresh(self):
+        self.write('first')
+        options = Options(
+            addons=[Setting, Dependent], repo_bases=[self.dir],
+            target_repo=None, src_repo=None, search_repo=None, checks=[])
+        server = daemon.Daemon(options, None, Sink())
+        server.refresh()
+        self.assertEqual(server.addons_map[Setting].value, 'first')
+        fingerprints = dict(server.fingerprints)
+
+        self.write('broken')
+        error = self.request(server, ['dev-util/foo'])
+        self.assertIn('broken setting', error)
+        self.assertIn('Traceback', error)
+        # Not marked as done, so the next scan tries again.
+        self.assertEqual(server.fingerprints, fingerprints)
+        self.assertRaises(ValueError, server.refresh)
+
+        self.write('second')
+        server.refresh()
+        self.assertEqual(server.addons_map[Setting].value, 'second')
+        self.assertIdentical(
+            server.addons_map[Dependent].__class__, Dependent)
+        self.assertNotEqual(server.fingerprints, fingerprints)
+
+
+class External(base.Addon):
+
+    source_options = ('external_dir',)
+
+
+class TestSourceOptions(TempDirMixin, TestCase):
+
+    def test_it(self):
+        options = Options(repo_bases=[], external_dir=self.dir)
+        server = daemon.Daemon(options, None, None)
+        first = server.fingerprint(External)
+        with open(pjoin(self.dir, 'glsa-1.xml'), 'w') as f:
+            f.write('<glsa/>\n')
+        self.assertNotEqual(first, server.fingerprint(External))
+
+
+class TestLimiters(TempDirMixin, TestCase):
+
+    def test_ebuild_paths(self):
+        os.makedirs(pjoin(self.dir, 'repo', 'dev-util', 'foo'))
+        ebuild = pjoin(self.dir, 'repo', 'dev-util', 'foo', 'foo-1.ebuild')
+        with open(ebuild, 'w') as f:
+            f.write('EAPI=5\n')
+        with open(pjoin(self.dir, 'bar-1.ebuild'), 'w') as f:
+            f.write('EAPI=5\n')
+        options = Options(target_repo=Options(base=pjoin(self.dir, 'repo')))
+        server = daemon.Daemon(options, None, None)
+
+        def limiters(*targets):
+            return server.limiters(dict(
+                targets=list(targets), cwd=pjoin(self.dir, 'repo')))
+
+        self.assertEqual(
+            limiters('dev-util/foo/foo-1.ebuild', ebuild, 'dev-util/bar'),
+            [atom('=dev-util/foo-1'), atom('dev-util/bar')])
+        self.assertRaises(
+            ValueError, limiters, pjoin(self.dir, 'bar-1.ebuild'))
@@ -21,3 +21,13 @@ class TestDeprecatedEclass(misc.ReportTestCase):
         reports = self.assertReports(
             check, self.mk_pkg("0.1", check.blacklist))
         self.assertEqual(len(reports), 1)
+
+    def test_batch(self):
+        check = dep_eclass(None, None)
+        pkgs = [self.mk_pkg("0.1", ["git", "eutils"]),
+                self.mk_pkg("0.2", ["eutils"]),
+                self.mk_pkg("0.3", ["git", "eutils"])]
+        reports = []
+        check.feed_batch(pkgs, misc.fake_reporter(reports.append))
+        self.assertEqual([x.version for x in reports], ["0.1", "0.3"])
+        self.assertEqual(dict(reports[1].eclasses), {"git": "git-r3"})
@@ -0,0 +1,186 @@
+# License: BSD/GPL2
+
+import os
+import stat
+
+from pkgcore.repository.util import SimpleTree
+from pkgcore.restrictions import packages
+from pkgcore.test import TestCase
+from pkgcore.util.parserestrict import parse_match
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore_checks import base, feeds
+
+
+class Result(base.Result):
+
+    def __init__(self, category=None, package=None, version=None):
+        base.Result.__init__(self)
+        if category is not None:
+            self.category = category
+        if package is not None:
+            self.package = package
+        if version is not None:
+            self.version = version
+
+
+class Reporter(base.Reporter):
+
+    def __init__(self):
+        base.Reporter.__init__(self)
+        self.calls = []
+
+    def start_check(self, checks, target):
+        self.calls.append(('start', str(target)))
+
+    def add_report(self, result):
+        self.calls.append(result)
+
+    def end_check(self):
+        self.calls.append('end')
+
+
+class TestTargetSources(TestCase):
+
+    def setUp(self):
+        self.repo = SimpleTree({
+            'app-misc': {'baz': ('1', '2'), 'qux': ('3',)},
+            'dev-util': {'bar': ('1',), 'foo': ('1', '2')},
+            })
+
+    def source(self, *targets):
+        sources = feeds.target_sources(
+            self.repo, [parse_match(x) for x in targets])
+        self.assertEqual(len(sources), 1)
+        return sources[0]
+
+    def test_limiter_key(self):
+        self.assertEqual(
+            feeds.limiter_key(parse_match('>=dev-util/foo-1')),
+            ('dev-util', 'foo'))
+        self.assertIdentical(feeds.limiter_key(parse_match('dev-util/*')), None)
+        self.assertIdentical(feeds.limiter_key(parse_match('foo')), None)
+
+    def test_grouping(self):
+        sources = feeds.target_sources(self.repo, [
+            parse_match(x) for x in ('dev-util/foo', 'app-misc/*',
+                                     'app-misc/baz')])
+        self.assertEqual(
+            [(x.__class__, x.scope) for x in sources],
+            [(feeds.MultiTargetSource, base.package_scope),
+             (feeds.RestrictedRepoSource, base.category_scope)])
+
+    def test_feed(self):
+        source = self.source(
+            'dev-util/foo', '=app-misc/baz-2', 'bar', 'app-misc/baz')
+        self.assertIsInstance(source, feeds.MultiTargetSource)
+        self.assertEqual(
+            [x.cpvstr for x in source.feed()],
+            ['app-misc/baz-1', 'app-misc/baz-2', 'dev-util/bar-1',
+             'dev-util/foo-1', 'dev-util/foo-2'])
+        self.assertEqual(
+            str(source.target(Result('app-misc', 'baz', '2'))),
+            '=app-misc/baz-2')
+        self.assertEqual(
+            str(source.target(Result('app-misc', 'baz', '1'))), 'app-misc/baz')
+        self.assertEqual(
+            str(source.target(Result('app-misc', 'baz'))), '=app-misc/baz-2')
+        self.assertEqual(
+            str(source.target(Result('dev-util', 'bar'))),
+            str(parse_match('bar')))
+        # Falls back to the category.
+        self.assertEqual(
+            str(source.target(Result('app-misc', 'qux'))), '=app-misc/baz-2')
+        self.assertIdentical(source.target(Result('sys-apps', 'qux')), None)
+        self.assertIdentical(source.target(Result()), None)
+
+    def test_target_reporter(self):
+        source = self.source('dev-util/foo', 'app-misc/baz')
+        list(source.feed())
+        reporter = Reporter()
+        target_reporter = feeds.TargetReporter(reporter, source)
+        results = [Result('app-misc', 'baz', '1'), Result(),
+                   Result('dev-util', 'foo', '2'), Result('dev-util', 'foo')]
+        target_reporter.start_check([], source.limiter)
+        for result in results:
+            target_reporter.add_report(result)
+        target_reporter.end_check()
+        self.assertEqual(reporter.calls, [
+            ('start', 'dev-util/foo'), 'end',
+            ('start', 'app-misc/baz'), results[0], results[1], 'end',
+            ('start', 'dev-util/foo'), results[2], results[3], 'end'])
+
+
+class RepoCheck(base.Template):
+
+    feed_type = base.repository_feed
+    scope = base.repository_scope
+
+    def start(self):
+        self.fed = []
+
+    def feed(self, chunk, reporter):
+        self.fed.append(tuple(pkg.cpvstr for pkg in chunk))
+
+
+class TestToRepo(TestCase):
+
+    repo = SimpleTree({
+        'app-misc': {'baz': ('1', '2'), 'qux': ('3',)},
+        'dev-util': {'foo': ('1',)},
+        })
+
+    def scan(self, transforms, compiled):
+        check = RepoCheck(None)
+        source = feeds.RestrictedRepoSource(self.repo, packages.AlwaysTrue)
+        bad, pipes = base.plug([check], transforms, [source])
+        self.assertFalse(bad)
+        (source, pipe), = pipes
+        if compiled:
+            pipe = base.compile_pipeline(pipe)
+        pipe.start()
+        for pkg in source.feed():
+            pipe.feed(pkg, None)
+            # Streamed, nothing waits for the end of the repository.
+            if pkg.category == 'dev-util':
+                self.assertTrue(check.fed)
+        pipe.finish(None)
+        return check.fed
+
+    def test_package_to_repo(self):
+        transforms = [feeds.VersionToPackage, feeds.PackageToRepo]
+        for compiled in (False, True):
+            self.assertEqual(self.scan(transforms, compiled), [
+                ('app-misc/baz-1', 'app-misc/baz-2'), ('app-misc/qux-3',),
+                ('dev-util/foo-1',)])
+
+    def test_category_to_repo(self):
+        transforms = [feeds.VersionToCategory, feeds.CategoryToRepo]
+        for compiled in (False, True):
+            self.assertEqual(self.scan(transforms, compiled), [
+                ('app-misc/baz-1', 'app-misc/baz-2', 'app-misc/qux-3'),
+                ('dev-util/foo-1',)])
+
+
+class TestDirSnapshot(TempDirMixin, TestCase):
+
+    def test_snapshot(self):
+        os.makedirs(pjoin(self.dir, 'files', 'sub'))
+        os.makedirs(pjoin(self.dir, 'files', '.svn'))
+        for path, size in (('foo-1.ebuild', 3), ('files/a.patch', 5),
+                           ('files/sub/b.patch', 7), ('files/.svn/entries', 1)):
+            with open(pjoin(self.dir, path), 'w') as f:
+                f.write('x' * size)
+        snapshot = feeds.DirSnapshot(self.dir, walk_files=True)
+        self.assertEqual(sorted(snapshot.entries), ['files', 'foo-1.ebuild'])
+        self.assertEqual(snapshot.entries['foo-1.ebuild'][1], 3)
+        self.assertEqual(
+            sorted((path, size) for path, mode, size, mtime in snapshot.files
+                   if stat.S_ISREG(mode)),
+            [('files/a.patch', 5), ('files/sub/b.patch', 7)])
+        # Taken once, not updated.
+        os.unlink(pjoin(self.dir, 'foo-1.ebuild'))
+        self.assertIn('foo-1.ebuild', snapshot.entries)
+        self.assertIdentical(
+            feeds.DirSnapshot(pjoin(self.dir, 'files', 'sub')).files, None)
@@ -0,0 +1,110 @@
+# License: BSD/GPL2
+
+import gc
+import pickle
+import sys
+
+from pkgcore.test import TestCase
+
+from pkgcore_checks import base, memory
+
+
+class Slotted(object):
+
+    __slots__ = ('data', '__private')
+
+    def __init__(self, data):
+        self.data = data
+        self.__private = [data]
+
+
+class Lazy(object):
+
+    def __getattr__(self, attr):
+        raise AssertionError('looked up %s' % (attr,))
+
+
+class Sink(base.Template):
+
+    feed_type = base.versioned_feed
+
+    def __init__(self, shared):
+        base.Template.__init__(self, None)
+        self.shared = shared
+        self.seen = []
+
+    def feed(self, item, reporter):
+        self.seen.append('x' * 1000)
+
+    def finish(self, reporter):
+        self.seen = []
+
+
+class TestDeepSize(TestCase):
+
+    def test_deep_size(self):
+        data = 'x' * 10000
+        self.assertTrue(memory.deep_size([data]) > 10000)
+        self.assertTrue(memory.deep_size({'key': data}) > 10000)
+        # Shared data is only counted once.
+        self.assertTrue(memory.deep_size([data, data]) < 20000)
+        self.assertTrue(memory.deep_size([data], skip=[id(data)]) < 1000)
+        # Slots, including name mangled ones.
+        obj = Slotted(data)
+        self.assertTrue(memory.deep_size(obj) > 10000)
+        self.assertTrue(memory.deep_size(obj, skip=[id(data)]) >
+                        sys.getsizeof(obj) + sys.getsizeof([]))
+        # Classes and functions are not descended into.
+        self.assertTrue(memory.deep_size([Slotted, memory.deep_size]) < 1000)
+        memory.deep_size(Lazy())
+
+
+class TestMemoryProfile(TestCase):
+
+    def test_wrap(self):
+        shared = 'y' * 100000
+        sink = Sink(shared)
+        profile = memory.MemoryProfile([shared])
+        pipe = base.CheckRunner([sink])
+        base.wrap_checks(pipe, profile.wrap)
+        pipe.start()
+        for x in xrange(10):
+            pipe.feed(x, None)
+        pipe.finish(None)
+        self.assertEqual(sink.seen, [])
+        stats = profile.sorted_stats()[0]
+        self.assertEqual(stats.kind, 'check')
+        self.assertTrue(10000 < stats.retained < 100000, stats.retained)
+        self.assertTrue(stats.retained_after < 1000)
+        self.assertTrue(profile.peaks['feed'] > 0)
+
+        profile.measure_addons([sink])
+        self.assertEqual(profile.addons.values(), [stats.retained_after])
+
+        data = pickle.loads(pickle.dumps(profile.collect(), 2))
+        self.assertEqual(stats.retained, 0)
+        profile.merge(data)
+        self.assertTrue(profile.sorted_stats()[0].retained > 10000)
+        self.assertTrue(profile.dump()['checks'])
+
+    def test_gc(self):
+        profile = memory.MemoryProfile()
+        enabled = gc.isenabled()
+        threshold = gc.get_threshold()
+        gc.set_threshold(10)
+        profile.start_gc()
+        try:
+            self.assertFalse(gc.isenabled())
+            garbage = []
+            for x in xrange(100):
+                cycle = []
+                cycle.append(cycle)
+                garbage.append(cycle)
+            del garbage, cycle
+            profile.maybe_collect()
+        finally:
+            profile.stop_gc()
+            gc.set_threshold(*threshold)
+        self.assertEqual(gc.isenabled(), enabled)
+        self.assertEqual(sum(profile.gc.collections), 1)
+        self.assertTrue(sum(profile.gc.collected) >= 100)
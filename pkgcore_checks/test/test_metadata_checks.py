@@ -2,16 +2,18 @@
 # License: BSD/GPL2
 
 from functools import partial
+import logging
 import os
 import tempfile
 
 from pkgcore.ebuild import repo_objs
+from pkgcore.package.errors import MetadataException
 from snakeoil import fileutils
 from snakeoil.currying import post_curry
 from snakeoil.osutils import pjoin
 from snakeoil.test.mixins import TempDirMixin
 
-from pkgcore_checks import metadata_checks, addons
+from pkgcore_checks import base, metadata_checks, addons
 from pkgcore_checks.test import misc
 
 
@@ -43,6 +45,42 @@ class TestDescriptionReport(misc.ReportTestCase):
             self.mk_pkg("based on eclass"*50)),
             metadata_checks.CrappyDescription)
 
+    def test_batch(self):
+        check = metadata_checks.DescriptionReport(None, None)
+        reports = []
+        check.feed_batch(
+            [self.mk_pkg(), self.mk_pkg("a decent description"),
+             self.mk_pkg("diffball"), self.mk_pkg()],
+            misc.fake_reporter(reports.append))
+        self.assertEqual(
+            [x.msg for x in reports],
+            ["empty/unset",
+             "using the pkg name as the description isn't very helpful",
+             "empty/unset"])
+
+    def test_batch_broken_version(self):
+        class BrokenPkg(misc.FakePkg):
+            @property
+            def description(self):
+                raise MetadataException(self, 'description', 'broken')
+
+        pkgs = [self.mk_pkg(), BrokenPkg("dev-util/diffball-0.7.2"),
+                self.mk_pkg(), self.mk_pkg()]
+        # the other versions of the batch still get checked.
+        dispatcher = base.Dispatcher(
+            [(metadata_checks.DescriptionReport(None, None), None)],
+            batch_size=4)
+        reports = []
+        reporter = misc.fake_reporter(reports.append)
+        logging.disable(logging.CRITICAL)
+        try:
+            for pkg in pkgs:
+                dispatcher.feed(pkg, reporter)
+            dispatcher.finish(reporter)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(len(reports), 3)
+
 
 class TestKeywordsReport(misc.ReportTestCase):
 
@@ -0,0 +1,86 @@
+# License: BSD/GPL2
+
+import json
+import pickle
+from StringIO import StringIO
+
+from pkgcore.test import TestCase
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore_checks import metrics
+
+
+class TestRegistry(TempDirMixin, TestCase):
+
+    def populate(self, registry):
+        lookups = registry.counter(
+            'lookups_total', 'Cache "lookups".', ('cache', 'result'))
+        lookups.inc(3, ('query', 'hit'))
+        lookups.inc(1, ('query', 'miss'))
+        lookups.inc(labels=('query', 'hit'))
+        registry.gauge('entries', 'Cache size.').set(5)
+        sizes = registry.histogram('sizes', 'Sizes.', (10, 1))
+        for value in (0, 1, 5, 50):
+            sizes.observe(value)
+        return registry
+
+    def test_prometheus(self):
+        registry = self.populate(metrics.Registry())
+        f = StringIO()
+        registry.write_prometheus(f)
+        self.assertEqual(f.getvalue().splitlines(), [
+            '# HELP lookups_total Cache "lookups".',
+            '# TYPE lookups_total counter',
+            'lookups_total{cache="query",result="hit"} 4',
+            'lookups_total{cache="query",result="miss"} 1',
+            '# HELP entries Cache size.',
+            '# TYPE entries gauge',
+            'entries 5',
+            '# HELP sizes Sizes.',
+            '# TYPE sizes histogram',
+            'sizes_bucket{le="1"} 2',
+            'sizes_bucket{le="10"} 3',
+            'sizes_bucket{le="+Inf"} 4',
+            'sizes_sum 56',
+            'sizes_count 4',
+        ])
+        path = pjoin(self.dir, 'metrics.prom')
+        registry.save_prometheus(path)
+        with open(path) as f:
+            self.assertEqual(f.read(), registry_text(registry))
+
+    def test_json(self):
+        dump = json.loads(json.dumps(
+            self.populate(metrics.Registry()).dump()))
+        self.assertEqual(dump['lookups_total']['type'], 'counter')
+        self.assertEqual(dump['lookups_total']['samples'][0], {
+            'labels': {'cache': 'query', 'result': 'hit'}, 'value': 4})
+        self.assertEqual(dump['sizes']['samples'], [{
+            'labels': {}, 'buckets': [['1', 2], ['10', 3], ['+Inf', 4]],
+            'sum': 56, 'count': 4}])
+
+    def test_merge(self):
+        registry = self.populate(metrics.Registry())
+        data = pickle.loads(pickle.dumps(registry.collect(), 2))
+        self.assertEqual(registry.metrics['lookups_total'].values, {})
+        self.populate(registry)
+        registry.metrics['entries'].set(2)
+        registry.merge(data)
+        self.assertEqual(registry.metrics['lookups_total'].values[
+            ('query', 'hit')], 8)
+        # Gauges keep the largest value.
+        self.assertEqual(registry.metrics['entries'].values[()], 5)
+        self.assertEqual(registry.metrics['sizes'].values[()], [4, 2, 2, 112])
+
+    def test_get(self):
+        registry = metrics.Registry()
+        counter = registry.counter('foo', 'Foo.')
+        self.assertIdentical(registry.counter('foo', 'Foo.'), counter)
+        self.assertRaises(ValueError, registry.gauge, 'foo', 'Foo.')
+
+
+def registry_text(registry):
+    f = StringIO()
+    registry.write_prometheus(f)
+    return f.getvalue()
@@ -0,0 +1,82 @@
+# License: BSD/GPL2
+
+import logging
+import time
+
+from pkgcore.test import TestCase
+
+from pkgcore_checks import base, overlap
+
+
+class Sync(base.Template):
+
+    def feed(self, item, reporter):
+        reporter.add_report(('sync', item))
+
+    def finish(self, reporter):
+        reporter.add_report(('sync', 'finish'))
+
+
+def slow_io(item, fail=False):
+    if fail:
+        raise ValueError(item)
+    # Later items finish their I/O first.
+    time.sleep(0.002 * (5 - hash(item) % 5))
+    return [('io', item)]
+
+
+class Deferring(base.Template):
+
+    fail = None
+
+    def feed(self, item, reporter):
+        reporter.add_report(('before', item))
+        base.defer(reporter, slow_io, (item, item == self.fail))
+        reporter.add_report(('after', item))
+
+    def finish(self, reporter):
+        base.defer(reporter, slow_io, ('finish',))
+
+
+class Reporter(object):
+
+    def __init__(self):
+        self.results = []
+
+    def add_report(self, result):
+        self.results.append(result)
+
+
+class TestLoop(TestCase):
+
+    def scan(self, loop, fail=None):
+        deferring = Deferring(None)
+        deferring.fail = fail
+        pipe = base.compile_pipeline(
+            base.CheckRunner([deferring, Sync(None)]))
+        reporter = Reporter()
+        pipe.start()
+        logging.disable(logging.CRITICAL)
+        try:
+            overlap.feed_pipeline(pipe, xrange(10), reporter, loop)
+        finally:
+            logging.disable(logging.NOTSET)
+        return reporter.results
+
+    def test_order(self):
+        serial = self.scan(None)
+        loop = overlap.Loop(3, threads=3)
+        self.assertEqual(self.scan(loop), serial)
+        self.assertEqual(serial[:4], [
+            ('before', 0), ('io', 0), ('after', 0), ('sync', 0)])
+        self.assertEqual(loop.calls, 11)
+        self.assertIn('11 deferred calls', loop.summary())
+        self.assertEqual(loop.collect()[0], 11)
+        self.assertEqual(loop.calls, 0)
+
+    def test_errors(self):
+        # A failing deferred call does not affect the others.
+        results = self.scan(overlap.Loop(2), fail=7)
+        self.assertEqual(results[28:32], [
+            ('before', 7), ('after', 7), ('sync', 7), ('before', 8)])
+        self.assertEqual(results[-2:], [('io', 'finish'), ('sync', 'finish')])
@@ -0,0 +1,61 @@
+# License: BSD/GPL2
+
+from pkgcore.test import TestCase
+
+from pkgcore_checks import base, parallel
+
+
+class DummyAddon(base.Template):
+
+    feed_type = base.versioned_feed
+
+
+class VersionCheck(base.Template):
+
+    feed_type = base.versioned_feed
+    required_addons = (DummyAddon,)
+
+
+class RepoCheck(base.Template):
+
+    feed_type = base.versioned_feed
+    scope = base.repository_scope
+    required_addons = (DummyAddon,)
+
+
+class OtherRepoCheck(base.Template):
+
+    feed_type = base.versioned_feed
+    scope = base.repository_scope
+
+
+class TestSplitSinks(TestCase):
+
+    def test_split(self):
+        addon = DummyAddon(None)
+        version = VersionCheck(None)
+        repo = RepoCheck(None)
+        other = OtherRepoCheck(None)
+        sharded, serial = parallel.split_sinks([addon, version, repo, other])
+        self.assertEqual(set(sharded), set([addon, version]))
+        self.assertEqual(set(serial), set([addon, repo, other]))
+
+    def test_no_repo_sinks(self):
+        version = VersionCheck(None)
+        sharded, serial = parallel.split_sinks([version])
+        self.assertEqual(sharded, [version])
+        self.assertEqual(serial, [])
+
+
+class TestShardCategories(TestCase):
+
+    def test_shard(self):
+        cats = ['a', 'b', 'c', 'd', 'e']
+        self.assertEqual(
+            parallel.shard_categories(cats, 2),
+            [('a', 'b', 'c'), ('d', 'e')])
+        self.assertEqual(
+            parallel.shard_categories(cats, 10),
+            [('a',), ('b',), ('c',), ('d',), ('e',)])
+        self.assertEqual(parallel.shard_categories(cats, 1), [tuple(cats)])
+        self.assertEqual(parallel.shard_categories([], 4), [])
@@ -1,10 +1,14 @@
 # Copyright: 2006 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+from StringIO import StringIO
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.restrictions import packages
 from pkgcore.test import TestCase
 from pkgcore.test.scripts import helpers
 
-from pkgcore_checks import pcheck
+from pkgcore_checks import feeds, pcheck, repo_metadata, whitespace
 
 
 class CommandlineTest(TestCase, helpers.MainMixin):
@@ -21,3 +25,58 @@ class CommandlineTest(TestCase, helpers.MainMixin):
             '-r', 'spork')
         options = self.parse('spork', '--list-checks')
         self.assertTrue(options.list_checks)
+        self.assertError(
+            '--daemon and --connect are mutually exclusive',
+            '--daemon', 'sock', '--connect', 'sock')
+        self.assertError(
+            '--since and --connect are mutually exclusive',
+            '--since', 'HEAD', '--connect', 'sock')
+
+    def test_read_targets(self):
+        self.assertEqual(
+            pcheck.read_targets(StringIO(
+                '# stable request\ndev-util/foo  =app-misc/bar-1 # c\n\n'
+                '  sys-apps/*\n')),
+            ['dev-util/foo', '=app-misc/bar-1', 'sys-apps/*'])
+
+    def test_ebuild_limiter(self):
+        limiter = pcheck.ebuild_limiter(
+            '/repo/', '/repo/dev-util/foo/foo-1.2-r1.ebuild')
+        self.assertEqual(limiter, atom('=dev-util/foo-1.2-r1'))
+        for path in ('/other/dev-util/foo/foo-1.ebuild',
+                     '/repo/dev-util/foo/bar-1.ebuild',
+                     '/repo/dev-util/foo/foo.ebuild',
+                     '/repo/dev-util/foo/files/foo-1.ebuild'):
+            self.assertIdentical(pcheck.ebuild_limiter('/repo', path), None)
+
+    def test_lazy_addon_options(self):
+        parser = pcheck.OptionParser()
+        # Only added once needed.
+        self.assertFalse(parser.has_option('--reset-caching-per'))
+        self.assertEqual(
+            parser._match_long_opt('--reset-c'), '--reset-caching-per')
+        self.assertFalse(parser.has_option('--arches'))
+        parser.format_option_help()
+        self.assertTrue(parser.has_option('--arches'))
+
+    def test_out_of_scope_checks(self):
+        options = self.parser.get_default_values()
+        options.target_repo = None
+        transforms = [
+            feeds.VersionToEbuild, feeds.VersionToPackage,
+            feeds.VersionToCategory, feeds.PackageToRepo]
+        checks = [whitespace.WhitespaceCheck, repo_metadata.UnusedLicense]
+        package = atom('dev-util/foo')
+        self.assertEqual(pcheck.out_of_scope_checks(
+            options, transforms, [(checks, [package])]),
+            set([repo_metadata.UnusedLicense]))
+        self.assertEqual(pcheck.out_of_scope_checks(
+            options, transforms, [(checks, [package]),
+                                  (checks, [packages.AlwaysTrue])]), set())
+        # Nothing to scan, nothing to leave out.
+        self.assertEqual(pcheck.out_of_scope_checks(
+            options, transforms, [(checks, [])]), set())
+        # WhitespaceCheck lacks a transform, scan reports that.
+        self.assertEqual(pcheck.out_of_scope_checks(
+            options, [], [(checks, [package])]),
+            set([repo_metadata.UnusedLicense]))
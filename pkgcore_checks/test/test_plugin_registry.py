@@ -0,0 +1,56 @@
+# License: BSD/GPL2
+
+import json
+import os
+
+from pkgcore.test import TestCase
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore_checks import base, plugin_registry
+
+
+class TestPluginRegistry(TempDirMixin, TestCase):
+
+    def test_build(self):
+        data = plugin_registry.build()
+        self.assertIn('pkgcore_checks.whitespace.WhitespaceCheck',
+                      data['checks'])
+        self.assertEqual(
+            data['addons']['pkgcore_checks.visibility.VisibilityReport'], [
+                'pkgcore_checks.addons.ArchesAddon',
+                'pkgcore_checks.addons.EvaluateDepSetAddon',
+                'pkgcore_checks.addons.ProfileAddon',
+                'pkgcore_checks.addons.QueryCacheAddon'])
+        self.assertEqual(data['options']['-a'],
+                         ['pkgcore_checks.addons.ArchesAddon'])
+        self.assertTrue(plugin_registry.fresh(data))
+
+    def test_load(self):
+        path = pjoin(self.dir, 'cache', 'plugins.json')
+        registry = plugin_registry.load(path)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(plugin_registry.load(path).data, registry.data)
+
+        # Stale entries get it rebuilt.
+        with open(path) as f:
+            data = json.load(f)
+        stale = dict(data)
+        stale['files'] = dict(data['files'])
+        stale['files'][sorted(data['files'])[0]] = [0, 0]
+        self.assertFalse(plugin_registry.fresh(stale))
+        with open(path, 'w') as f:
+            json.dump(stale, f)
+        self.assertEqual(plugin_registry.load(path).data, registry.data)
+        with open(path) as f:
+            self.assertEqual(json.load(f), data)
+
+    def test_entries(self):
+        registry = plugin_registry.PluginRegistry(plugin_registry.build())
+        entries = registry.checks()
+        selected = base.Whitelist(['WhitespaceCheck']).filter(entries)
+        self.assertEqual(len(selected), 1)
+        self.assertEqual(selected[0].load().__name__, 'WhitespaceCheck')
+        self.assertEqual(registry.option_addons('--reset'),
+                         ['pkgcore_checks.addons.QueryCacheAddon'])
+        self.assertEqual(registry.option_addons('--no-such-option'), [])
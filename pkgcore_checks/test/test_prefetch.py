@@ -0,0 +1,52 @@
+# License: BSD/GPL2
+
+from pkgcore.test import TestCase
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore_checks import prefetch
+
+
+class FakePkg(object):
+
+    def __init__(self, path, broken=False):
+        self.path = path
+        self.broken = broken
+        self.loads = 0
+
+    @property
+    def data(self):
+        self.loads += 1
+        if self.broken:
+            raise ValueError(self.path)
+        return {}
+
+
+class TestPrefetcher(TempDirMixin, TestCase):
+
+    def test_iter(self):
+        pkgs = list(FakePkg(pjoin(self.dir, 'foo-%i.ebuild' % (x,)))
+                    for x in xrange(10))
+        pkgs.append(FakePkg(pjoin(self.dir, 'missing.ebuild'), broken=True))
+        for pkg in pkgs[:-1]:
+            with open(pkg.path, 'w') as f:
+                f.write('EAPI=5\n')
+        prefetcher = prefetch.Prefetcher(3, threads=2)
+        self.assertEqual(list(prefetcher.iter(iter(pkgs))), pkgs)
+        # Every package was warmed before being handed on.
+        self.assertEqual(list(pkg.loads for pkg in pkgs), [1] * len(pkgs))
+        self.assertEqual(prefetcher.hits + prefetcher.misses, len(pkgs))
+        self.assertIn('queue depth 3', prefetcher.summary())
+
+        counts = prefetcher.collect()
+        self.assertEqual((prefetcher.hits, prefetcher.misses), (0, 0))
+        prefetcher.merge(counts)
+        self.assertEqual(prefetcher.hits + prefetcher.misses, len(pkgs))
+
+    def test_early_exit(self):
+        pkgs = list(FakePkg(pjoin(self.dir, 'foo-%i.ebuild' % (x,)))
+                    for x in xrange(10))
+        it = prefetch.Prefetcher(2).iter(iter(pkgs))
+        self.assertIdentical(it.next(), pkgs[0])
+        it.close()
+        self.assertEqual(list(prefetch.Prefetcher(2).iter(iter([]))), [])
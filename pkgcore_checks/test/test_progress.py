@@ -0,0 +1,177 @@
+# License: BSD/GPL2
+
+import json
+from StringIO import StringIO
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.restrictions import packages, values
+from pkgcore.test import TestCase
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore_checks import progress
+
+
+class FakeRepo(object):
+
+    def __init__(self, pkgs):
+        self.packages = {}
+        for key in pkgs:
+            category, package = key.split('/')
+            self.packages.setdefault(category, []).append(package)
+        self.categories = sorted(self.packages)
+
+
+class FakePkg(object):
+
+    def __init__(self, key):
+        self.category, self.package = key.split('/')
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class Tty(StringIO):
+
+    def isatty(self):
+        return True
+
+
+class Reporter(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def add_report(self, result):
+        self.stream.write(result + '\n')
+
+    def finish(self):
+        self.stream.write('done\n')
+
+
+class TestCountPackages(TestCase):
+
+    def test_count(self):
+        repo = FakeRepo(['dev-util/foo', 'dev-util/bar', 'dev-lang/foo',
+                         'app-misc/baz'])
+
+        def category(name):
+            return packages.PackageRestriction(
+                'category', values.StrExactMatch(name))
+
+        def package(name):
+            return packages.PackageRestriction(
+                'package', values.StrExactMatch(name))
+
+        count = progress.count_packages
+        self.assertEqual(count(repo, packages.AlwaysTrue), 4)
+        self.assertEqual(count(repo, atom('>=dev-util/foo-1')), 1)
+        self.assertEqual(count(repo, atom('dev-util/missing')), 0)
+        self.assertEqual(count(repo, category('dev-util')), 2)
+        self.assertEqual(count(repo, package('foo')), 2)
+        self.assertEqual(count(repo, packages.AndRestriction(
+            packages.PackageRestriction(
+                'category', values.StrGlobMatch('dev-')),
+            package('foo'))), 2)
+        # Overlapping targets are counted once.
+        self.assertEqual(count(repo, packages.OrRestriction(
+            category('dev-util'), package('foo'))), 3)
+        self.assertIdentical(count(repo, packages.OrRestriction(
+            category('dev-util'),
+            packages.AndRestriction(package('foo'), negate=True))), None)
+
+
+class TestProgress(TempDirMixin, TestCase):
+
+    def feed(self, scan, clock, keys):
+        for pkg in scan.iter(FakePkg(key) for key in keys):
+            clock.now += 1
+
+    def test_stream(self):
+        clock = Clock()
+        stream = StringIO()
+        scan = progress.Progress(stream, interval=2, clock=clock)
+        scan.expect(FakeRepo(['a/a', 'a/b', 'b/a', 'b/b']), packages.AlwaysTrue)
+        self.feed(scan, clock, ['a/a', 'a/a', 'a/b', 'b/a'])
+        scan.finish()
+        lines = stream.getvalue().splitlines()
+        # Once on the first package, then no more than every 2 seconds.
+        self.assertEqual(lines, [
+            'progress: 1/4 packages (25%), 1 versions, a',
+            'progress: 2/4 packages (50%), 3 versions, a, 1.0 packages/s, '
+            'ETA 2s',
+            'progress: 3/4 packages (75%), 4 versions, b, 0.8 packages/s, '
+            'ETA 1s',
+        ])
+
+    def test_eta(self):
+        clock = Clock()
+        scan = progress.Progress(clock=clock)
+        scan.expect(FakeRepo(['a/%i' % (x,) for x in xrange(1000)]),
+                    packages.AlwaysTrue)
+        self.feed(scan, clock, ['a/%i' % (x,) for x in xrange(100)])
+        status = scan.status()
+        self.assertEqual(status['rate'], 1.0)
+        self.assertEqual(status['eta'], 900)
+        self.assertIn('ETA 15m00s', scan.format(status))
+        self.assertEqual(progress.format_duration(3723), '1h02m03s')
+
+        scan.expect(None, packages.OrRestriction(
+            packages.AlwaysTrue, negate=True))
+        self.assertIdentical(scan.status()['total'], None)
+        self.assertIdentical(scan.status()['eta'], None)
+        self.assertTrue(scan.format(scan.status()).startswith(
+            'progress: 100 packages, 100 versions'))
+
+    def test_file(self):
+        clock = Clock()
+        path = pjoin(self.dir, 'status.json')
+        scan = progress.Progress(path=path, clock=clock)
+        scan.expect(FakeRepo(['a/a', 'a/b']), packages.AlwaysTrue)
+        self.feed(scan, clock, ['a/a'])
+        with open(path) as f:
+            self.assertEqual(json.load(f)['done'], False)
+        self.feed(scan, clock, ['a/b'])
+        scan.finish()
+        with open(path) as f:
+            status = json.load(f)
+        self.assertEqual(status['done'], True)
+        self.assertEqual((status['packages'], status['total']), (2, 2))
+
+    def test_workers(self):
+        clock = Clock()
+        stream = StringIO()
+        scan = progress.Progress(stream, clock=clock)
+        # Counting alone writes nothing.
+        self.assertEqual(
+            len(list(scan.count(FakePkg(key) for key in ['a/a', 'a/b']))), 2)
+        self.assertEqual(stream.getvalue(), '')
+        counts = scan.collect()
+        self.assertEqual(counts, (2, 2, 'a'))
+        self.assertEqual((scan.packages, scan.versions), (0, 0))
+        scan.merge(counts)
+        self.assertEqual((scan.packages, scan.versions), (2, 2))
+        self.assertIn('2 packages', stream.getvalue())
+
+    def test_tty(self):
+        clock = Clock()
+        stream = Tty()
+        scan = progress.Progress(stream, clock=clock)
+        self.assertTrue(scan.tty)
+        reporter = progress.ClearingReporter(Reporter(stream), scan)
+        self.feed(scan, clock, ['a/a'])
+        reporter.add_report('result')
+        reporter.add_report('another')
+        scan.finish()
+        reporter.finish()
+        self.assertEqual(stream.getvalue(), (
+            '\r\x1b[Kprogress: 1 packages, 1 versions, a'
+            '\r\x1b[Kresult\nanother\n'
+            '\r\x1b[Kprogress: 1 packages, 1 versions, a\n'
+            'done\n'))
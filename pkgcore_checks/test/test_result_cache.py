@@ -0,0 +1,295 @@
+# License: BSD/GPL2
+
+import os
+import shutil
+import tempfile
+
+from pkgcore.test import TestCase
+from snakeoil.osutils import pjoin
+
+from pkgcore_checks import addons, base, deprecated, feeds, result_cache
+
+
+class Eclass(object):
+
+    def __init__(self, path):
+        self.path = path
+
+
+class FakeRepo(object):
+
+    def __init__(self, eclasses):
+        self.eclass_cache = self
+        self.eclasses = eclasses
+
+
+class FakePkg(object):
+
+    def __init__(self, repo, path, version, inherited=()):
+        self.repo = repo
+        self.path = path
+        self.category = 'dev-util'
+        self.package = 'foo'
+        self.fullver = version
+        self.cpvstr = 'dev-util/foo-%s' % (version,)
+        self.inherited = inherited
+
+
+class Result(base.Result):
+
+    __attrs__ = ('cpvstr',)
+
+    def __init__(self, pkg):
+        base.Result.__init__(self)
+        self.cpvstr = pkg.cpvstr
+
+    def __eq__(self, other):
+        return self.cpvstr == other.cpvstr
+
+
+class Check(base.Template):
+
+    feed_type = base.versioned_feed
+    result_cache_version = 1
+
+    def __init__(self):
+        base.Template.__init__(self, None)
+        self.seen = []
+
+    def feed(self, pkg, reporter):
+        self.seen.append(pkg.cpvstr)
+        reporter.add_report(Result(pkg))
+
+
+class PkgDirCheck(Check):
+
+    feed_type = base.pkgdir_feed
+
+    def feed(self, item, reporter):
+        Check.feed(self, item[0][0], reporter)
+
+
+class VersionResult(Result):
+
+    __attrs__ = ('cpvstr', 'category', 'package', 'version')
+
+    def __init__(self, pkg):
+        Result.__init__(self, pkg)
+        self._store_cpv(pkg)
+
+
+class BatchCheck(Check):
+
+    result = VersionResult
+
+    def feed_batch(self, pkgs, reporter):
+        self.seen.append(list(x.cpvstr for x in pkgs))
+        for pkg in pkgs:
+            if pkg.fullver != '2':
+                reporter.add_report(self.result(pkg))
+
+
+class Reporter(object):
+
+    def __init__(self):
+        self.results = []
+
+    def add_report(self, result):
+        self.results.append(result)
+
+
+class Options(object):
+
+    repo_bases = ()
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.repo_dir = pjoin(self.dir, 'repo')
+        self.pkg_dir = pjoin(self.repo_dir, 'dev-util', 'foo')
+        os.makedirs(self.pkg_dir)
+        os.makedirs(pjoin(self.repo_dir, 'eclass'))
+        self.write('dev-util/foo/foo-1.ebuild', 'inherit bar\n')
+        self.write('eclass/bar.eclass', '# bar\n')
+        self.repo = FakeRepo(
+            {'bar': Eclass(pjoin(self.repo_dir, 'eclass', 'bar.eclass'))})
+        self.pkg = FakePkg(
+            self.repo, pjoin(self.pkg_dir, 'foo-1.ebuild'), '1', ('bar',))
+        self.location = pjoin(self.dir, 'cache', 'repo')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data):
+        with open(pjoin(self.repo_dir, path), 'w') as f:
+            f.write(data)
+
+    def scan(self, pkgs, read=True, max_size=1024 * 1024):
+        cache = result_cache.ResultCache(
+            self.location, max_size, Options(), read=read)
+        check = Check()
+        wrapped = cache.wrap(check)
+        self.assertIsInstance(wrapped, result_cache.CachedCheck)
+        reporter = Reporter()
+        for pkg in pkgs:
+            wrapped.feed(pkg, reporter)
+        wrapped.finish(reporter)
+        return cache, check, reporter
+
+    def test_hash_path(self):
+        digest = result_cache.hash_path(self.pkg_dir)
+        self.assertEqual(digest, result_cache.hash_path(self.pkg_dir))
+        os.chmod(self.pkg.path, 0755)
+        self.assertNotEqual(digest, result_cache.hash_path(self.pkg_dir))
+        self.assertEqual(
+            result_cache.hash_path(pjoin(self.dir, 'missing')),
+            result_cache.hash_path(pjoin(self.dir, 'also-missing')))
+
+    def test_replay(self):
+        cache, check, reporter = self.scan([self.pkg])
+        self.assertEqual(check.seen, ['dev-util/foo-1'])
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        cache, check, reporter = self.scan([self.pkg])
+        self.assertEqual(check.seen, [])
+        self.assertEqual(reporter.results, [Result(self.pkg)])
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+        cache, check, reporter = self.scan([self.pkg], read=False)
+        self.assertEqual(check.seen, ['dev-util/foo-1'])
+
+    def test_invalidation(self):
+        self.scan([self.pkg])
+        self.write('eclass/bar.eclass', '# changed\n')
+        cache, check, reporter = self.scan([self.pkg])
+        self.assertEqual(check.seen, ['dev-util/foo-1'])
+        self.write('dev-util/foo/metadata.xml', '<pkgmetadata/>\n')
+        cache, check, reporter = self.scan([self.pkg])
+        self.assertEqual(check.seen, ['dev-util/foo-1'])
+        cache, check, reporter = self.scan([self.pkg])
+        self.assertEqual(check.seen, [])
+
+    def test_pkgdir(self):
+        def scan():
+            cache = result_cache.ResultCache(
+                self.location, 1024 * 1024, Options())
+            check = PkgDirCheck()
+            wrapped = cache.wrap(check)
+            item = ((self.pkg,), feeds.DirSnapshot(self.pkg_dir, True))
+            wrapped.feed(item, Reporter())
+            wrapped.finish(Reporter())
+            return check.seen
+
+        self.assertEqual(scan(), ['dev-util/foo-1'])
+        self.assertEqual(scan(), [])
+        self.write('dev-util/foo/foo-1.ebuild', 'inherit baz\n')
+        self.assertEqual(scan(), ['dev-util/foo-1'])
+        os.mkdir(pjoin(self.pkg_dir, 'files'))
+        self.write('dev-util/foo/files/foo.patch', '--- a\n')
+        self.assertEqual(scan(), ['dev-util/foo-1'])
+        self.assertEqual(scan(), [])
+        os.chmod(pjoin(self.pkg_dir, 'files', 'foo.patch'), 0755)
+        self.assertEqual(scan(), ['dev-util/foo-1'])
+
+    def test_fingerprint(self):
+        options = Options()
+        options.repo_bases = (self.repo_dir,)
+        os.mkdir(pjoin(self.repo_dir, 'metadata'))
+        self.write('metadata/layout.conf', 'masters =\n')
+
+        def fingerprint():
+            cache = result_cache.ResultCache(self.location, 0, options)
+            return cache.fingerprint(deprecated.DeprecatedEAPIReport)
+
+        digest = fingerprint()
+        self.assertEqual(digest, fingerprint())
+        self.write('metadata/layout.conf', 'masters =\neapis-deprecated = 4\n')
+        self.assertNotEqual(digest, fingerprint())
+
+    def test_fingerprint_options(self):
+        class LicenseCheck(Check):
+            required_addons = (addons.LicenseAddon,)
+
+        options = Options()
+        options.license_dirs = [pjoin(self.dir, 'licenses')]
+        os.mkdir(options.license_dirs[0])
+
+        def fingerprint():
+            cache = result_cache.ResultCache(self.location, 0, options)
+            return cache.fingerprint(LicenseCheck)
+
+        digest = fingerprint()
+        with open(pjoin(options.license_dirs[0], 'GPL-2'), 'w') as f:
+            f.write('GPL\n')
+        self.assertNotEqual(digest, fingerprint())
+
+    def test_evict_empty(self):
+        cache = result_cache.ResultCache(self.location, 0, Options())
+        cache.flush()
+        cache.evict()
+        self.assertFalse(os.path.exists(pjoin(self.dir, 'cache')))
+
+    def test_batch_order(self):
+        pkgs = list(FakePkg(self.repo, self.pkg.path, str(x)) for x in (1, 3))
+        self.batch_scan(pkgs[1:])
+        cache, check, reporter = self.batch_scan(pkgs)
+        self.assertEqual(check.seen, [['dev-util/foo-1']])
+        # Cached results are reported in the position of their version.
+        self.assertEqual(reporter.results, [Result(x) for x in pkgs])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_uncacheable(self):
+        cache = result_cache.ResultCache(self.location, 0, Options())
+        check = Check()
+        check.result_cache_version = None
+        self.assertIdentical(cache.wrap(check), check)
+        transform = base.Transform(None)
+        self.assertIdentical(cache.wrap(transform), transform)
+        # Broken packages are fed to the check as usual.
+        self.pkg.inherited = ('missing',)
+        cache, check, reporter = self.scan([self.pkg])
+        self.assertEqual(check.seen, ['dev-util/foo-1'])
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def batch_scan(self, pkgs, result=VersionResult):
+        cache = result_cache.ResultCache(self.location, 1024 * 1024, Options())
+        check = BatchCheck()
+        check.result = result
+        pipe = base.compile_pipeline(
+            base.CheckRunner([cache.wrap(check)]), batch_size=10)
+        reporter = Reporter()
+        for pkg in pkgs:
+            pipe.feed(pkg, reporter)
+        pipe.finish(reporter)
+        return cache, check, reporter
+
+    def test_batch(self):
+        pkgs = list(FakePkg(self.repo, self.pkg.path, str(x)) for x in (1, 2))
+        cache, check, reporter = self.batch_scan(pkgs)
+        self.assertEqual(check.seen, [['dev-util/foo-1', 'dev-util/foo-2']])
+        self.assertEqual(reporter.results, [Result(pkgs[0])])
+        cache, check, reporter = self.batch_scan(pkgs)
+        self.assertEqual(check.seen, [])
+        self.assertEqual(reporter.results, [Result(pkgs[0])])
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+    def test_batch_unattributed(self):
+        # Results not telling which version they are about are not stored.
+        pkgs = [self.pkg]
+        cache, check, reporter = self.batch_scan(pkgs, result=Result)
+        self.assertEqual(reporter.results, [Result(self.pkg)])
+        cache, check, reporter = self.batch_scan(pkgs, result=Result)
+        self.assertEqual(check.seen, [['dev-util/foo-1']])
+
+    def test_evict(self):
+        self.scan([self.pkg])
+        bucket = pjoin(self.location, 'dev-util', 'foo')
+        self.assertTrue(os.path.isfile(bucket))
+        cache, check, reporter = self.scan([self.pkg])
+        cache.evict()
+        self.assertTrue(os.path.isfile(bucket))
+        cache.max_size = 0
+        cache.evict()
+        self.assertFalse(os.path.exists(bucket))
@@ -0,0 +1,89 @@
+# License: BSD/GPL2
+
+import pickle
+
+from pkgcore.test import TestCase
+
+from pkgcore_checks import base, timing
+
+
+class Sink(base.Template):
+
+    feed_type = base.package_feed
+
+    def __init__(self):
+        base.Template.__init__(self, None)
+        self.seen = []
+
+    def feed(self, item, reporter):
+        self.seen.append(item)
+
+
+class Double(base.Transform):
+
+    source = base.versioned_feed
+    dest = base.package_feed
+    scope = base.version_scope
+    cost = 1
+
+    def feed(self, item, reporter):
+        self.child.feed(item, reporter)
+        self.child.feed(item, reporter)
+
+
+class TestTimings(TestCase):
+
+    def test_wrap(self):
+        sink = Sink()
+        pipe = base.CheckRunner([Double(base.CheckRunner([sink]))])
+        timings = timing.Timings()
+        base.wrap_checks(pipe, timings.wrap)
+        self.assertEqual(base.collect_checks(pipe), set([sink]))
+        pipe.start()
+        for x in xrange(3):
+            pipe.feed(x, None)
+        pipe.finish(None)
+        self.assertEqual(sink.seen, [0, 0, 1, 1, 2, 2])
+
+        stats = dict((x.name.rsplit('.', 1)[-1], x)
+                     for x in timings.sorted_stats())
+        self.assertEqual(sorted(stats), ['Double', 'Sink'])
+        self.assertEqual(stats['Double'].kind, 'transform')
+        self.assertEqual(stats['Sink'].kind, 'check')
+        self.assertEqual(stats['Double'].feed.calls, 3)
+        self.assertEqual(stats['Sink'].feed.calls, 6)
+        self.assertEqual(stats['Sink'].start.calls, 1)
+        self.assertEqual(stats['Sink'].finish.calls, 1)
+        self.assertEqual(timings._nested, [])
+        summary = stats['Sink'].feed.summary()
+        self.assertEqual(summary['calls'], 6)
+        self.assertTrue(summary['max'] >= summary['p95'] >= 0)
+
+    def test_batch(self):
+        class BatchSink(Sink):
+            def feed_batch(self, items, reporter):
+                self.seen.extend(items)
+        sink = BatchSink()
+        timings = timing.Timings()
+        pipe = base.CheckRunner([sink])
+        base.wrap_checks(pipe, timings.wrap)
+        pipe = base.compile_pipeline(pipe, batch_size=2)
+        for x in xrange(3):
+            pipe.feed(x, None)
+        pipe.finish(None)
+        self.assertEqual(sink.seen, [0, 1, 2])
+        stats = timings.sorted_stats()[0]
+        # Counted per item, not per call.
+        self.assertEqual(stats.feed.calls, 3)
+
+    def test_collect_merge(self):
+        sink = Sink()
+        timings = timing.Timings()
+        wrapped = timings.wrap(sink)
+        wrapped.feed(1, None)
+        data = pickle.loads(pickle.dumps(timings.collect(), 2))
+        name = '%s.%s' % (Sink.__module__, 'Sink')
+        self.assertEqual(timings.stats[name].feed.calls, 0)
+        wrapped.feed(2, None)
+        timings.merge(data)
+        self.assertEqual(timings.stats[name].feed.calls, 2)
@@ -0,0 +1,96 @@
+# License: BSD/GPL2
+
+import os
+import subprocess
+
+from pkgcore.test import SkipTest, TestCase
+from snakeoil.osutils import pjoin, ensure_dirs
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore_checks import errors, vcs
+
+
+class TestChanges(TestCase):
+
+    arch_dirs = {
+        'x86': set(['profiles', 'profiles/default']),
+        'amd64': set(['profiles', 'profiles/default',
+                      'profiles/default/amd64']),
+    }
+
+    def changes(self, *paths):
+        return vcs.Changes.from_paths(
+            paths, frozenset(['dev-util', 'app-misc']), self.arch_dirs)
+
+    def test_packages(self):
+        changes = self.changes(
+            'dev-util/foo/foo-1.ebuild', 'dev-util/foo/files/x.patch',
+            'app-misc/bar/metadata.xml', 'app-misc/metadata.xml')
+        self.assertEqual(changes.packages,
+                         set([('dev-util', 'foo'), ('app-misc', 'bar')]))
+        self.assertEqual(changes.categories, set(['app-misc']))
+        self.assertFalse(changes.eclasses or changes.arches)
+
+    def test_eclasses(self):
+        changes = self.changes('eclass/foo.eclass', 'eclass/README')
+        self.assertEqual(changes.eclasses, set(['foo']))
+        self.assertFalse(changes.packages)
+
+    def test_profiles(self):
+        self.assertEqual(
+            self.changes('profiles/default/amd64/package.mask').arches,
+            set(['amd64']))
+        self.assertEqual(
+            self.changes('profiles/default/package.use.mask').arches,
+            set(['amd64', 'x86']))
+        self.assertEqual(
+            self.changes('profiles/package.mask').arches,
+            set(['amd64', 'x86']))
+        self.assertEqual(
+            self.changes('profiles/default/amd64/package.use.mask/foo',
+                         'profiles/default/amd64/package.use.mask/x/bar').arches,
+            set(['amd64']))
+        self.assertEqual(
+            self.changes('profiles/default/package.mask/bar').arches,
+            set(['amd64', 'x86']))
+        self.assertFalse(self.changes('profiles/updates/1Q-2014'))
+
+    def test_ignored(self):
+        self.assertFalse(self.changes(
+            'metadata/layout.conf', 'licenses/GPL-2', 'sys-apps/foo/foo-1.ebuild'))
+
+
+class TestChangedPaths(TempDirMixin, TestCase):
+
+    def git(self, *args):
+        with open(os.devnull, 'w') as null:
+            subprocess.check_call(
+                ('git', '-c', 'user.name=test', '-c', 'user.email=test@test')
+                + args, cwd=self.dir, stdout=null, stderr=null)
+
+    def write(self, path, data='data\n'):
+        ensure_dirs(os.path.dirname(pjoin(self.dir, path)))
+        with open(pjoin(self.dir, path), 'w') as f:
+            f.write(data)
+
+    def test_it(self):
+        try:
+            self.git('init', '-q')
+        except EnvironmentError:
+            raise SkipTest('git not available')
+        self.write('repo/dev-util/foo/foo-1.ebuild')
+        self.write('repo/dev-util/bar/bar-1.ebuild')
+        self.write('other/file')
+        self.git('add', '.')
+        self.git('commit', '-q', '-m', 'init')
+        repo = pjoin(self.dir, 'repo')
+        self.assertEqual(vcs.changed_paths(repo, 'HEAD'), [])
+
+        self.write('repo/dev-util/foo/foo-1.ebuild', 'changed\n')
+        self.write('repo/dev-util/baz/baz-1.ebuild')
+        os.unlink(pjoin(repo, 'dev-util/bar/bar-1.ebuild'))
+        self.write('other/file', 'changed\n')
+        self.assertEqual(vcs.changed_paths(repo, 'HEAD'), [
+            'dev-util/bar/bar-1.ebuild', 'dev-util/baz/baz-1.ebuild',
+            'dev-util/foo/foo-1.ebuild'])
+        self.assertRaises(errors.VCSError, vcs.changed_paths, repo, 'nope')
@@ -0,0 +1,219 @@
+# License: BSD/GPL2
+
+"""Per check and per transform timing instrumentation.
+
+Checks and transforms of a planned pipeline get wrapped (see
+L{pkgcore_checks.base.wrap_checks}) with a L{TimedCheck} recording wall
+clock and cpu time of their start, feed and finish calls.  Times are
+exclusive: a transform is not charged for the time spent in the checks
+it feeds.
+"""
+
+from array import array
+import time
+
+from pkgcore_checks import base
+
+phases = ('start', 'feed', 'finish')
+
+
+class PhaseStats(object):
+
+    """Timing data for one phase (start, feed or finish) of one check."""
+
+    __slots__ = ('wall', 'cpu', 'samples')
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        # wall clock time of each call; kept for the percentiles.
+        self.samples = array('d')
+
+    def add(self, wall, cpu, items=1):
+        self.wall += wall
+        self.cpu += cpu
+        if items == 1:
+            self.samples.append(wall)
+        else:
+            # A batch of items; charge each the average.
+            self.samples.extend([wall / items] * items)
+
+    def merge(self, other):
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.samples.extend(other.samples)
+
+    @property
+    def calls(self):
+        return len(self.samples)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        calls = len(samples)
+        if not calls:
+            return dict(calls=0, wall=0.0, cpu=0.0, mean=0.0, p95=0.0, max=0.0)
+        return dict(
+            calls=calls, wall=self.wall, cpu=self.cpu,
+            mean=self.wall / calls,
+            p95=samples[min(calls - 1, int(calls * 0.95))],
+            max=samples[-1])
+
+    def __getstate__(self):
+        return (self.wall, self.cpu, self.samples.tostring())
+
+    def __setstate__(self, state):
+        self.wall, self.cpu, samples = state
+        self.samples = array('d')
+        self.samples.fromstring(samples)
+
+
+class CheckStats(object):
+
+    """Timing data for all phases of one check or transform class."""
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        for phase in phases:
+            setattr(self, phase, PhaseStats())
+
+    @property
+    def wall(self):
+        return sum(getattr(self, phase).wall for phase in phases)
+
+    @property
+    def cpu(self):
+        return sum(getattr(self, phase).cpu for phase in phases)
+
+    def merge(self, other):
+        for phase in phases:
+            getattr(self, phase).merge(getattr(other, phase))
+
+    def detach(self):
+        """Return a copy holding the data gathered so far, and reset."""
+        other = CheckStats(self.name, self.kind)
+        for phase in phases:
+            setattr(other, phase, getattr(self, phase))
+            setattr(self, phase, PhaseStats())
+        return other
+
+
+class TimedCheck(base.CheckWrapper):
+
+    """Wraps a check or transform, charging its calls to a L{Timings}."""
+
+    def __init__(self, wrapped, timings):
+        base.CheckWrapper.__init__(self, wrapped)
+        self._timings = timings
+        self._stats = timings.get_stats(wrapped)
+
+    def start(self):
+        token = self._timings.enter()
+        try:
+            self.wrapped.start()
+        finally:
+            self._timings.leave(token, self._stats.start)
+
+    def feed(self, item, reporter):
+        token = self._timings.enter()
+        try:
+            self.wrapped.feed(item, reporter)
+        finally:
+            self._timings.leave(token, self._stats.feed)
+
+    def feed_batch(self, items, reporter):
+        token = self._timings.enter()
+        try:
+            self.wrapped.feed_batch(items, reporter)
+        finally:
+            self._timings.leave(token, self._stats.feed, len(items))
+
+    def finish(self, reporter):
+        token = self._timings.enter()
+        try:
+            self.wrapped.finish(reporter)
+        finally:
+            self._timings.leave(token, self._stats.finish)
+
+
+class Timings(object):
+
+    """Collects L{CheckStats} for every wrapped check and transform."""
+
+    def __init__(self):
+        self.stats = {}
+        # per active call, the wall/cpu time spent in nested wrapped calls.
+        self._nested = []
+
+    def get_stats(self, obj):
+        # Charge other instrumentation (result caching) to the real check.
+        while isinstance(obj, base.CheckWrapper):
+            obj = obj.wrapped
+        name = '%s.%s' % (obj.__class__.__module__, obj.__class__.__name__)
+        stats = self.stats.get(name)
+        if stats is None:
+            if isinstance(obj, base.Transform):
+                kind = 'transform'
+            else:
+                kind = 'check'
+            stats = self.stats[name] = CheckStats(name, kind)
+        return stats
+
+    def wrap(self, obj):
+        return TimedCheck(obj, self)
+
+    def enter(self):
+        self._nested.append([0.0, 0.0])
+        return time.time(), time.clock()
+
+    def leave(self, token, phase_stats, items=1):
+        wall = time.time() - token[0]
+        cpu = time.clock() - token[1]
+        nested_wall, nested_cpu = self._nested.pop()
+        if self._nested:
+            parent = self._nested[-1]
+            parent[0] += wall
+            parent[1] += cpu
+        phase_stats.add(wall - nested_wall, cpu - nested_cpu, items)
+
+    def collect(self):
+        """Return the data gathered so far and reset.
+
+        Used to ship data from worker processes to the parent, which
+        feeds it to L{merge}.
+        """
+        return dict((name, stats.detach())
+                    for name, stats in self.stats.iteritems())
+
+    def merge(self, stats):
+        for name, other in stats.iteritems():
+            ours = self.stats.get(name)
+            if ours is None:
+                self.stats[name] = other
+            else:
+                ours.merge(other)
+
+    def sorted_stats(self):
+        return sorted(self.stats.itervalues(),
+                      key=lambda x: (-x.wall, x.name))
+
+    def dump(self):
+        """Return the gathered data as a json serializable structure."""
+        checks = []
+        for stats in self.sorted_stats():
+            d = dict(name=stats.name, kind=stats.kind)
+            for phase in phases:
+                d[phase] = getattr(stats, phase).summary()
+            checks.append(d)
+        return dict(timestamp=time.time(), checks=checks)
+
+    def write_table(self, out):
+        """Write a table sorted by total wall clock time to a formatter."""
+        out.write('%-55s %-9s %8s %9s %9s %9s %9s %9s' % (
+            'check', 'kind', 'items', 'wall(s)', 'cpu(s)',
+            'mean(ms)', 'p95(ms)', 'max(ms)'))
+        for stats in self.sorted_stats():
+            feed = stats.feed.summary()
+            out.write('%-55s %-9s %8i %9.3f %9.3f %9.3f %9.3f %9.3f' % (
+                stats.name, stats.kind, feed['calls'], stats.wall, stats.cpu,
+                feed['mean'] * 1000, feed['p95'] * 1000, feed['max'] * 1000))
@@ -31,6 +31,7 @@ class UnstableOnlyReport(StableCheckAddon):
     """scan for pkgs that have just unstable keywords"""
 
     feed_type = package_feed
+    result_cache_version = 1
     required_addons = (ArchesAddon,)
     known_results = (UnstableOnly,)
 
@@ -61,6 +62,3 @@ class UnstableOnlyReport(StableCheckAddon):
             unstable = [x for x in pkgset if v[1].match(x)]
             if unstable:
                 reporter.add_report(UnstableOnly(unstable, k))
-
-    def finish(self, reporter):
-        self.arch_restricts.clear()
@@ -0,0 +1,198 @@
+# License: BSD/GPL2
+
+"""Limit scans to what changed in a git work tree since a given ref.
+
+Changed paths are mapped to what needs scanning:
+
+ - anything under a category/package dir: that package;
+ - a category's metadata.xml: that category (category checks only see it
+   if scanned on its own, so this gets a separate limiter);
+ - an eclass: the packages inheriting it;
+ - a file of a profile listed in profiles.desc (or of one of its
+   parents), directories of files like package.mask/ included: the
+   packages keyworded for the arch of that profile, with only the
+   profile dependent checks (visibility and such).
+
+Everything else (metadata/, licenses/...) is ignored.
+"""
+
+import os
+
+from pkgcore.restrictions import packages, values
+
+from pkgcore_checks import errors
+
+from snakeoil.demandload import demandload
+demandload(
+    'subprocess',
+    'pkgcore_checks:profile_cache',
+)
+
+
+def git(path, *args):
+    """Run git in path and return its output.
+
+    :raise errors.VCSError: if git is missing or fails.
+    """
+    try:
+        proc = subprocess.Popen(
+            ('git',) + args, cwd=path,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except EnvironmentError, e:
+        raise errors.VCSError('failed running git: %s' % (e,))
+    stdout, stderr = proc.communicate()
+    if proc.returncode:
+        raise errors.VCSError('git %s failed: %s' % (
+            args[0], stderr.strip() or 'exit status %i' % (proc.returncode,)))
+    return stdout
+
+
+def changed_paths(path, ref):
+    """Return the paths changed in the work tree at path since ref.
+
+    Staged, unstaged and untracked (but not ignored) files are included.
+    Paths are relative to path, which does not have to be the top of the
+    git work tree.
+    """
+    changed = set()
+    changed.update(git(
+        path, 'diff', '--name-only', '--no-renames', '--relative', '-z',
+        ref, '--').split('\0'))
+    changed.update(git(
+        path, 'ls-files', '--others', '--exclude-standard', '-z').split('\0'))
+    changed.discard('')
+    return sorted(changed)
+
+
+def arch_profile_dirs(profiles_obj):
+    """Map the arches of profiles.desc to the dirs of their profile stacks.
+
+    :param profiles_obj: a L{pkgcore.ebuild.repo_objs.BundledProfiles}.
+    :return: dict mapping arches to sets of dirs relative to the repo base.
+    """
+    repo_base = os.path.dirname(profiles_obj.profile_base.rstrip('/'))
+    result = {}
+    for arch, known in profiles_obj.arch_profiles.iteritems():
+        dirs = result.setdefault(arch, set())
+        for x in known:
+            for node in profiles_obj.create_profile(x.profile).stack:
+                path = getattr(node, 'path', None)
+                if path is not None:
+                    dirs.add(os.path.relpath(path, repo_base))
+    return result
+
+
+class Changes(object):
+
+    """What a set of changed paths touches, see L{from_paths}."""
+
+    def __init__(self):
+        # (category, package) tuples.
+        self.packages = set()
+        self.categories = set()
+        self.eclasses = set()
+        self.arches = set()
+
+    @classmethod
+    def from_paths(cls, paths, categories, arch_dirs):
+        """Map changed paths (relative to the repo base) to changes.
+
+        :param categories: the categories of the repo.
+        :param arch_dirs: mapping of arches to profile dirs, see
+            L{arch_profile_dirs}.
+        """
+        changes = cls()
+        for path in paths:
+            bits = path.split('/')
+            if bits[0] in categories:
+                if len(bits) > 2:
+                    changes.packages.add((bits[0], bits[1]))
+                elif bits[1:] == ['metadata.xml']:
+                    changes.categories.add(bits[0])
+            elif bits[0] == 'eclass' and len(bits) == 2 and \
+                    bits[1].endswith('.eclass'):
+                changes.eclasses.add(bits[1][:-len('.eclass')])
+            elif bits[0] == 'profiles':
+                # Files in directories of files (package.mask/ and such)
+                # belong to the profile holding that directory.
+                for index, bit in enumerate(bits[:-1]):
+                    if bit in profile_cache.dir_files:
+                        del bits[index + 1:]
+                        break
+                dirname = '/'.join(bits[:-1])
+                changes.arches.update(
+                    arch for arch, dirs in arch_dirs.iteritems()
+                    if dirname in dirs)
+        return changes
+
+    def __nonzero__(self):
+        return bool(
+            self.packages or self.categories or self.eclasses or self.arches)
+
+
+def _package_restriction(category, package):
+    return packages.AndRestriction(
+        packages.PackageRestriction('category', values.StrExactMatch(category)),
+        packages.PackageRestriction('package', values.StrExactMatch(package)))
+
+
+def _combine(restrictions):
+    restrictions = list(restrictions)
+    if not restrictions:
+        return None
+    if len(restrictions) == 1:
+        return restrictions[0]
+    return packages.OrRestriction(*restrictions)
+
+
+def _matching_packages(repo, restriction):
+    return set((pkg.category, pkg.package)
+               for pkg in repo.itermatch(restriction))
+
+
+def limiters(repo, changes):
+    """Build the limiters to scan changes with.
+
+    Eclass and arch changes are expanded to the matching packages here so
+    the limiters stay package scoped; a limiter on, say, the inherited
+    eclasses alone would make repository wide checks run on a partial
+    repository.
+
+    :return: a list of limiters for all checks (one for the changed
+        packages, one for the changed categories) and a limiter for the
+        profile dependent checks only, or C{None}.
+    """
+    keys = set(changes.packages)
+    if changes.eclasses:
+        keys.update(_matching_packages(repo, packages.PackageRestriction(
+            'inherited', values.ContainmentMatch(*changes.eclasses))))
+    # Packages in changed categories get scanned with those.
+    keys = set(key for key in keys if key[0] not in changes.categories)
+    result = []
+    limiter = _combine(_package_restriction(*key) for key in sorted(keys))
+    if limiter is not None:
+        result.append(limiter)
+    limiter = _combine(
+        packages.PackageRestriction('category', values.StrExactMatch(category))
+        for category in sorted(changes.categories))
+    if limiter is not None:
+        result.append(limiter)
+
+    profile_limiter = None
+    if changes.arches:
+        keywords = set(changes.arches)
+        keywords.update('~%s' % (arch,) for arch in changes.arches)
+        profile_keys = _matching_packages(repo, packages.PackageRestriction(
+            'keywords', values.ContainmentMatch(*keywords)))
+        profile_limiter = _combine(
+            _package_restriction(*key)
+            for key in sorted(profile_keys - keys)
+            if key[0] not in changes.categories)
+    return result, profile_limiter
+
+
+def changes_since(repo, profiles_obj, ref):
+    """Return the L{Changes} to the work tree of repo since ref."""
+    return Changes.from_paths(
+        changed_paths(repo.location, ref), frozenset(repo.categories),
+        arch_profile_dirs(profiles_obj))
@@ -187,6 +187,7 @@ class VisibilityReport(base.Template):
                 self.check_visibility_vcs(pkg, reporter)
                 break
 
+        hits = misses = insoluble_hits = 0
         for attr, depset in (("depends", pkg.depends),
                              ("rdepends", pkg.rdepends),
                              ("post_rdepends", pkg.post_rdepends)):
@@ -195,7 +196,9 @@ class VisibilityReport(base.Template):
 
                 node = strip_atom_use(orig_node)
                 if node not in self.query_cache:
+                    misses += 1
                     if node in self.profiles.global_insoluble:
+                        insoluble_hits += 1
                         nonexistent.add(node)
                         # insert an empty tuple, so that tight loops further
                         # on don't have to use the slower get method
@@ -212,13 +215,20 @@ class VisibilityReport(base.Template):
                             nonexistent.add(node)
                             self.query_cache[node] = ()
                             self.profiles.global_insoluble.add(node)
-                elif not self.query_cache[node]:
-                    nonexistent.add(node)
+                else:
+                    hits += 1
+                    if not self.query_cache[node]:
+                        nonexistent.add(node)
 
             if nonexistent:
                 reporter.add_report(NonExistentDeps(pkg, attr, nonexistent))
 
         del nonexistent
+        addons.query_cache_lookups.inc(hits, ('hit',))
+        addons.query_cache_lookups.inc(misses, ('miss',))
+        addons.global_insoluble_lookups.inc(insoluble_hits, ('hit',))
+        addons.global_insoluble_lookups.inc(
+            misses - insoluble_hits, ('miss',))
 
         for attr, depset in (("depends", pkg.depends),
                              ("rdepends", pkg.rdepends),
@@ -226,14 +236,27 @@ class VisibilityReport(base.Template):
             for edepset, profiles in self.depset_cache.collapse_evaluate_depset(pkg, attr, depset):
                 self.process_depset(pkg, attr, edepset, profiles, reporter)
 
+    def finish(self, reporter):
+        addons.global_insoluble_entries.set(
+            len(self.profiles.global_insoluble))
+
     def check_visibility_vcs(self, pkg, reporter):
-        for key, profiles in self.profiles.profile_filters.iteritems():
+        # only the profiles of the stable keywords of pkg can see it; don't
+        # load the others.
+        for key in sorted(set(pkg.keywords)):
             if key.startswith("~") or key.startswith("-"):
                 continue
+            profiles = self.profiles.profile_filters.get(key)
+            if profiles is None:
+                continue
             for profile in profiles:
+                if not profile.members:
+                    # reported along with the first profile of its class.
+                    continue
                 if profile.visible(pkg):
-                    reporter.add_report(VisibleVcsPkg(
-                        pkg, profile.key, profile.name))
+                    for member in profile.members:
+                        reporter.add_report(VisibleVcsPkg(
+                            pkg, member.key, member.name))
 
     def process_depset(self, pkg, attr, depset, profiles, reporter):
         get_cached_query = self.query_cache.get
@@ -246,6 +269,8 @@ class VisibilityReport(base.Template):
             else:
                 csolutions.append(required)
 
+        # (visible hits, visible misses, insoluble hits, insoluble misses)
+        counts = [0, 0, 0, 0]
         for profile in profiles:
             failures = set()
             # is it visible?  ie, is it masked?
@@ -260,13 +285,17 @@ class VisibilityReport(base.Template):
                 # scan all of the quickies, the caches...
                 for node in required:
                     if node in cache:
+                        counts[0] += 1
                         break
                     elif provided(node):
                         break
                 else:
+                    counts[1] += 1
                     for node in required:
                         if node in insoluble:
-                            pass
+                            counts[2] += 1
+                        else:
+                            counts[3] += 1
 
                         # get is required since there is an intermix between old style
                         # virtuals and new style- thus the cache priming doesn't get
@@ -284,5 +313,11 @@ class VisibilityReport(base.Template):
                         # no matches.  not great, should collect them all
                         failures.update(required)
             if failures:
-                reporter.add_report(NonsolvableDeps(
-                    pkg, attr, profile.key, profile.name, list(failures)))
+                for member in profile.members:
+                    reporter.add_report(NonsolvableDeps(
+                        pkg, attr, member.key, member.name, list(failures)))
+        lookups = addons.profile_cache_lookups
+        for key, count in zip((('visible', 'hit'), ('visible', 'miss'),
+                               ('insoluble', 'hit'), ('insoluble', 'miss')),
+                              counts):
+            lookups.inc(count, key)
@@ -106,6 +106,7 @@ class WhitespaceCheck(base.Template):
     """checking ebuild for (useless) whitespaces"""
 
     feed_type = base.ebuild_feed
+    result_cache_version = 1
     known_results = (
         WhitespaceFound, WrongIndentFound, DoubleEmptyLine,
         TrailingEmptyLine, NoFinalNewline)